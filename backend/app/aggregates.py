@@ -0,0 +1,57 @@
+"""
+Cache degli aggregati per analisi (overview, marketing, trend): il risultato JSON di ogni endpoint resta valido
+finché non cambia la versione dei dati da cui è calcolato. Un'analisi non cambia dopo l'upload (nuovi dati =
+nuovo upload = nuovo analysis_id); cambia solo il segmento visualizzato, con il feedback operatore: la versione
+è quindi la versione del feedback dell'analisi. Una voce con versione diversa viene ricalcolata alla richiesta.
+Le voci di un'analisi vengono scartate quando lo store la rilascia.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+# Voci per analisi (endpoint x parametri), le meno recenti scartate oltre il limite
+MAX_ENTRIES_PER_ANALYSIS = 64
+
+
+class AggregateCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES_PER_ANALYSIS):
+        self.max_entries = max_entries
+        self._entries: dict[str, OrderedDict[Hashable, tuple[Hashable, Any]]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, analysis_id: str, key: Hashable, version: Hashable, compute: Callable[[], Any]) -> Any:
+        """Risultato di compute() per (analisi, key) alla versione data, calcolato solo se manca o è superato."""
+        with self._lock:
+            entries = self._entries.setdefault(analysis_id, OrderedDict())
+            cached = entries.get(key)
+            if cached is not None and cached[0] == version:
+                entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return cached[1]
+            self._counters["misses"] += 1
+            if cached is not None:
+                self._counters["invalidations"] += 1
+        value = compute()  # fuori dal lock: richieste concorrenti sulla stessa voce calcolano lo stesso risultato
+        with self._lock:
+            entries = self._entries.setdefault(analysis_id, OrderedDict())
+            entries[key] = (version, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return value
+
+    def evict(self, analysis_id: str) -> None:
+        with self._lock:
+            self._entries.pop(analysis_id, None)
+
+    def stats(self) -> dict:
+        """Contatori del processo corrente (ogni worker gunicorn ha la sua cache)."""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "analyses": len(self._entries),
+                "entries": sum(len(e) for e in self._entries.values()),
+            }
@@ -0,0 +1,345 @@
+"""
+Contenitore colonnare di un'analisi: al posto di una lista di SegmentedCustomer, un array NumPy per campo.
+- numeri: array compatti (int8..int64 / float64) con maschera dei valori mancanti;
+- stringhe ripetute (canale, giorno, data arrivo, camera, prenotante): codici interi + elenco categorie;
+- stringhe libere (cliente_id, nome): byte UTF-8 concatenati + offset;
+- segmento: int8 (codice in SEGMENTS_BY_CODE), punteggi: matrice int16 (righe × 4);
+- indice row_index → posizione, costruito con l'analisi (vedi row_index_lookup);
+- posting list per segmento: posizioni ordinate per segmento e offset per codice (vedi segment_postings).
+Tutti i dati stanno in `arrays` (nome → ndarray) e `categories`: le aggregazioni lavorano sulle colonne,
+gli endpoint di dettaglio leggono viste riga (customer(pos) → SegmentedCustomer).
+`meta` conserva i dati dell'elaborazione (soglie spesa, file, versione scoring) salvati con l'analisi.
+`derived` tiene i dati calcolati al primo uso (ordinamenti, indici): vivono finché l'analisi resta aperta.
+"""
+from typing import Any, Hashable, Iterable, Mapping, Optional
+
+import numpy as np
+
+from app.models import Scores, SegmentedCustomer, SEGMENT_CODES, SEGMENTS_BY_CODE
+
+INT_FIELDS = ("numero_notti", "numero_ospiti", "storico_soggiorni", "anticipo_giorni", "numero_bambini")
+FLOAT_FIELDS = ("spesa_media", "revenue")
+CATEGORY_FIELDS = ("canale", "giorno_arrivo", "data_arrivo", "categoria_camera", "prenotante")
+TEXT_FIELDS = ("cliente_id", "nome_cliente")
+SCORE_FIELDS = ("business", "leisure", "coppia", "famiglia")
+
+_INT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+# Indice diretto row_index → posizione se i row_index coprono un intervallo al massimo così più ampio delle righe
+_DIRECT_LOOKUP_SPAN = 4
+
+
+def _downcast(arr: np.ndarray) -> np.ndarray:
+    """Array int64 nel dtype intero più piccolo che contiene i suoi valori."""
+    if not len(arr):
+        return arr.astype(np.int8)
+    lo, hi = int(arr.min()), int(arr.max())
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return arr.astype(dtype)
+    return arr
+
+
+def _compact_ints(values: list) -> np.ndarray:
+    """Interi (None → 0) nel dtype più piccolo; oltre int64 (valori enormi dal file) resta object."""
+    filled = [0 if v is None else v for v in values]
+    try:
+        arr = np.array(filled, dtype=np.int64)
+    except OverflowError:
+        return np.array(filled, dtype=object)
+    return _downcast(arr)
+
+
+def row_index_lookup(row_index: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Indice per position(): tabella diretta "row_index.lookup" (posizione per row_index, -1 = assente)
+    se i row_index sono piccoli e densi, come quelli numerati dall'ingest; altrimenti "row_index.order"
+    (permutazione che ordina i row_index) per la ricerca binaria.
+    """
+    n = len(row_index)
+    if not n:
+        return {"row_index.lookup": np.empty(0, np.int32)}
+    lo, hi = int(row_index.min()), int(row_index.max())
+    if lo >= 0 and hi < _DIRECT_LOOKUP_SPAN * n + 1024:
+        table = np.full(hi + 1, -1, dtype=np.int32 if n < 2**31 else np.int64)
+        table[row_index[::-1]] = np.arange(n - 1, -1, -1)  # row_index ripetuti: vince la prima posizione
+        return {"row_index.lookup": table}
+    return {"row_index.order": np.argsort(row_index, kind="stable")}
+
+
+def segment_postings(segment: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    "segment.postings": posizioni raggruppate per codice segmento (in ordine di file dentro ogni gruppo);
+    "segment.offsets": inizio del gruppo di ogni codice (len = segmenti + 1), quindi conteggi = differenze.
+    """
+    postings = np.argsort(segment, kind="stable")
+    counts = np.bincount(segment, minlength=len(SEGMENTS_BY_CODE))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return {"segment.postings": postings.astype(np.int32 if len(segment) < 2**31 else np.int64), "segment.offsets": offsets}
+
+
+def _text_arrays(values: list[Optional[str]]) -> tuple[np.ndarray, np.ndarray]:
+    """Stringhe libere come byte UTF-8 concatenati + offset (n + 1); None → stringa vuota con maschera."""
+    encoded = [b"" if v is None else v.encode("utf-8", "surrogatepass") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class _Column:
+    """
+    Colonna che cresce a blocchi con ndarray.resize (realloc, senza copia per i blocchi grandi): niente lista di
+    blocchi da concatenare, quindi nessun momento con blocchi e colonna finale in memoria insieme.
+    Il dtype si allarga se un blocco non ci sta (es. int8 → int16, object per interi oltre int64).
+    """
+
+    __slots__ = ("data", "size")
+
+    def __init__(self, dtype, shape: tuple = ()):
+        self.data = np.empty((0, *shape), dtype=dtype)
+        self.size = 0
+
+    def append(self, arr: np.ndarray) -> None:
+        need = self.size + len(arr)
+        dtype = np.promote_types(self.data.dtype, arr.dtype)
+        if dtype != self.data.dtype:
+            self.data = self.data[:self.size].astype(dtype)
+        if need > len(self.data):
+            self.data.resize((max(need, len(self.data) * 3 // 2), *self.data.shape[1:]), refcheck=False)
+        self.data[self.size:need] = arr
+        self.size = need
+
+    def finish(self) -> np.ndarray:
+        self.data.resize((self.size, *self.data.shape[1:]), refcheck=False)
+        return self.data
+
+
+class AnalysisBuilder:
+    """
+    Costruisce una ColumnarAnalysis un blocco di SegmentedCustomer alla volta (i blocchi possono essere scartati):
+    ogni blocco diventa subito array compatti accodati alle colonne, nessun oggetto Python resta tra un blocco e l'altro.
+    """
+
+    def __init__(self):
+        columns = {"row_index": _Column(np.int8), "segment": _Column(np.int8),
+                   "scores": _Column(np.int16, (len(SCORE_FIELDS),))}
+        for f in INT_FIELDS:
+            columns[f], columns[f"{f}.null"] = _Column(np.int8), _Column(bool)
+        for f in FLOAT_FIELDS:
+            columns[f], columns[f"{f}.null"] = _Column(np.float64), _Column(bool)
+        for f in CATEGORY_FIELDS:
+            columns[f"{f}.codes"] = _Column(np.int16)
+        for f in TEXT_FIELDS:
+            columns[f"{f}.data"], columns[f"{f}.lengths"] = _Column(np.uint8), _Column(np.int8)
+            columns[f"{f}.null"] = _Column(bool)
+        self._columns = columns
+        self._encoders: dict[str, dict[str, int]] = {f: {} for f in CATEGORY_FIELDS}
+
+    def _append(self, name: str, arr: np.ndarray) -> None:
+        self._columns[name].append(arr)
+
+    def add(self, customers: list[SegmentedCustomer]) -> None:
+        n = len(customers)
+        if not n:
+            return
+        self._append("row_index", _downcast(np.fromiter((c.row_index for c in customers), dtype=np.int64, count=n)))
+        self._append("segment", np.fromiter((SEGMENT_CODES[c.segment] for c in customers), dtype=np.int8, count=n))
+        scores = np.array([(c.scores.business, c.scores.leisure, c.scores.coppia, c.scores.famiglia) for c in customers], dtype=np.int16)
+        self._append("scores", scores.reshape(n, len(SCORE_FIELDS)))
+        for f in INT_FIELDS:
+            values = [getattr(c, f) for c in customers]
+            self._append(f"{f}.null", np.fromiter((v is None for v in values), dtype=bool, count=n))
+            self._append(f, _compact_ints(values))
+        for f in FLOAT_FIELDS:
+            values = [getattr(c, f) for c in customers]
+            self._append(f"{f}.null", np.fromiter((v is None for v in values), dtype=bool, count=n))
+            self._append(f, np.fromiter((np.nan if v is None else v for v in values), dtype=np.float64, count=n))
+        for f in CATEGORY_FIELDS:
+            encoder = self._encoders[f]
+            codes = np.fromiter(
+                (-1 if (v := getattr(c, f)) is None else encoder.setdefault(v, len(encoder)) for c in customers),
+                dtype=np.int32,
+                count=n,
+            )
+            self._append(f"{f}.codes", codes.astype(np.int16) if len(encoder) < np.iinfo(np.int16).max else codes)
+        for f in TEXT_FIELDS:
+            values = [getattr(c, f) for c in customers]
+            self._append(f"{f}.null", np.fromiter((v is None for v in values), dtype=bool, count=n))
+            data, offsets = _text_arrays(values)
+            self._append(f"{f}.data", data)
+            self._append(f"{f}.lengths", _downcast(np.diff(offsets)))
+
+    def build(self) -> "ColumnarAnalysis":
+        arrays = {name: column.finish() for name, column in self._columns.items()}
+        self._columns = {}
+        for f in TEXT_FIELDS:
+            lengths = arrays.pop(f"{f}.lengths")
+            arrays[f"{f}.offsets"] = offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+        arrays.update(row_index_lookup(arrays["row_index"]))
+        arrays.update(segment_postings(arrays["segment"]))
+        categories = {f: list(enc) for f, enc in self._encoders.items()}
+        return ColumnarAnalysis(arrays, categories)
+
+
+class ColumnarAnalysis:
+    """Analisi in forma colonnare; le righe sono nell'ordine del file (posizione 0..n-1)."""
+
+    def __init__(self, arrays: Mapping[str, np.ndarray], categories: dict[str, list[str]], meta: Optional[dict] = None):
+        self.arrays = arrays
+        self.categories = categories
+        self.meta = meta if meta is not None else {}
+        self._lookup: Optional[dict[str, np.ndarray]] = None
+        self._segment_postings: Optional[dict[str, np.ndarray]] = None
+        self.derived: dict[Hashable, Any] = {}
+
+    @classmethod
+    def from_customers(cls, customers: Iterable[SegmentedCustomer]) -> "ColumnarAnalysis":
+        builder = AnalysisBuilder()
+        builder.add(list(customers))
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self.arrays["row_index"])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays.values())
+
+    # --- colonne ---
+
+    @property
+    def row_index(self) -> np.ndarray:
+        return self.arrays["row_index"]
+
+    @property
+    def segment(self) -> np.ndarray:
+        """Codici segmento (int8, posizione in SEGMENTS_BY_CODE)."""
+        return self.arrays["segment"]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """Punteggi (righe × 4, ordine SCORE_FIELDS)."""
+        return self.arrays["scores"]
+
+    def numbers(self, field: str) -> tuple[np.ndarray, np.ndarray]:
+        """(valori, maschera mancanti) di un campo numerico; i mancanti valgono 0 (interi) o NaN (float)."""
+        return self.arrays[field], self.arrays[f"{field}.null"]
+
+    def codes(self, field: str) -> np.ndarray:
+        """Codici di un campo categoria (-1 = mancante): valore = categories[field][codice]."""
+        return self.arrays[f"{field}.codes"]
+
+    def _postings(self) -> dict[str, np.ndarray]:
+        if "segment.offsets" in self.arrays:
+            return self.arrays
+        if self._segment_postings is None:  # analisi salvata prima delle posting list
+            self._segment_postings = segment_postings(self.segment)
+        return self._segment_postings
+
+    def segment_counts(self) -> np.ndarray:
+        """Clienti per codice segmento (del modello), dagli offset delle posting list."""
+        return np.diff(self._postings()["segment.offsets"])
+
+    def segment_positions(self, code: int) -> np.ndarray:
+        """Posizioni (in ordine di file) dei clienti con questo codice segmento: vista, nessuna copia."""
+        postings = self._postings()
+        offsets = postings["segment.offsets"]
+        return postings["segment.postings"][offsets[code]:offsets[code + 1]]
+
+    def position(self, row_index: int) -> Optional[int]:
+        """Posizione della riga con questo row_index (None se assente): O(1) con la tabella diretta."""
+        index = self.arrays
+        if "row_index.lookup" not in index and "row_index.order" not in index:
+            if self._lookup is None:  # analisi salvata prima dell'indice: costruito al primo uso
+                self._lookup = row_index_lookup(self.row_index)
+            index = self._lookup
+        if "row_index.lookup" in index:
+            table = index["row_index.lookup"]
+            if 0 <= row_index < len(table) and table[row_index] >= 0:
+                return int(table[row_index])
+            return None
+        order = index["row_index.order"]
+        k = int(np.searchsorted(self.row_index, row_index, sorter=order))
+        if k < len(order) and self.row_index[order[k]] == row_index:
+            return int(order[k])
+        return None
+
+    def positions(self, row_indexes: np.ndarray) -> np.ndarray:
+        """Posizioni di più row_index in un passaggio vettoriale (-1 dove assenti)."""
+        row_indexes = np.asarray(row_indexes, dtype=np.int64)
+        index = self.arrays
+        if "row_index.lookup" not in index and "row_index.order" not in index:
+            if self._lookup is None:
+                self._lookup = row_index_lookup(self.row_index)
+            index = self._lookup
+        out = np.full(len(row_indexes), -1, dtype=np.int64)
+        if "row_index.lookup" in index:
+            table = index["row_index.lookup"]
+            inside = (row_indexes >= 0) & (row_indexes < len(table))
+            out[inside] = table[row_indexes[inside]]
+            return out
+        order = index["row_index.order"]
+        if len(order):
+            k = np.minimum(np.searchsorted(self.row_index, row_indexes, sorter=order), len(order) - 1)
+            found = self.row_index[order[k]] == row_indexes
+            out[found] = order[k[found]]
+        return out
+
+    # --- viste riga ---
+
+    def _number(self, field: str, pos: int) -> Any:
+        if self.arrays[f"{field}.null"][pos]:
+            return None
+        v = self.arrays[field][pos]
+        return v if isinstance(v, int) else v.item()
+
+    def _category(self, field: str, pos: int) -> Optional[str]:
+        code = self.arrays[f"{field}.codes"][pos]
+        return self.categories[field][code] if code >= 0 else None
+
+    def _text(self, field: str, pos: int) -> Optional[str]:
+        if self.arrays[f"{field}.null"][pos]:
+            return None
+        offsets = self.arrays[f"{field}.offsets"]
+        raw = self.arrays[f"{field}.data"][offsets[pos]:offsets[pos + 1]]
+        return raw.tobytes().decode("utf-8", "surrogatepass")
+
+    def customer(self, pos: int) -> SegmentedCustomer:
+        """Vista riga: SegmentedCustomer ricostruito dalla posizione pos."""
+        b, le, co, fa = self.scores[pos].tolist()
+        fields = {f: self._number(f, pos) for f in INT_FIELDS + FLOAT_FIELDS}
+        fields.update({f: self._category(f, pos) for f in CATEGORY_FIELDS})
+        fields.update({f: self._text(f, pos) for f in TEXT_FIELDS})
+        return SegmentedCustomer(
+            row_index=int(self.row_index[pos]),
+            segment=SEGMENTS_BY_CODE[self.segment[pos]],
+            scores=Scores.of(b, le, co, fa),
+            **fields,
+        )
+
+    def customers(self, positions: Iterable[int]) -> list[SegmentedCustomer]:
+        return [self.customer(int(p)) for p in positions]
+
+
+def effective_revenues(analysis: ColumnarAnalysis) -> np.ndarray:
+    """Revenue per riga: campo revenue o, se mancante, spesa_media * numero_notti (0 se non calcolabile)."""
+    revenue, revenue_null = analysis.numbers("revenue")
+    spesa, spesa_null = analysis.numbers("spesa_media")
+    notti, notti_null = analysis.numbers("numero_notti")
+    use_revenue = ~revenue_null & (revenue > 0)
+    use_spesa = ~use_revenue & ~spesa_null & ~notti_null & (notti > 0)
+    return np.where(use_revenue, revenue, np.where(use_spesa, spesa * notti.astype(np.float64), 0.0))
+
+
+def effective_adrs(analysis: ColumnarAnalysis) -> np.ndarray:
+    """ADR per riga: spesa_media o, se mancante, revenue / numero_notti (0 se non calcolabile)."""
+    revenue, revenue_null = analysis.numbers("revenue")
+    spesa, spesa_null = analysis.numbers("spesa_media")
+    notti, notti_null = analysis.numbers("numero_notti")
+    use_spesa = ~spesa_null & (spesa > 0)
+    use_revenue = ~use_spesa & ~revenue_null & ~notti_null & (notti > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_night = revenue / notti.astype(np.float64)
+    return np.where(use_spesa, spesa, np.where(use_revenue, per_night, 0.0))
@@ -3,13 +3,17 @@ Parsing file Excel arrivi clienti.
 Supporta colonne con nomi italiani o inglesi, flessibile su naming.
 """
 import re
+import sys
+import threading
 from datetime import datetime
-from typing import Any
+from functools import partial
+from typing import Any, Callable
 
+import numpy as np
 import pandas as pd
 
-from app.models import SegmentedCustomer, Segment, Scores
-from app.scoring import compute_scores, assign_segment
+from app.models import SegmentedCustomer, Segment, Scores, SEGMENTS_BY_CODE
+from app.scoring import compute_scores, assign_segment, compute_scores_batch
 
 
 # Possibili alias per colonne Excel (italiano / inglese). L'ordine delle colonne nel file non conta.
@@ -60,9 +64,12 @@ def _map_columns(df: pd.DataFrame) -> dict[str, str]:
     return out
 
 
-def _get_day_name(val: Any) -> str:
+_DAYS = ["lun", "mar", "mer", "gio", "ven", "sab", "dom"]
+
+
+def _get_day_name(val: Any, fmt: str | None = None) -> str:
     """Da data o numero 0-6 o stringa giorno restituisce abbreviazione Lun/Mar/..."""
-    days = ["lun", "mar", "mer", "gio", "ven", "sab", "dom"]
+    days = _DAYS
     if pd.isna(val):
         return ""
     if isinstance(val, (int, float)):
@@ -74,7 +81,7 @@ def _get_day_name(val: Any) -> str:
         return days[val.weekday()]
     s = str(val).strip().lower()
     # Prima prova a interpretare come data (es. "2024-06-15"): così non restituiamo "202"
-    dt = _parse_date(val)
+    dt = _parse_date(val, fmt)
     if dt is not None:
         return days[dt.weekday()]
     # Stringa numerica (es. "202" da Excel): usa come numero giorno
@@ -89,12 +96,21 @@ def _get_day_name(val: Any) -> str:
     return s
 
 
-def _parse_date(val: Any) -> datetime | None:
-    """Converte valore in datetime (accetta Excel, stringhe DD/MM/YYYY, YYYY-MM-DD, ecc.)."""
+def _parse_date(val: Any, fmt: str | None = None) -> datetime | None:
+    """
+    Converte valore in datetime (accetta Excel, stringhe DD/MM/YYYY, YYYY-MM-DD, ecc.).
+    fmt: formato dedotto per la colonna (vedi _infer_date_format), provato per primo sulle stringhe di sola data;
+    con orario decide pd.to_datetime sul valore intero, che lo conserva (notti e anticipo contano le ore).
+    """
     if val is None or pd.isna(val):
         return None
     if isinstance(val, datetime):
         return val
+    if fmt is not None and isinstance(val, str) and len(val.strip()) <= 10:
+        try:
+            return datetime.strptime(val.strip(), fmt)
+        except ValueError:
+            pass
     try:
         dt = pd.to_datetime(val)
         if hasattr(dt, "to_pydatetime"):
@@ -111,31 +127,93 @@ def _parse_date(val: Any) -> datetime | None:
     return None
 
 
-def _nights_from_dates(arrivo: Any, partenza: Any) -> int | None:
+def _nights_from_dates(arrivo: Any, partenza: Any, fmt_arrivo: str | None = None, fmt_partenza: str | None = None) -> int | None:
     """Calcola numero notti da data arrivo e data partenza (se entrambe presenti)."""
-    d1 = _parse_date(arrivo)
-    d2 = _parse_date(partenza)
+    d1 = _parse_date(arrivo, fmt_arrivo)
+    d2 = _parse_date(partenza, fmt_partenza)
     if d1 is None or d2 is None:
         return None
     delta = (d2 - d1).days
     return max(0, delta) if isinstance(delta, int) else max(0, int(delta))
 
 
-def _is_vacation_period(val: Any) -> bool:
+MESI_VACANZA = (1, 6, 7, 8, 12)
+
+
+def _is_vacation_period(val: Any, fmt: str | None = None) -> bool:
     if pd.isna(val):
         return False
-    dt = _parse_date(val)
-    return dt.month in (1, 6, 7, 8, 12) if dt else False
+    dt = _parse_date(val, fmt)
+    return dt.month in MESI_VACANZA if dt else False
+
 
+# Colonne logiche che contengono (o possono contenere) date
+DATE_KEYS = ("data_arrivo", "data_partenza", "data_prenotazione", "giorno_arrivo")
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}$")
+_DMY_DATE_RE = re.compile(r"^(\d{1,2})([/.-])(\d{1,2})\2(\d{4})$")
+_DATE_SAMPLE_SIZE = 200
 
-def parse_and_segment(df: pd.DataFrame) -> tuple[list[SegmentedCustomer], float | None]:
+
+def _infer_date_format(sample: list[str]) -> str | None:
     """
-    Legge il DataFrame (da Excel), segmenta ogni riga, restituisce lista SegmentedCustomer
-    e soglia spesa top 25% (per scoring Premium).
+    Deduce il formato data di una colonna da un campione di valori distinti (stringhe, primi 10 caratteri).
+    ISO (YYYY-MM-DD, anche con orario) → "%Y-%m-%d"; GG/MM/AAAA → "%d/%m/%Y" se qualche giorno > 12
+    (analogo per MM/GG e per i separatori "-" e "."). Se il campione è misto o ambiguo restituisce None
+    e ogni valore viene interpretato singolarmente da _parse_date.
     """
-    if df.empty:
-        return [], None
+    if not sample:
+        return None
+    if all(_ISO_DATE_RE.match(s) for s in sample):
+        return "%Y-%m-%d"
+    matches = [_DMY_DATE_RE.match(s) for s in sample]
+    if not all(matches) or len({m.group(2) for m in matches}) != 1:
+        return None
+    sep = matches[0].group(2)
+    first_gt12 = any(int(m.group(1)) > 12 for m in matches)
+    second_gt12 = any(int(m.group(3)) > 12 for m in matches)
+    if first_gt12 and not second_gt12:
+        return f"%d{sep}%m{sep}%Y"
+    if second_gt12 and not first_gt12:
+        return f"%m{sep}%d{sep}%Y"
+    return None
+
+
+class DateFormatSampler:
+    """Raccoglie i primi valori distinti (stringhe) delle colonne data, anche da più blocchi dello stesso file."""
+
+    def __init__(self, col_map: dict[str, str]):
+        self.col_map = col_map
+        self.samples: dict[str, dict[str, None]] = {key: {} for key in DATE_KEYS if key in col_map}
+
+    def add(self, df: pd.DataFrame) -> None:
+        for key, sample in self.samples.items():
+            col = self.col_map[key]
+            if len(sample) >= _DATE_SAMPLE_SIZE or col not in df.columns:
+                continue
+            for v in pd.unique(df[col].dropna().to_numpy(dtype=object)):
+                if isinstance(v, str) and v.strip():
+                    sample.setdefault(v.strip()[:10])
+                    if len(sample) >= _DATE_SAMPLE_SIZE:
+                        break
+
+    def formats(self) -> dict[str, str]:
+        out = {}
+        for key, sample in self.samples.items():
+            fmt = _infer_date_format(list(sample))
+            if fmt is not None:
+                out[key] = fmt
+        return out
 
+
+def infer_date_formats(df: pd.DataFrame, col_map: dict[str, str]) -> dict[str, str]:
+    """Formato data dedotto per ogni colonna logica di DATE_KEYS presente nel file."""
+    sampler = DateFormatSampler(col_map)
+    sampler.add(df)
+    return sampler.formats()
+
+
+def resolve_col_map(df: pd.DataFrame) -> dict[str, str]:
+    """Mappa colonne con alias; se nessuna colonna è riconosciuta usa l'ordine posizionale."""
     col_map = _map_columns(df)
     if not col_map:
         # Fallback: usa prima riga come header se necessario, oppure colonne 0,1,2...
@@ -163,8 +241,59 @@ def parse_and_segment(df: pd.DataFrame) -> tuple[list[SegmentedCustomer], float
                 col_map["prenotante"] = c
             elif i == 10:
                 col_map["numero_bambini"] = c
+    return col_map
+
+
+def spend_series(df: pd.DataFrame, col_map: dict[str, str]) -> pd.Series | None:
+    """
+    Spesa per notte usata per soglia top 25% e media (valori validi, NaN esclusi).
+    Se il file ha "totale" (costo soggiorno) ma non "spesa media", la calcoliamo come totale/giorni.
+    """
+    spesa_col = col_map.get("spesa_media")
+    totale_col = col_map.get("totale_soggiorno")
+    notti_col = col_map.get("numero_notti")
+    if spesa_col and spesa_col in df.columns:
+        return pd.to_numeric(df[spesa_col], errors="coerce").dropna()
+    if totale_col and totale_col in df.columns and notti_col and notti_col in df.columns:
+        totali = pd.to_numeric(df[totale_col], errors="coerce")
+        notti_ser = pd.to_numeric(df[notti_col], errors="coerce").replace(0, float("nan"))
+        return (totali / notti_ser).dropna()
+    return None
+
+
+def spend_stats(series: pd.Series | None) -> tuple[float | None, float | None]:
+    """Soglia top 25% e media spesa (per capacità sopra/sotto media)."""
+    threshold_top25 = None
+    media_spesa = None
+    try:
+        if series is not None and not series.empty:
+            threshold_top25 = float(series.quantile(0.75))
+            media_spesa = float(series.mean())
+    except Exception:
+        pass
+    return threshold_top25, media_spesa
+
 
-    def get(row: pd.Series, key: str, default: Any = None):
+def _spend_stats(df: pd.DataFrame, col_map: dict[str, str]) -> tuple[float | None, float | None]:
+    try:
+        series = spend_series(df, col_map)
+    except Exception:
+        return None, None
+    return spend_stats(series)
+
+
+def _segment_row(
+    row: pd.Series,
+    i: int,
+    col_map: dict[str, str],
+    threshold_top25: float | None,
+    media_spesa: float | None,
+    date_formats: dict[str, str] | None = None,
+) -> SegmentedCustomer:
+    """Segmenta una singola riga. Solleva eccezione se la riga non è interpretabile (il chiamante la salta)."""
+    fmt = (date_formats or {}).get
+
+    def get(key: str, default: Any = None):
         col = col_map.get(key)
         if col is None or col not in row:
             return default
@@ -173,159 +302,663 @@ def parse_and_segment(df: pd.DataFrame) -> tuple[list[SegmentedCustomer], float
             return default
         return v
 
-    # Soglia top 25% e media spesa (per capacità sopra/sotto media)
-    # Se il file ha "totale" (costo soggiorno) ma non "spesa media", la calcoliamo come totale/giorni
-    threshold_top25 = None
-    media_spesa = None
-    try:
-        spesa_col = col_map.get("spesa_media")
-        totale_col = col_map.get("totale_soggiorno")
-        notti_col = col_map.get("numero_notti")
-        if spesa_col and spesa_col in df.columns:
-            series = pd.to_numeric(df[spesa_col], errors="coerce").dropna()
-            if not series.empty:
-                threshold_top25 = float(series.quantile(0.75))
-                media_spesa = float(series.mean())
-        elif totale_col and totale_col in df.columns and notti_col and notti_col in df.columns:
-            totali = pd.to_numeric(df[totale_col], errors="coerce")
-            notti_ser = pd.to_numeric(df[notti_col], errors="coerce").replace(0, float("nan"))
-            series = (totali / notti_ser).dropna()
-            if not series.empty:
-                threshold_top25 = float(series.quantile(0.75))
-                media_spesa = float(series.mean())
-    except Exception:
-        pass
+    notti = int(pd.to_numeric(get("numero_notti", 0), errors="coerce") or 0)
+    if notti <= 0:
+        calc = _nights_from_dates(get("data_arrivo"), get("data_partenza"), fmt("data_arrivo"), fmt("data_partenza"))
+        if calc is not None:
+            notti = calc
+    # Ospiti: da colonna unica "numero_ospiti" oppure Interi + scontati (adulti + bambini)
+    adulti_val = get("numero_adulti")
+    bambini_col_val = get("numero_bambini")
+    numero_bambini_from_col: int | None = None  # valorizzato se usiamo Interi/scontati
+    if adulti_val is not None or bambini_col_val is not None:
+        adulti = int(pd.to_numeric(adulti_val, errors="coerce") or 0)
+        bambini_num = 0
+        if bambini_col_val is not None:
+            s = str(bambini_col_val).strip().lower()
+            if s in ("sì", "si", "yes", "1", "x", "ok"):
+                bambini_num = 1
+            elif s not in ("no", "0", ""):
+                try:
+                    bambini_num = int(pd.to_numeric(bambini_col_val, errors="coerce") or 0)
+                except (TypeError, ValueError):
+                    pass
+        numero_bambini_from_col = bambini_num
+        ospiti = adulti + bambini_num
+    else:
+        ospiti = int(pd.to_numeric(get("numero_ospiti", 0), errors="coerce") or 0)
+    canale = str(get("canale", "") or "")
+    # Se il file ha solo "Prenotante" (agenzia) e non "canale", usalo come canale per la dashboard
+    if not canale:
+        prenotante_raw = get("prenotante")
+        if prenotante_raw is not None:
+            canale = str(prenotante_raw).strip()
+    giorno_raw, giorno_fmt = get("giorno_arrivo"), fmt("giorno_arrivo")
+    if not giorno_raw:
+        giorno_raw, giorno_fmt = get("data_arrivo"), fmt("data_arrivo")
+    giorno = _get_day_name(giorno_raw, giorno_fmt)
+    spesa = _norm_float(get("spesa_media"))
+    totale_val = _norm_float(get("totale_soggiorno"))
+    # Se c'è "totale" (costo soggiorno) e non abbiamo spesa per notte, ricavala: totale / giorni
+    if spesa is None and notti > 0 and totale_val is not None and totale_val > 0:
+        spesa = round(totale_val / notti, 2)
+    cat_camera = str(get("categoria_camera", "") or "")
+    data_arrivo_raw = get("data_arrivo")
+    data_arrivo = None
+    if data_arrivo_raw is not None:
+        dt = _parse_date(data_arrivo_raw, fmt("data_arrivo"))
+        data_arrivo = dt.strftime("%Y-%m-%d") if dt else str(data_arrivo_raw).strip()[:10] or None
+    is_vacation = _is_vacation_period(data_arrivo_raw, fmt("data_arrivo"))
 
-    results: list[SegmentedCustomer] = []
-    for idx, row in df.iterrows():
+    # Anticipo: da colonna "anticipo_giorni" o da (data_arrivo - data_prenotazione)
+    anticipo_giorni = None
+    anticipo_val = get("anticipo_giorni")
+    if anticipo_val is not None:
         try:
-            i = int(idx) if isinstance(idx, (int, float)) else len(results)
-            notti = int(pd.to_numeric(get(row, "numero_notti", 0), errors="coerce") or 0)
-            if notti <= 0:
-                calc = _nights_from_dates(get(row, "data_arrivo"), get(row, "data_partenza"))
-                if calc is not None:
-                    notti = calc
-            # Ospiti: da colonna unica "numero_ospiti" oppure Interi + scontati (adulti + bambini)
-            adulti_val = get(row, "numero_adulti")
-            bambini_col_val = get(row, "numero_bambini")
-            numero_bambini_from_col: int | None = None  # valorizzato se usiamo Interi/scontati
-            if adulti_val is not None or bambini_col_val is not None:
-                adulti = int(pd.to_numeric(adulti_val, errors="coerce") or 0)
-                bambini_num = 0
-                if bambini_col_val is not None:
-                    s = str(bambini_col_val).strip().lower()
-                    if s in ("sì", "si", "yes", "1", "x", "ok"):
-                        bambini_num = 1
-                    elif s not in ("no", "0", ""):
-                        try:
-                            bambini_num = int(pd.to_numeric(bambini_col_val, errors="coerce") or 0)
-                        except (TypeError, ValueError):
-                            pass
-                numero_bambini_from_col = bambini_num
-                ospiti = adulti + bambini_num
+            anticipo_giorni = int(pd.to_numeric(anticipo_val, errors="coerce") or 0)
+        except (TypeError, ValueError):
+            pass
+    if anticipo_giorni is None:
+        dt_arr = _parse_date(get("data_arrivo"), fmt("data_arrivo"))
+        dt_pren = _parse_date(get("data_prenotazione"), fmt("data_prenotazione"))
+        if dt_arr and dt_pren and dt_pren <= dt_arr:
+            anticipo_giorni = (dt_arr - dt_pren).days
+
+    prenotante = str(get("prenotante", "") or "").strip() or None
+
+    numero_bambini = numero_bambini_from_col if numero_bambini_from_col is not None else None
+    if numero_bambini is None:
+        bambini_val = get("numero_bambini")
+        if bambini_val is not None:
+            s = str(bambini_val).strip().lower()
+            if s in ("sì", "si", "yes", "1", "x", "ok"):
+                numero_bambini = 1
+            elif s in ("no", "0", ""):
+                numero_bambini = 0
             else:
-                ospiti = int(pd.to_numeric(get(row, "numero_ospiti", 0), errors="coerce") or 0)
-            canale = str(get(row, "canale", "") or "")
-            # Se il file ha solo "Prenotante" (agenzia) e non "canale", usalo come canale per la dashboard
-            if not canale:
-                prenotante_raw = get(row, "prenotante")
-                if prenotante_raw is not None:
-                    canale = str(prenotante_raw).strip()
-            giorno_raw = get(row, "giorno_arrivo") or get(row, "data_arrivo")
-            giorno = _get_day_name(giorno_raw)
-            spesa = _norm_float(get(row, "spesa_media"))
-            totale_val = _norm_float(get(row, "totale_soggiorno"))
-            # Se c'è "totale" (costo soggiorno) e non abbiamo spesa per notte, ricavala: totale / giorni
-            if spesa is None and notti > 0 and totale_val is not None and totale_val > 0:
-                spesa = round(totale_val / notti, 2)
-            cat_camera = str(get(row, "categoria_camera", "") or "")
-            data_arrivo_raw = get(row, "data_arrivo")
-            data_arrivo = None
-            if data_arrivo_raw is not None:
-                dt = _parse_date(data_arrivo_raw)
-                data_arrivo = dt.strftime("%Y-%m-%d") if dt else str(data_arrivo_raw).strip()[:10] or None
-            is_vacation = _is_vacation_period(data_arrivo_raw)
-
-            # Anticipo: da colonna "anticipo_giorni" o da (data_arrivo - data_prenotazione)
-            anticipo_giorni = None
-            anticipo_val = get(row, "anticipo_giorni")
-            if anticipo_val is not None:
                 try:
-                    anticipo_giorni = int(pd.to_numeric(anticipo_val, errors="coerce") or 0)
+                    numero_bambini = int(pd.to_numeric(bambini_val, errors="coerce") or 0)
                 except (TypeError, ValueError):
                     pass
-            if anticipo_giorni is None:
-                dt_arr = _parse_date(get(row, "data_arrivo"))
-                dt_pren = _parse_date(get(row, "data_prenotazione"))
-                if dt_arr and dt_pren and dt_pren <= dt_arr:
-                    anticipo_giorni = (dt_arr - dt_pren).days
-
-            prenotante = str(get(row, "prenotante", "") or "").strip() or None
-
-            numero_bambini = numero_bambini_from_col if numero_bambini_from_col is not None else None
-            if numero_bambini is None:
-                bambini_val = get(row, "numero_bambini")
-                if bambini_val is not None:
-                    s = str(bambini_val).strip().lower()
-                    if s in ("sì", "si", "yes", "1", "x", "ok"):
-                        numero_bambini = 1
-                    elif s in ("no", "0", ""):
-                        numero_bambini = 0
-                    else:
-                        try:
-                            numero_bambini = int(pd.to_numeric(bambini_val, errors="coerce") or 0)
-                        except (TypeError, ValueError):
-                            pass
-
-            if notti <= 0:
-                notti = 1
-            if ospiti <= 0:
-                ospiti = 1
-
-            scores = compute_scores(
-                numero_notti=notti,
-                numero_ospiti=ospiti,
-                canale=canale,
-                giorno_arrivo=giorno,
-                spesa_media=spesa,
-                categoria_camera=cat_camera,
-                threshold_top25=threshold_top25,
-                is_vacation_period=is_vacation,
-                media_spesa=media_spesa,
-                anticipo_giorni=anticipo_giorni,
-                prenotante=prenotante,
-                numero_bambini=numero_bambini,
-            )
-            segment = assign_segment(scores)
-            # Revenue: da totale soggiorno se presente, altrimenti spesa * notti
-            if totale_val is not None and totale_val > 0:
-                revenue = round(totale_val, 2)
-            else:
-                revenue = (spesa * notti) if spesa is not None else None
-            results.append(
-                SegmentedCustomer(
-                    row_index=i,
-                    segment=segment,
-                    scores=scores,
-                    numero_notti=notti,
-                    numero_ospiti=ospiti,
-                    canale=canale or None,
-                    giorno_arrivo=giorno or None,
-                    storico_soggiorni=None,
-                    spesa_media=spesa,
-                    cliente_id=str(get(row, "cliente_id", "")) or None,
-                    nome_cliente=str(get(row, "nome_cliente", "")).strip() or None,
-                    data_arrivo=data_arrivo,
-                    categoria_camera=cat_camera or None,
-                    revenue=revenue,
-                    anticipo_giorni=anticipo_giorni,
-                    prenotante=prenotante,
-                    numero_bambini=numero_bambini,
-                )
-            )
+
+    if notti <= 0:
+        notti = 1
+    if ospiti <= 0:
+        ospiti = 1
+
+    scores = compute_scores(
+        numero_notti=notti,
+        numero_ospiti=ospiti,
+        canale=canale,
+        giorno_arrivo=giorno,
+        spesa_media=spesa,
+        categoria_camera=cat_camera,
+        threshold_top25=threshold_top25,
+        is_vacation_period=is_vacation,
+        media_spesa=media_spesa,
+        anticipo_giorni=anticipo_giorni,
+        prenotante=prenotante,
+        numero_bambini=numero_bambini,
+    )
+    segment = assign_segment(scores)
+    # Revenue: da totale soggiorno se presente, altrimenti spesa * notti
+    if totale_val is not None and totale_val > 0:
+        revenue = round(totale_val, 2)
+    else:
+        revenue = (spesa * notti) if spesa is not None else None
+    return SegmentedCustomer(
+        row_index=i,
+        segment=segment,
+        scores=scores,
+        numero_notti=notti,
+        numero_ospiti=ospiti,
+        canale=canale or None,
+        giorno_arrivo=giorno or None,
+        storico_soggiorni=None,
+        spesa_media=spesa,
+        cliente_id=str(get("cliente_id", "")) or None,
+        nome_cliente=str(get("nome_cliente", "")).strip() or None,
+        data_arrivo=data_arrivo,
+        categoria_camera=cat_camera or None,
+        revenue=revenue,
+        anticipo_giorni=anticipo_giorni,
+        prenotante=prenotante,
+        numero_bambini=numero_bambini,
+    )
+
+
+def _parse_rows(
+    df: pd.DataFrame,
+    col_map: dict[str, str],
+    threshold_top25: float | None,
+    media_spesa: float | None,
+    date_formats: dict[str, str] | None = None,
+) -> list[SegmentedCustomer]:
+    """Motore riga per riga (df.iterrows): riferimento per il motore colonnare."""
+    results: list[SegmentedCustomer] = []
+    for idx, row in df.iterrows():
+        try:
+            i = int(idx) if isinstance(idx, (int, float)) else len(results)
+            results.append(_segment_row(row, i, col_map, threshold_top25, media_spesa, date_formats))
         except Exception:
             continue  # salta righe che danno errore
-    return results, threshold_top25
+    return results
+
+
+# --- Motore colonnare -------------------------------------------------------
+# Converte le colonne in blocco (pandas/NumPy) e applica le funzioni di parsing una sola volta
+# per valore distinto. Le righe con valori "anomali" (date NaT o con timezone, numeri non finiti
+# o enormi) passano da _segment_row, così il risultato coincide con il motore riga per riga.
+
+_ERROR = object()  # la riga originale solleverebbe un'eccezione → riga scartata
+_SI_VALUES = ("sì", "si", "yes", "1", "x", "ok")
+_MAX_SAFE_INT = 2.0 ** 53
+
+
+def _intern(v: Any) -> Any:
+    """Stringhe ripetute (canale, camera, prenotante, data) condivise tra righe, blocchi e analisi."""
+    return sys.intern(v) if type(v) is str else v
+
+
+class _RawColumn:
+    """Colonna logica grezza fattorizzata: codici per riga (-1 = NA/assente) e valori distinti."""
+
+    __slots__ = ("codes", "uniques", "na")
+
+    def __init__(self, codes: np.ndarray, uniques: list):
+        self.codes = codes
+        self.uniques = uniques
+        self.na = codes < 0
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, col: str | None, dtype: np.dtype) -> "_RawColumn":
+        if col is None or col not in df.columns:
+            return cls(np.full(len(df), -1, dtype=np.intp), [])
+        values = df[col].to_numpy(dtype=dtype)
+        if values.dtype != object:
+            values = values.astype(object)
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        return cls(codes, list(uniques))
+
+    def map(self, func, na_result: Any = None) -> np.ndarray:
+        """Applica func una volta per valore distinto (eccezioni → _ERROR) e ridistribuisce per riga."""
+        out = np.empty(len(self.uniques) + 1, dtype=object)
+        for k, u in enumerate(self.uniques):
+            try:
+                out[k] = func(u)
+            except Exception:
+                out[k] = _ERROR
+        out[-1] = na_result
+        return out[self.codes]
+
+    def numeric(self) -> np.ndarray:
+        """pd.to_numeric(errors="coerce") per riga (NaN per NA e valori non numerici)."""
+        if not self.uniques:
+            return np.full(len(self.codes), np.nan)
+        conv = pd.to_numeric(pd.Series(self.uniques, dtype=object), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+        return np.append(conv, np.nan)[self.codes]
+
+
+def _int_or_zero(col: _RawColumn, na_default: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Equivalente colonnare di int(pd.to_numeric(v, errors="coerce") or 0).
+    Restituisce (valori interi, maschera errore int(nan), maschera fallback per valori non finiti/enormi).
+    """
+    num = col.numeric()
+    num[col.na] = na_default
+    nan = np.isnan(num)
+    huge = ~nan & ~(np.abs(num) < _MAX_SAFE_INT)
+    safe = np.where(nan | huge, 0.0, num)
+    return np.trunc(safe).astype(np.int64), nan, huge
+
+
+_DATE_NONE, _DATE_OK, _DATE_NAT, _DATE_ODD = 0, 1, 2, 3
+
+
+def _date_info(dt: Any) -> tuple[int, np.datetime64]:
+    """Classifica il risultato di _parse_date: None, data naive valida, NaT o anomala (timezone, fuori range)."""
+    if dt is None:
+        return _DATE_NONE, np.datetime64("NaT", "us")
+    if pd.isna(dt):
+        return _DATE_NAT, np.datetime64("NaT", "us")
+    if getattr(dt, "tzinfo", None) is not None:
+        return _DATE_ODD, np.datetime64("NaT", "us")
+    return _DATE_OK, np.datetime64(pd.Timestamp(dt).as_unit("us").asm8, "us")
+
+
+class _DateColumn:
+    """
+    Stadio date: ogni colonna data è parsata una sola volta. Le stringhe passano da un'unica
+    pd.to_datetime vettoriale con il formato dedotto per la colonna; i valori rimanenti (formato
+    diverso, numeri, oggetti datetime) da _parse_date, una volta per valore distinto.
+    Giorno della settimana, mese (periodo vacanze), stringa ISO e differenze in giorni derivano dal risultato.
+    """
+
+    __slots__ = ("col", "fmt", "state_u", "value_u", "state", "value")
+
+    def __init__(self, col: _RawColumn, fmt: str | None = None):
+        self.col = col
+        self.fmt = fmt
+        uniques = col.uniques
+        state_u = np.full(len(uniques) + 1, _DATE_NONE, dtype=np.int8)
+        value_u = np.full(len(uniques) + 1, np.datetime64("NaT", "us"), dtype="datetime64[us]")
+        pending = range(len(uniques))
+        if fmt is not None:
+            str_pos = np.array([k for k, u in enumerate(uniques) if isinstance(u, str)], dtype=np.intp)
+            if len(str_pos):
+                texts = pd.Series([uniques[k] for k in str_pos], dtype=object).str.strip()
+                # Solo date senza orario: con l'orario (da conservare) passano da _parse_date
+                conv = pd.to_datetime(texts.where(texts.str.len() <= 10), format=fmt, errors="coerce")
+                ok = conv.notna().to_numpy()
+                state_u[str_pos[ok]] = _DATE_OK
+                value_u[str_pos[ok]] = conv[ok].to_numpy(dtype="datetime64[us]")
+                done = set(str_pos[ok].tolist())
+                pending = [k for k in range(len(uniques)) if k not in done]
+        for k in pending:
+            try:
+                state_u[k], value_u[k] = _date_info(_parse_date(uniques[k], fmt))
+            except Exception:
+                state_u[k] = _DATE_ODD
+        self.state_u = state_u
+        self.value_u = value_u
+        self.state = state_u[col.codes]
+        self.value = value_u[col.codes]
+
+    def _derive(self, vector_ok: np.ndarray, vector_values: np.ndarray, scalar, na_result: Any) -> np.ndarray:
+        """Valore per riga: dal risultato vettoriale dove vector_ok, altrimenti scalar(valore) per valore distinto."""
+        out = np.empty(len(self.state_u), dtype=object)
+        for k, u in enumerate(self.col.uniques):
+            if vector_ok[k]:
+                out[k] = vector_values[k]
+                continue
+            try:
+                out[k] = scalar(u, self.fmt)
+            except Exception:
+                out[k] = _ERROR
+        out[-1] = na_result
+        return out[self.col.codes]
+
+    def weekday_names(self) -> np.ndarray:
+        """Come _get_day_name (i numeri restano "numero giorno", non date)."""
+        ok = self.state_u == _DATE_OK
+        ok[:-1] &= np.array([isinstance(u, (str, datetime)) for u in self.col.uniques], dtype=bool)
+        weekday = (self.value_u.astype("datetime64[D]").astype(np.int64) + 3) % 7  # 1970-01-01 = giovedì
+        return self._derive(ok, np.array(_DAYS, dtype=object)[np.where(ok, weekday, 0)], _get_day_name, "")
+
+    def iso_strings(self) -> np.ndarray:
+        """Data normalizzata YYYY-MM-DD (o testo originale troncato se non è una data)."""
+        years = self.value_u.astype("datetime64[Y]").astype(np.int64) + 1970
+        ok = (self.state_u == _DATE_OK) & (years >= 1000) & (years <= 9999)
+        iso = [_intern(v) for v in np.datetime_as_string(self.value_u, unit="D").tolist()]
+        return self._derive(ok, np.array(iso, dtype=object), _data_arrivo_str, None)
+
+    def vacation(self) -> np.ndarray:
+        """Come _is_vacation_period: mese dell'arrivo in MESI_VACANZA."""
+        ok = self.state_u == _DATE_OK
+        months = self.value_u.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        return self._derive(ok, np.isin(months, MESI_VACANZA), _is_vacation_period, False)
+
+
+def _days_between(start: _DateColumn, end: _DateColumn) -> np.ndarray:
+    """(end - start).days con arrotondamento verso il basso come timedelta.days (NaT → valore non usato)."""
+    delta_us = (end.value - start.value).astype(np.int64)
+    return np.floor_divide(delta_us, 86_400_000_000)
+
+
+def _bambini_from_col(v: Any) -> int:
+    """Bambini da colonna Interi/scontati (stessa logica di _segment_row)."""
+    s = str(v).strip().lower()
+    if s in _SI_VALUES:
+        return 1
+    if s not in ("no", "0", ""):
+        try:
+            return int(pd.to_numeric(v, errors="coerce") or 0)
+        except (TypeError, ValueError):
+            pass
+    return 0
+
+
+def _anticipo_from_col(v: Any) -> int | None:
+    try:
+        return int(pd.to_numeric(v, errors="coerce") or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _data_arrivo_str(v: Any, fmt: str | None = None) -> str | None:
+    dt = _parse_date(v, fmt)
+    return dt.strftime("%Y-%m-%d") if dt else str(v).strip()[:10] or None
+
+
+# --- Piano di ingest per intestazione ---------------------------------------------
+# Mappa colonne, formato numerico per colonna e convertitori tipizzati dipendono solo dall'intestazione
+# (e dal gestionale che ha prodotto il file): compilati una volta e riusati per gli export successivi
+# con la stessa intestazione. Il formato numerico sceglie solo la conversione vettoriale da tentare:
+# i valori che non la rispettano passano da _norm_float, quindi il risultato non cambia.
+
+_PLAN_CACHE_SIZE = 64
+_PLAN_CACHE: dict[tuple, "IngestPlan"] = {}
+_PLAN_CACHE_LOCK = threading.Lock()  # upload da thread di richiesta e job in background
+_NUMBER_SAMPLE_SIZE = 200
+_EU_NUMBER_RE = re.compile(r"^-?\d{1,3}(\.\d{3})*,\d+$|^-?\d+,\d+$")
+FLOAT_KEYS = ("spesa_media", "totale_soggiorno")
+
+
+def _detect_number_locale(df: pd.DataFrame, col: str | None) -> str:
+    """"eu" se il campione contiene importi con virgola decimale (1.234,56 / 89,90), altrimenti "plain"."""
+    if col is None or col not in df.columns:
+        return "plain"
+    seen = 0
+    for v in pd.unique(df[col].dropna().to_numpy(dtype=object)):
+        if isinstance(v, str):
+            if _EU_NUMBER_RE.match(v.strip().replace(" ", "").replace("\u00a0", "")):
+                return "eu"
+            seen += 1
+            if seen >= _NUMBER_SAMPLE_SIZE:
+                break
+    return "plain"
+
+
+def _floats(values: list) -> tuple[np.ndarray, np.ndarray]:
+    """float(v) in blocco (cast da object: stesso parser di Python): (valori, maschera dei valori convertiti)."""
+    arr = np.array(values, dtype=object)
+    try:
+        return arr.astype(float), np.ones(len(arr), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+    out = np.full(len(arr), np.nan)
+    ok = np.zeros(len(arr), dtype=bool)
+    for j, v in enumerate(values):
+        try:
+            out[j] = float(v)
+            ok[j] = True
+        except (TypeError, ValueError):
+            pass
+    return out, ok
+
+
+def _eu_number_text(v: Any) -> Any:
+    """Come _norm_float: senza spazi; con la virgola, punto = migliaia e virgola = decimali."""
+    if not isinstance(v, str):
+        return v
+    t = v.strip().replace(" ", "").replace("\u00a0", "")
+    return t.replace(".", "").replace(",", ".") if "," in t else t
+
+
+def _float_column(col: _RawColumn, locale: str = "plain") -> np.ndarray:
+    """Equivalente colonnare di _norm_float per riga: conversione in blocco secondo il formato della colonna."""
+    uniques = col.uniques
+    values, ok = _floats([_eu_number_text(u) for u in uniques] if locale == "eu" else uniques)
+    out = np.empty(len(uniques) + 1, dtype=object)
+    out[:-1][ok] = values[ok]
+    for k in np.flatnonzero(~ok):
+        out[k] = _norm_float(uniques[k])  # testi in altro formato o non numerici
+    out[-1] = None
+    return out[col.codes]
+
+
+def _text_column(col: _RawColumn) -> np.ndarray:
+    return col.map(lambda u: _intern(str(u or "")), "")
+
+
+def _bambini_column(col: _RawColumn) -> np.ndarray:
+    return col.map(_bambini_from_col, 0)
+
+
+class IngestPlan:
+    """
+    Piano di ingest compilato per un'intestazione: mappa colonne logiche, formato numerico delle colonne
+    importo ("plain" o "eu") e convertitore tipizzato per campo (colonna grezza → valori per riga).
+    """
+
+    __slots__ = ("fingerprint", "col_map", "number_locales", "converters")
+
+    def __init__(self, fingerprint: tuple, col_map: dict[str, str], number_locales: dict[str, str]):
+        self.fingerprint = fingerprint
+        self.col_map = col_map
+        self.number_locales = number_locales
+        self.converters: dict[str, Callable[[_RawColumn], np.ndarray]] = {
+            "canale": _text_column,
+            "categoria_camera": _text_column,
+            "numero_bambini": _bambini_column,
+            **{key: partial(_float_column, locale=number_locales[key]) for key in FLOAT_KEYS},
+        }
+
+    @classmethod
+    def compile(cls, df: pd.DataFrame, col_map: dict[str, str] | None = None) -> "IngestPlan":
+        col_map = col_map if col_map is not None else resolve_col_map(df)
+        locales = {key: _detect_number_locale(df, col_map.get(key)) for key in FLOAT_KEYS}
+        return cls(tuple(df.columns), col_map, locales)
+
+
+def ingest_plan(df: pd.DataFrame) -> IngestPlan:
+    """Piano per l'intestazione di df: dalla cache se già visto, altrimenti compilato sul primo blocco di dati."""
+    fingerprint = tuple(df.columns)
+    with _PLAN_CACHE_LOCK:
+        plan = _PLAN_CACHE.get(fingerprint)
+    if plan is None:
+        plan = IngestPlan.compile(df)  # fuori dal lock: due upload concorrenti compilano lo stesso piano
+        with _PLAN_CACHE_LOCK:
+            if fingerprint not in _PLAN_CACHE and len(_PLAN_CACHE) >= _PLAN_CACHE_SIZE:
+                _PLAN_CACHE.pop(next(iter(_PLAN_CACHE)))
+            plan = _PLAN_CACHE.setdefault(fingerprint, plan)
+    return plan
+
+
+def _parse_columns(
+    df: pd.DataFrame,
+    col_map: dict[str, str],
+    threshold_top25: float | None,
+    media_spesa: float | None,
+    date_formats: dict[str, str] | None = None,
+    plan: IngestPlan | None = None,
+) -> list[SegmentedCustomer]:
+    """Motore colonnare: stesso risultato di _parse_rows, con conversioni in blocco (convertitori del piano)."""
+    date_formats = date_formats or {}
+    plan = plan if plan is not None else IngestPlan.compile(df, col_map)
+    convert = plan.converters
+    n = len(df)
+    # Stesso tipo dei valori visti da iterrows (es. int → float se il frame è tutto numerico)
+    dtype = df.iloc[:0].to_numpy().dtype
+    raw = {key: _RawColumn.from_frame(df, col_map.get(key), dtype) for key in COLUMN_ALIASES}
+    invalid = np.zeros(n, dtype=bool)
+    fallback = np.zeros(n, dtype=bool)
+
+    def errors(arr: np.ndarray) -> np.ndarray:
+        return np.fromiter((x is _ERROR for x in arr), dtype=bool, count=n)
+
+    # Stadio date: ogni colonna data parsata una sola volta
+    arr_dates = _DateColumn(raw["data_arrivo"], date_formats.get("data_arrivo"))
+    dep_dates = _DateColumn(raw["data_partenza"], date_formats.get("data_partenza"))
+    pren_dates = _DateColumn(raw["data_prenotazione"], date_formats.get("data_prenotazione"))
+    giorno_dates = _DateColumn(raw["giorno_arrivo"], date_formats.get("giorno_arrivo"))
+
+    # Notti (con ricalcolo da arrivo/partenza se <= 0)
+    notti, bad, huge = _int_or_zero(raw["numero_notti"], 0)
+    invalid |= bad
+    fallback |= huge
+    need_calc = (notti <= 0) & (arr_dates.state != _DATE_NONE) & (dep_dates.state != _DATE_NONE)
+    fallback |= need_calc & ((arr_dates.state == _DATE_ODD) | (dep_dates.state == _DATE_ODD))
+    invalid |= need_calc & ((arr_dates.state == _DATE_NAT) | (dep_dates.state == _DATE_NAT))  # int(NaT.days)
+    calc_ok = need_calc & (arr_dates.state == _DATE_OK) & (dep_dates.state == _DATE_OK)
+    if calc_ok.any():
+        notti = np.where(calc_ok, np.maximum(_days_between(arr_dates, dep_dates), 0), notti)
+
+    # Ospiti: Interi + scontati oppure colonna unica
+    adulti_branch = ~raw["numero_adulti"].na | ~raw["numero_bambini"].na
+    adulti, bad, huge = _int_or_zero(raw["numero_adulti"], np.nan)
+    invalid |= adulti_branch & bad
+    fallback |= adulti_branch & huge
+    bambini_col = convert["numero_bambini"](raw["numero_bambini"])
+    bambini_err = errors(bambini_col)
+    bambini_huge = np.fromiter((x is not _ERROR and abs(x) >= _MAX_SAFE_INT for x in bambini_col), dtype=bool, count=n)
+    invalid |= adulti_branch & bambini_err
+    fallback |= adulti_branch & bambini_huge
+    bambini_num = np.where(adulti_branch & ~bambini_err & ~bambini_huge, bambini_col, 0)
+    ospiti_col, bad, huge = _int_or_zero(raw["numero_ospiti"], 0)
+    invalid |= ~adulti_branch & bad
+    fallback |= ~adulti_branch & huge
+    ospiti = np.where(adulti_branch, adulti + bambini_num.astype(np.int64), ospiti_col)
+
+    # Canale (se assente usa il prenotante) e prenotante
+    canale = convert["canale"](raw["canale"])
+    prenotante_canale = raw["prenotante"].map(lambda u: _intern(str(u).strip()), None)
+    no_canale = (canale == "") & ~raw["prenotante"].na
+    canale = np.where(no_canale, prenotante_canale, canale)
+    prenotante = raw["prenotante"].map(lambda u: _intern(str(u or "").strip() or None), None)
+
+    # Giorno arrivo: colonna giorno (se valorizzata) altrimenti data arrivo
+    giorno_truthy = raw["giorno_arrivo"].map(bool, False).astype(bool)
+    giorno = np.where(giorno_truthy, giorno_dates.weekday_names(), arr_dates.weekday_names())
+    invalid |= errors(giorno)
+
+    # Spesa e totale
+    spesa = convert["spesa_media"](raw["spesa_media"])
+    totale = convert["totale_soggiorno"](raw["totale_soggiorno"])
+    for arr in (spesa, totale):
+        fallback |= np.fromiter((x is not None and not np.isfinite(x) for x in arr), dtype=bool, count=n)
+    derive = (spesa == None) & (notti > 0) & (totale != None)  # noqa: E711 (confronto elementwise)
+    for k in np.flatnonzero(derive):
+        if totale[k] > 0:
+            spesa[k] = round(totale[k] / int(notti[k]), 2)
+
+    cat_camera = convert["categoria_camera"](raw["categoria_camera"])
+
+    # Data arrivo (stringa normalizzata) e periodo vacanze
+    data_arrivo = arr_dates.iso_strings()
+    invalid |= errors(data_arrivo)
+    is_vacation = arr_dates.vacation()
+
+    # Anticipo: da colonna o da (data_arrivo - data_prenotazione)
+    anticipo = raw["anticipo_giorni"].map(_anticipo_from_col, None)
+    invalid |= errors(anticipo)
+    need_calc = (anticipo == None) & (arr_dates.state != _DATE_NONE) & (pren_dates.state != _DATE_NONE)  # noqa: E711
+    fallback |= need_calc & ((arr_dates.state == _DATE_ODD) | (pren_dates.state == _DATE_ODD))
+    calc_ok = need_calc & (arr_dates.state == _DATE_OK) & (pren_dates.state == _DATE_OK)
+    calc_ok &= pren_dates.value <= arr_dates.value
+    if calc_ok.any():
+        days = _days_between(pren_dates, arr_dates)
+        for k in np.flatnonzero(calc_ok):
+            anticipo[k] = int(days[k])
+
+    numero_bambini = np.where(adulti_branch, bambini_num, None)
+    notti = np.where(notti <= 0, 1, notti)
+    ospiti = np.where(ospiti <= 0, 1, ospiti)
+
+    cliente_id = raw["cliente_id"].map(lambda u: str(u) or None, None)
+    nome_cliente = raw["nome_cliente"].map(lambda u: str(u).strip() or None, None)
+
+    # Indice riga: come iterrows (etichetta numerica, altrimenti progressivo delle righe valide)
+    index = df.index
+    numeric_index = pd.api.types.is_integer_dtype(index.dtype) or pd.api.types.is_float_dtype(index.dtype)
+    labels = list(index) if not numeric_index else None
+    if numeric_index and pd.api.types.is_float_dtype(index.dtype):
+        fallback |= ~np.isfinite(index.to_numpy(dtype=float))
+
+    # Scoring vettoriale sulle righe gestite dal motore colonnare
+    keep = ~invalid & ~fallback
+    batch = compute_scores_batch(
+        numero_notti=notti[keep],
+        numero_ospiti=ospiti[keep],
+        canale=canale[keep],
+        giorno_arrivo=giorno[keep],
+        spesa_media=spesa[keep],
+        categoria_camera=cat_camera[keep],
+        threshold_top25=threshold_top25,
+        is_vacation_period=is_vacation[keep].astype(bool),
+        media_spesa=media_spesa,
+        anticipo_giorni=anticipo[keep],
+        prenotante=prenotante[keep],
+        numero_bambini=numero_bambini[keep],
+    )
+    score_rows = zip(
+        batch.business.tolist(), batch.leisure.tolist(), batch.coppia.tolist(), batch.famiglia.tolist(), batch.segment.tolist()
+    )
+
+    results: list[SegmentedCustomer] = []
+    int_index = index.to_numpy() if numeric_index else None
+    for k in range(n):
+        if fallback[k]:
+            idx = labels[k] if labels is not None else index[k]
+            try:
+                i = int(idx) if isinstance(idx, (int, float)) else len(results)
+                results.append(_segment_row(df.iloc[k], i, col_map, threshold_top25, media_spesa, date_formats))
+            except Exception:
+                pass
+            continue
+        if invalid[k]:
+            continue
+        b, le, co, fa, seg_code = next(score_rows)
+        if int_index is not None:
+            i = int(int_index[k])
+        else:
+            idx = labels[k]
+            i = int(idx) if isinstance(idx, (int, float)) else len(results)
+        nk = int(notti[k])
+        sp = spesa[k]
+        tot = totale[k]
+        nb = numero_bambini[k]
+        if tot is not None and tot > 0:
+            revenue = round(tot, 2)
+        else:
+            revenue = (sp * nk) if sp is not None else None
+        results.append(
+            SegmentedCustomer(
+                row_index=i,
+                segment=SEGMENTS_BY_CODE[seg_code],
+                scores=Scores.of(b, le, co, fa),
+                numero_notti=nk,
+                numero_ospiti=int(ospiti[k]),
+                canale=canale[k] or None,
+                giorno_arrivo=giorno[k] or None,
+                storico_soggiorni=None,
+                spesa_media=sp,
+                cliente_id=cliente_id[k],
+                nome_cliente=nome_cliente[k],
+                data_arrivo=data_arrivo[k],
+                categoria_camera=cat_camera[k] or None,
+                revenue=revenue,
+                anticipo_giorni=anticipo[k],
+                prenotante=prenotante[k],
+                numero_bambini=int(nb) if nb is not None else None,
+            )
+        )
+    return results
+
+
+def segment_frame(
+    df: pd.DataFrame,
+    col_map: dict[str, str],
+    threshold_top25: float | None,
+    media_spesa: float | None,
+    date_formats: dict[str, str] | None = None,
+    engine: str = "columns",
+    plan: IngestPlan | None = None,
+) -> list[SegmentedCustomer]:
+    """
+    Segmenta un DataFrame (o un blocco di un file più grande) con soglie e formati già calcolati.
+    row_index = etichetta dell'indice: per i blocchi usare un indice che prosegue da quello precedente.
+    plan: piano di ingest dell'intestazione (vedi ingest_plan); se assente viene compilato sul blocco.
+    """
+    if engine == "rows":
+        return _parse_rows(df, col_map, threshold_top25, media_spesa, date_formats)
+    return _parse_columns(df, col_map, threshold_top25, media_spesa, date_formats, plan)
+
+
+def parse_and_segment(df: pd.DataFrame, engine: str = "columns") -> tuple[list[SegmentedCustomer], float | None]:
+    """
+    Legge il DataFrame (da Excel), segmenta ogni riga, restituisce lista SegmentedCustomer
+    e soglia spesa top 25% (per scoring Premium).
+    engine: "columns" (conversioni in blocco, default) o "rows" (df.iterrows, riferimento); stesso risultato.
+    """
+    if df.empty:
+        return [], None
+
+    plan = ingest_plan(df)
+    col_map = plan.col_map
+    threshold_top25, media_spesa = _spend_stats(df, col_map)
+    date_formats = infer_date_formats(df, col_map)
+    return segment_frame(df, col_map, threshold_top25, media_spesa, date_formats, engine, plan), threshold_top25
 
 
 def _norm_float(v: Any) -> float | None:
@@ -0,0 +1,253 @@
+"""
+Feedback operatore per cliente (analysis_id, row_index) → payload salvato da POST .../feedback.
+Stesso backend dello store analisi (ANALYSIS_STORE):
+- "memory": dizionario nel processo;
+- "disk"/"shared": SQLite in modalità WAL (ANALYSIS_STORE_DIR/feedback.sqlite3), condiviso tra i worker
+  e durevole. Lettura per chiave primaria (analysis_id, row_index). Le scritture passano da un unico thread
+  che raccoglie i salvataggi arrivati durante il commit precedente e li conferma con una sola transazione
+  (group commit): ogni richiesta attende la conferma su disco, ma i salvataggi concorrenti condividono lo stesso fsync.
+  Gli import in blocco (put_many, note da gestionale) sono una transazione a sé, confermata tutta o niente.
+Ogni analisi ha una versione del feedback, incrementata a ogni salvataggio: chi deriva dati dal feedback
+(segmenti visualizzati, aggregati) li ricalcola solo quando la versione cambia, anche se il salvataggio
+è avvenuto su un altro worker.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from typing import Optional
+
+from app.store import ANALYSIS_STORE, ANALYSIS_STORE_DIR
+
+# Attesa prima di ogni commit per raccogliere altri salvataggi nella stessa transazione (secondi, 0 = nessuna)
+FEEDBACK_COMMIT_WINDOW = float(os.environ.get("FEEDBACK_COMMIT_WINDOW", "0"))
+# Righe per query IN (...) nelle letture multiple (sotto il limite di parametri delle vecchie SQLite, 999)
+_IN_CHUNK = 500
+
+
+class FeedbackStore(ABC):
+    """Interfaccia: un backend senza uno dei metodi astratti non è istanziabile."""
+
+    @abstractmethod
+    def get(self, analysis_id: str, row_index: int) -> Optional[dict]:
+        """Payload salvato per il cliente, None se assente."""
+
+    @abstractmethod
+    def put(self, analysis_id: str, row_index: int, payload: dict) -> None:
+        """Salva il payload del cliente (sostituisce il precedente); la versione cresce di 1."""
+
+    @abstractmethod
+    def put_many(self, analysis_id: str, items: list[tuple[int, dict]]) -> None:
+        """Salva (row_index, payload) di molti clienti insieme; la versione cresce di len(items)."""
+
+    @abstractmethod
+    def get_many(self, analysis_id: str, row_indexes: list[int]) -> dict[int, dict]:
+        """row_index -> payload per le righe con feedback (le altre assenti dal risultato)."""
+
+    @abstractmethod
+    def version(self, analysis_id: str) -> int:
+        """Numero di salvataggi confermati per l'analisi (0 = nessun feedback)."""
+
+    @abstractmethod
+    def segments(self, analysis_id: str) -> dict[int, str]:
+        """row_index -> segmento scelto dal feedback (solo righe con segmento valorizzato)."""
+
+    def evict(self, analysis_id: str, dropped: bool) -> None:
+        """L'analisi è stata rilasciata dallo store (dropped: scartata, non più consultabile)."""
+
+
+class MemoryFeedback(FeedbackStore):
+    def __init__(self):
+        self._feedback: dict[str, dict[int, dict]] = {}
+        self._versions: dict[str, int] = {}
+
+    def get(self, analysis_id: str, row_index: int) -> Optional[dict]:
+        return (self._feedback.get(analysis_id) or {}).get(row_index)
+
+    def get_many(self, analysis_id: str, row_indexes: list[int]) -> dict[int, dict]:
+        entries = self._feedback.get(analysis_id) or {}
+        return {r: entries[r] for r in row_indexes if r in entries}
+
+    def put(self, analysis_id: str, row_index: int, payload: dict) -> None:
+        self._feedback.setdefault(analysis_id, {})[row_index] = payload
+        self._versions[analysis_id] = self._versions.get(analysis_id, 0) + 1
+
+    def put_many(self, analysis_id: str, items: list[tuple[int, dict]]) -> None:
+        self._feedback.setdefault(analysis_id, {}).update(items)
+        self._versions[analysis_id] = self._versions.get(analysis_id, 0) + len(items)
+
+    def version(self, analysis_id: str) -> int:
+        return self._versions.get(analysis_id, 0)
+
+    def segments(self, analysis_id: str) -> dict[int, str]:
+        entries = self._feedback.get(analysis_id) or {}
+        return {row: p["segment"] for row, p in entries.items() if p.get("segment")}
+
+    def evict(self, analysis_id: str, dropped: bool) -> None:
+        if dropped:
+            self._feedback.pop(analysis_id, None)
+            self._versions.pop(analysis_id, None)
+
+
+class SqliteFeedback(FeedbackStore):
+    """Feedback in SQLite (WAL, synchronous=FULL): una connessione per thread, scritture raggruppate."""
+
+    def __init__(self, root: str = ANALYSIS_STORE_DIR, commit_window: float = FEEDBACK_COMMIT_WINDOW):
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "feedback.sqlite3")
+        self.commit_window = commit_window
+        self._local = threading.local()
+        self._cond = threading.Condition()
+        self._pending: list[tuple[str, int, str, Future]] = []
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid = 0
+        self.commits = 0  # transazioni confermate (salvataggi / commit = dimensione media del gruppo)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback ("
+            " analysis_id TEXT NOT NULL, row_index INTEGER NOT NULL, payload TEXT NOT NULL,"
+            " PRIMARY KEY (analysis_id, row_index)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback_version ("
+            " analysis_id TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():  # connessioni non ereditate dopo un fork
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, analysis_id: str, row_index: int) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT payload FROM feedback WHERE analysis_id = ? AND row_index = ?", (analysis_id, row_index)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, analysis_id: str, row_indexes: list[int]) -> dict[int, dict]:
+        """Una query per blocco di _IN_CHUNK righe (chiave primaria), invece di una per cliente."""
+        conn = self._connect()
+        out = {}
+        for start in range(0, len(row_indexes), _IN_CHUNK):
+            chunk = row_indexes[start : start + _IN_CHUNK]
+            rows = conn.execute(
+                f"SELECT row_index, payload FROM feedback WHERE analysis_id = ? AND row_index IN ({','.join('?' * len(chunk))})",
+                (analysis_id, *chunk),
+            )
+            out.update((row_index, json.loads(payload)) for row_index, payload in rows)
+        return out
+
+    def version(self, analysis_id: str) -> int:
+        row = self._connect().execute(
+            "SELECT version FROM feedback_version WHERE analysis_id = ?", (analysis_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def segments(self, analysis_id: str) -> dict[int, str]:
+        rows = self._connect().execute("SELECT row_index, payload FROM feedback WHERE analysis_id = ?", (analysis_id,))
+        out = {}
+        for row_index, payload in rows:
+            segment = json.loads(payload).get("segment")
+            if segment:
+                out[row_index] = segment
+        return out
+
+    def evict(self, analysis_id: str, dropped: bool) -> None:
+        """Analisi rimossa dallo store (retention): il suo feedback non serve più."""
+        if not dropped:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM feedback WHERE analysis_id = ?", (analysis_id,))
+            conn.execute("DELETE FROM feedback_version WHERE analysis_id = ?", (analysis_id,))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+
+    def put(self, analysis_id: str, row_index: int, payload: dict) -> None:
+        """Accoda il salvataggio e attende il commit del gruppo che lo contiene."""
+        done: Future = Future()
+        with self._cond:
+            self._pending.append((analysis_id, row_index, json.dumps(payload, ensure_ascii=False), done))
+            if self._writer is None or self._writer_pid != os.getpid() or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="feedback-writer", daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+            self._cond.notify()
+        done.result()
+
+    def put_many(self, analysis_id: str, items: list[tuple[int, dict]]) -> None:
+        """Una sola transazione (un fsync) per tutto il blocco, sulla connessione del thread chiamante."""
+        if not items:
+            return
+        rows = [(analysis_id, row_index, json.dumps(payload, ensure_ascii=False)) for row_index, payload in items]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO feedback VALUES (?, ?, ?)", rows)
+            _bump_versions(conn, [analysis_id] * len(rows))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self.commits += 1
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            if self.commit_window > 0:
+                time.sleep(self.commit_window)  # lascia arrivare altri salvataggi nella stessa transazione
+            with self._cond:
+                batch, self._pending = self._pending, []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany("INSERT OR REPLACE INTO feedback VALUES (?, ?, ?)", [item[:3] for item in batch])
+                _bump_versions(conn, [item[0] for item in batch])
+                conn.execute("COMMIT")
+            except Exception as e:  # qualsiasi errore: i put() in attesa lo ricevono, il thread resta vivo
+                for item in batch:
+                    item[3].set_exception(e)
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:  # connessione inservibile: se ne apre un'altra
+                    conn.close()
+                    self._local.conn = None
+                    conn = self._connect()
+                continue
+            self.commits += 1
+            for item in batch:
+                item[3].set_result(None)
+
+
+def _bump_versions(conn: sqlite3.Connection, analysis_ids: list[str]) -> None:
+    """Incrementa la versione di ogni analisi del gruppo (nella transazione in corso)."""
+    counts: dict[str, int] = {}
+    for analysis_id in analysis_ids:
+        counts[analysis_id] = counts.get(analysis_id, 0) + 1
+    conn.executemany(
+        "INSERT INTO feedback_version VALUES (?, ?)"
+        " ON CONFLICT(analysis_id) DO UPDATE SET version = version + excluded.version",
+        list(counts.items()),
+    )
+
+
+def open_feedback_store(kind: str = ANALYSIS_STORE, root: str = ANALYSIS_STORE_DIR) -> FeedbackStore:
+    if kind == "memory":
+        return MemoryFeedback()
+    if kind in ("disk", "shared"):
+        return SqliteFeedback(root)
+    raise ValueError(f"ANALYSIS_STORE non valido: {kind!r} (usa 'memory', 'disk' o 'shared')")
@@ -0,0 +1,186 @@
+"""
+Filtri multi-dimensionali sui clienti di un'analisi (tabella clienti, conteggio, overview).
+Indici costruiti al primo uso e tenuti in analysis.derived finché l'analisi resta aperta:
+- campi categoria (canale, prenotante, categoria camera): una bitmap per valore richiesto (1 bit per riga);
+- bambini presenti, alta spesa (spesa_media >= soglia top 25% dell'upload): una bitmap ciascuno;
+- intervalli (data arrivo, notti): posizioni ordinate per valore (sort_order), l'intervallo è una fetta
+  trovata con ricerca binaria.
+Più valori dello stesso campo sono in OR; campi diversi in AND (op=and, default) oppure in OR (op=or).
+Le bitmap si combinano con operazioni bit a bit su 1/8 dei byte delle maschere booleane.
+"""
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis
+from app.sorting import sort_order
+
+# Parametro della query -> campo categoria (valori ripetibili: ?canale=a&canale=b)
+CATEGORY_FILTERS = {"canale": "canale", "prenotante": "prenotante", "categoria_camera": "categoria_camera"}
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+@dataclass(frozen=True)
+class CustomerQuery:
+    """Filtri richiesti, normalizzati (hashable: chiave della cache aggregati)."""
+
+    categories: tuple[tuple[str, tuple[str, ...]], ...] = ()
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    nights_min: Optional[int] = None
+    nights_max: Optional[int] = None
+    children: Optional[bool] = None
+    high_spend: Optional[bool] = None
+    any: bool = False  # op=or
+
+
+def _flag(value: Optional[str]) -> Optional[bool]:
+    if value is None or value == "":
+        return None
+    if value.lower() in ("1", "true", "si", "sì"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(value)
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    return int(value) if value not in (None, "") else None
+
+
+def _date(value: Optional[str]) -> Optional[str]:
+    """Data esattamente YYYY-MM-DD (confrontata come stringa con le date arrivo); ValueError altrimenti."""
+    if value in (None, ""):
+        return None
+    if len(value) != 10 or date.fromisoformat(value).isoformat() != value:
+        raise ValueError(value)  # es. "2024-06" o "20240601": l'intervallo verrebbe troncato in silenzio
+    return value
+
+
+def parse_query(args) -> Optional[CustomerQuery]:
+    """CustomerQuery dai parametri della richiesta (MultiDict), None se nessun filtro; ValueError se non validi."""
+    categories = tuple(
+        (field, tuple(sorted(set(values))))
+        for param, field in CATEGORY_FILTERS.items()
+        if (values := [v for v in args.getlist(param) if v])
+    )
+    op = (args.get("op") or "and").lower()
+    if op not in ("and", "or"):
+        raise ValueError(op)
+    query = CustomerQuery(
+        categories=categories,
+        date_from=_date(args.get("data_da")),
+        date_to=_date(args.get("data_a")),
+        nights_min=_int(args.get("notti_min")),
+        nights_max=_int(args.get("notti_max")),
+        children=_flag(args.get("bambini")),
+        high_spend=_flag(args.get("alta_spesa")),
+        any=op == "or",
+    )
+    return None if query == CustomerQuery(any=query.any) else query
+
+
+def _cached_bitmap(analysis: ColumnarAnalysis, key: tuple, build) -> np.ndarray:
+    bitmap = analysis.derived.get(key)
+    if bitmap is None:
+        bitmap = np.packbits(build())
+        analysis.derived[key] = bitmap
+    return bitmap
+
+
+def _value_bitmap(analysis: ColumnarAnalysis, field: str, value: str) -> np.ndarray:
+    try:
+        code = analysis.categories[field].index(value)
+    except ValueError:
+        code = None  # valore assente nell'analisi: nessuna riga
+    if code is None:
+        return np.zeros((len(analysis) + 7) // 8, dtype=np.uint8)
+    return _cached_bitmap(analysis, ("bitmap", field, code), lambda: analysis.codes(field) == code)
+
+
+def _children_bitmap(analysis: ColumnarAnalysis) -> np.ndarray:
+    def build():
+        values, null = analysis.numbers("numero_bambini")
+        return ~null & (values > 0)
+
+    return _cached_bitmap(analysis, ("bitmap", "bambini"), build)
+
+
+def _high_spend_bitmap(analysis: ColumnarAnalysis) -> np.ndarray:
+    def build():
+        threshold = analysis.meta.get("threshold_top25")
+        values, null = analysis.numbers("spesa_media")
+        if threshold is None:
+            return np.zeros(len(analysis), dtype=bool)
+        return ~null & (values >= threshold)
+
+    return _cached_bitmap(analysis, ("bitmap", "alta_spesa"), build)
+
+
+def _range_bitmap(analysis: ColumnarAnalysis, sort: str, lo: float, hi: float) -> np.ndarray:
+    """Righe con lo <= valore <= hi (mancanti escluse), dalle posizioni ordinate per valore."""
+    order = sort_order(analysis, sort)
+    start = int(np.searchsorted(order.keys, lo, side="left"))
+    end = int(np.searchsorted(order.keys, min(hi, np.finfo(np.float64).max), side="right"))  # mancanti = +inf
+    mask = np.zeros(len(analysis), dtype=bool)
+    mask[order.positions[start:end]] = True
+    return np.packbits(mask)
+
+
+def _date_bitmap(analysis: ColumnarAnalysis, date_from: Optional[str], date_to: Optional[str]) -> np.ndarray:
+    """Date arrivo nell'intervallo (estremi inclusi): bound → rango tra le date distinte ordinate."""
+    ordered = analysis.derived.get(("sorted", "data_arrivo"))
+    if ordered is None:
+        ordered = analysis.derived[("sorted", "data_arrivo")] = sorted(analysis.categories["data_arrivo"])
+    lo = bisect_left(ordered, date_from) if date_from else 0
+    hi = bisect_right(ordered, date_to) - 1 if date_to else len(ordered) - 1
+    return _range_bitmap(analysis, "data_arrivo", lo, hi)
+
+
+def _not(bitmap: np.ndarray, n: int) -> np.ndarray:
+    inverted = np.bitwise_not(bitmap)
+    if n % 8:
+        inverted[-1] &= np.uint8(0xFF << (8 - n % 8) & 0xFF)  # bit di riempimento dopo l'ultima riga
+    return inverted
+
+
+def _bitmaps(analysis: ColumnarAnalysis, query: CustomerQuery) -> list[np.ndarray]:
+    n = len(analysis)
+    out = []
+    for field, values in query.categories:
+        bitmaps = [_value_bitmap(analysis, field, v) for v in values]
+        out.append(np.bitwise_or.reduce(bitmaps) if len(bitmaps) > 1 else bitmaps[0])
+    if query.date_from or query.date_to:
+        out.append(_date_bitmap(analysis, query.date_from, query.date_to))
+    if query.nights_min is not None or query.nights_max is not None:
+        lo = query.nights_min if query.nights_min is not None else -np.inf
+        hi = query.nights_max if query.nights_max is not None else np.inf
+        out.append(_range_bitmap(analysis, "numero_notti", lo, hi))
+    if query.children is not None:
+        bitmap = _children_bitmap(analysis)
+        out.append(bitmap if query.children else _not(bitmap, n))
+    if query.high_spend is not None:
+        bitmap = _high_spend_bitmap(analysis)
+        out.append(bitmap if query.high_spend else _not(bitmap, n))
+    return out
+
+
+def match_bitmap(analysis: ColumnarAnalysis, query: CustomerQuery) -> np.ndarray:
+    """Bitmap (np.packbits) delle righe che soddisfano la query."""
+    bitmaps = _bitmaps(analysis, query)
+    combine = np.bitwise_or if query.any else np.bitwise_and
+    return combine.reduce(bitmaps) if len(bitmaps) > 1 else bitmaps[0]
+
+
+def match_mask(analysis: ColumnarAnalysis, query: CustomerQuery) -> np.ndarray:
+    """Maschera booleana (una voce per posizione) delle righe che soddisfano la query."""
+    return np.unpackbits(match_bitmap(analysis, query), count=len(analysis)).view(bool)
+
+
+def bitmap_count(bitmap: np.ndarray) -> int:
+    """Righe selezionate in una bitmap (conteggio dei bit a 1)."""
+    return int(_POPCOUNT[bitmap].sum(dtype=np.int64))
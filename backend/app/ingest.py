@@ -0,0 +1,341 @@
+"""
+Ingest a blocchi di file grandi: il file non viene mai caricato tutto in memoria.
+Prima passata per soglie spesa e formati data (e codifica per i CSV); seconda passata che segmenta
+blocco per blocco. CSV letti con csv.DictReader, .xlsx con openpyxl in modalità read-only.
+Sopra INGEST_PARALLEL_MIN_ROWS righe i blocchi vengono segmentati in parallelo da un pool di processi.
+"""
+import csv
+import io
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+import pandas as pd
+
+from app.excel_parser import (
+    DateFormatSampler,
+    IngestPlan,
+    infer_date_formats,
+    ingest_plan,
+    segment_frame,
+    spend_series,
+    spend_stats,
+)
+from app.models import SegmentedCustomer
+from app.sketch import SpendStats
+
+# Righe per blocco (memoria di picco ~ un blocco di DataFrame di stringhe)
+INGEST_CHUNK_ROWS = int(os.environ.get("INGEST_CHUNK_ROWS", "50000"))
+_READ_BUFFER = 1 << 20
+# Segmentazione parallela: numero processi (0 = tutti i core) e righe minime per usare il pool
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "0"))
+INGEST_PARALLEL_MIN_ROWS = int(os.environ.get("INGEST_PARALLEL_MIN_ROWS", "200000"))
+_MIN_SHARD_ROWS = 10000
+
+# Callback di avanzamento per blocco: (righe del blocco, righe segmentate, righe totali del file)
+Progress = Callable[[int, int, int], None]
+# Callback a fine prima passata (soglie spesa, formati data...), es. per salvarle con l'analisi
+OnScan = Callable[["IngestScan"], None]
+
+
+class EmptyFileError(ValueError):
+    """Il file non contiene righe di dati."""
+
+
+def _seekable(stream: BinaryIO) -> BinaryIO:
+    """Garantisce uno stream riavvolgibile (servono due passate); altrimenti copia su file temporaneo."""
+    try:
+        if stream.seekable():
+            stream.seek(0)
+            return stream
+    except (AttributeError, OSError):
+        pass
+    tmp = tempfile.TemporaryFile()
+    shutil.copyfileobj(stream, tmp, _READ_BUFFER)
+    tmp.seek(0)
+    return tmp
+
+
+def _iter_csv_frames(stream: BinaryIO, encoding: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Blocchi di righe CSV come DataFrame di stringhe, con indice che prosegue tra i blocchi."""
+    stream.seek(0)
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        # Lettura CSV con stdlib per evitare errori "expected pattern" di pandas
+        reader = csv.DictReader(text, delimiter=",", quotechar='"')
+        offset = 0
+        rows: list[dict] = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= chunk_rows:
+                yield pd.DataFrame(rows, index=pd.RangeIndex(offset, offset + len(rows)))
+                offset += len(rows)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, index=pd.RangeIndex(offset, offset + len(rows)))
+    finally:
+        text.detach()  # non chiudere lo stream sottostante
+
+
+class IngestScan:
+    """Risultato della prima passata: piano di ingest, soglie spesa, formati data, numero righe (e codifica CSV)."""
+
+    def __init__(self, plan: IngestPlan, threshold_top25: float | None, media_spesa: float | None,
+                 date_formats: dict[str, str], total_rows: int, encoding: str | None = None):
+        self.plan = plan
+        self.col_map = plan.col_map
+        self.threshold_top25 = threshold_top25
+        self.media_spesa = media_spesa
+        self.date_formats = date_formats
+        self.total_rows = total_rows
+        self.encoding = encoding
+
+
+def _scan_frames(frames: Iterator[pd.DataFrame], empty_message: str) -> IngestScan:
+    """Accumula le statistiche spesa in uno sketch (memoria costante) e un campione di date."""
+    plan: IngestPlan | None = None
+    sampler: DateFormatSampler | None = None
+    stats = SpendStats()
+    total_rows = 0
+    for frame in frames:
+        if plan is None:
+            plan = ingest_plan(frame)
+            sampler = DateFormatSampler(plan.col_map)
+        sampler.add(frame)
+        part = spend_series(frame, plan.col_map)
+        if part is not None:
+            stats.update(part.to_numpy(dtype=float))
+        total_rows += len(frame)
+    if plan is None:
+        raise EmptyFileError(empty_message)
+    threshold_top25, media_spesa = stats.result()
+    return IngestScan(plan, threshold_top25, media_spesa, sampler.formats(), total_rows)
+
+
+# --- Segmentazione parallela ----------------------------------------------------
+# Ogni blocco (shard) viene segmentato da un processo del pool con le soglie globali della prima passata;
+# i risultati tornano nell'ordine di invio, quindi in ordine di row_index.
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def ingest_workers() -> int:
+    return INGEST_WORKERS if INGEST_WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Pool condiviso tra le richieste (avviato alla prima upload grande); "spawn" perché Flask usa thread."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(ingest_workers(), mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(pool: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _parallel(total_rows: int) -> bool:
+    return ingest_workers() > 1 and total_rows >= INGEST_PARALLEL_MIN_ROWS
+
+
+def _shard_rows(total_rows: int, chunk_rows: int) -> int:
+    """Blocchi più piccoli in modalità parallela: almeno due shard per processo."""
+    if not _parallel(total_rows):
+        return chunk_rows
+    return min(chunk_rows, max(_MIN_SHARD_ROWS, math.ceil(total_rows / (2 * ingest_workers()))))
+
+
+def _segment_frames(
+    frames: Iterable[pd.DataFrame], scan: IngestScan, progress: Progress | None = None
+) -> Iterator[list[SegmentedCustomer]]:
+    """Segmenta i blocchi nel processo corrente o, per file grandi, nel pool (al più 2 shard in coda per processo)."""
+    args = (scan.col_map, scan.threshold_top25, scan.media_spesa, scan.date_formats, "columns", scan.plan)
+
+    def done(rows: int, customers: list[SegmentedCustomer]) -> list[SegmentedCustomer]:
+        if progress is not None:
+            progress(rows, len(customers), scan.total_rows)
+        return customers
+
+    if not _parallel(scan.total_rows):
+        for frame in frames:
+            yield done(len(frame), segment_frame(frame, *args))
+        return
+    pool = _get_pool()
+    pending: deque[tuple[Future, int]] = deque()
+    try:
+        for frame in frames:
+            pending.append((pool.submit(segment_frame, frame, *args), len(frame)))
+            if len(pending) >= 2 * ingest_workers():
+                future, rows = pending.popleft()
+                yield done(rows, future.result())
+        while pending:
+            future, rows = pending.popleft()
+            yield done(rows, future.result())
+    except BrokenProcessPool:
+        _reset_pool(pool)  # un processo è morto: la prossima upload riparte con un pool nuovo
+        raise
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def segment_dataframe(df: pd.DataFrame, on_scan: OnScan | None = None) -> list[SegmentedCustomer]:
+    """
+    Come parse_and_segment (soglie esatte sull'intero DataFrame), ma per DataFrame grandi
+    segmenta shard di righe in parallelo.
+    """
+    if df.empty:
+        return []
+    plan = ingest_plan(df)
+    try:
+        threshold_top25, media_spesa = spend_stats(spend_series(df, plan.col_map))
+    except Exception:
+        threshold_top25, media_spesa = None, None
+    scan = IngestScan(plan, threshold_top25, media_spesa, infer_date_formats(df, plan.col_map), len(df))
+    if on_scan is not None:
+        on_scan(scan)
+    step = _shard_rows(len(df), len(df))
+    shards = (df.iloc[start:start + step] for start in range(0, len(df), step))
+    return [c for part in _segment_frames(shards, scan) for c in part]
+
+
+def scan_csv(stream: BinaryIO, chunk_rows: int = INGEST_CHUNK_ROWS) -> IngestScan:
+    """Prima passata sul CSV: prova UTF-8 e, se la decodifica fallisce, ricomincia in latin-1."""
+    try:
+        scan = _scan_frames(_iter_csv_frames(stream, "utf-8", chunk_rows), "Il file CSV è vuoto")
+        scan.encoding = "utf-8"
+    except UnicodeDecodeError:
+        scan = _scan_frames(_iter_csv_frames(stream, "latin-1", chunk_rows), "Il file CSV è vuoto")
+        scan.encoding = "latin-1"
+    return scan
+
+
+def iter_segmented_csv(
+    stream: BinaryIO,
+    chunk_rows: int = INGEST_CHUNK_ROWS,
+    progress: Progress | None = None,
+    on_scan: OnScan | None = None,
+) -> Iterator[list[SegmentedCustomer]]:
+    """
+    Segmenta un CSV in streaming: una lista di SegmentedCustomer per blocco, in ordine di riga
+    (progress, se dato, viene chiamato dopo ogni blocco).
+    Stesso risultato di parse_and_segment sull'intero file (row_index globale); le soglie spesa vengono
+    dallo sketch (esatte fino a SPEND_SKETCH_K valori, poi con errore di rango O(1/k): vedi app/sketch.py).
+    """
+    stream = _seekable(stream)
+    scan = scan_csv(stream, chunk_rows)
+    if on_scan is not None:
+        on_scan(scan)
+    frames = _iter_csv_frames(stream, scan.encoding, _shard_rows(scan.total_rows, chunk_rows))
+    yield from _segment_frames(frames, scan, progress)
+
+
+# --- .xlsx in streaming (openpyxl read-only) ---------------------------------
+# Conversione celle come pd.read_excel(engine="openpyxl", dtype=str) seguito da replace di "nan"/"":
+# numeri interi senza ".0", date come str(datetime), righe vuote finali scartate, valori "NA"/"#N/A"/... → None.
+
+_NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+_EXCEL_ERRORS = frozenset({"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"})
+
+
+def _xlsx_cell_text(v) -> str | None:
+    if v is None:
+        return None
+    if isinstance(v, str):
+        return None if v in _NA_STRINGS or v in _EXCEL_ERRORS else v
+    if isinstance(v, bool):
+        return str(v)
+    if isinstance(v, float):
+        return str(int(v)) if v.is_integer() else str(v)
+    return str(v)
+
+
+def _xlsx_header(values: tuple) -> list[str]:
+    """Intestazioni come pandas: celle vuote → "Unnamed: i", duplicati → "nome.1", "nome.2"..."""
+    cells = list(values)
+    while cells and _xlsx_cell_text(cells[-1]) is None:
+        cells.pop()
+    header: list[str] = []
+    seen: dict[str, int] = {}
+    for i, v in enumerate(cells):
+        name = _xlsx_cell_text(v) if v is not None else None
+        name = name if name is not None else f"Unnamed: {i}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def _iter_xlsx_frames(stream: BinaryIO, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """Blocchi di righe del primo foglio come DataFrame di stringhe (indice che prosegue tra i blocchi)."""
+    from openpyxl import load_workbook
+
+    stream.seek(0)
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        header: list[str] | None = None
+        width = 0
+        offset = 0
+        blank_rows = 0
+        rows: list[list] = []
+        for values in ws.iter_rows(values_only=True):
+            if header is None:
+                if any(_xlsx_cell_text(v) is not None for v in values):
+                    header = _xlsx_header(values)
+                    width = len(header)
+                continue
+            row = [_xlsx_cell_text(v) for v in values[:width]]
+            if all(x is None for x in row):
+                blank_rows += 1  # righe vuote: tenute solo se seguite da dati (pandas scarta quelle finali)
+                continue
+            row.extend([None] * (width - len(row)))
+            rows.extend([None] * width for _ in range(blank_rows))
+            blank_rows = 0
+            rows.append(row)
+            if len(rows) >= chunk_rows:
+                yield pd.DataFrame(rows, columns=header, index=pd.RangeIndex(offset, offset + len(rows)))
+                offset += len(rows)
+                rows = []
+        if rows:
+            yield pd.DataFrame(rows, columns=header, index=pd.RangeIndex(offset, offset + len(rows)))
+    finally:
+        wb.close()
+
+
+def iter_segmented_xlsx(
+    stream: BinaryIO,
+    chunk_rows: int = INGEST_CHUNK_ROWS,
+    progress: Progress | None = None,
+    on_scan: OnScan | None = None,
+) -> Iterator[list[SegmentedCustomer]]:
+    """
+    Segmenta un .xlsx in streaming (openpyxl read-only): memoria costante rispetto alla dimensione del foglio.
+    Stesso risultato di pd.read_excel(dtype=str) + parse_and_segment (soglie spesa come per il CSV).
+    """
+    stream = _seekable(stream)
+    scan = _scan_frames(_iter_xlsx_frames(stream, chunk_rows), "Il file è vuoto")
+    if on_scan is not None:
+        on_scan(scan)
+    frames = _iter_xlsx_frames(stream, _shard_rows(scan.total_rows, chunk_rows))
+    yield from _segment_frames(frames, scan, progress)
@@ -0,0 +1,296 @@
+"""
+Job di upload in background: l'upload restituisce subito un job_id, l'elaborazione gira su un pool
+di thread e lo stato (righe elaborate/scartate, tempo, analysis_id finale) si legge da GET /api/jobs/<id>.
+Coda limitata: oltre UPLOAD_JOB_QUEUE job attivi (in coda o in esecuzione) i nuovi upload vengono rifiutati.
+Con più worker gunicorn (state_dir) lo stato è pubblicato su file: qualsiasi worker risponde
+a GET /api/jobs/<id>, e DELETE lascia un segnale di annullamento letto dal worker che esegue il job.
+Un job rimasto "queued"/"running" nel file di un worker terminato (crash, riavvio) è segnato "failed".
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from app.store import valid_id
+
+UPLOAD_JOB_WORKERS = int(os.environ.get("UPLOAD_JOB_WORKERS", "2"))
+UPLOAD_JOB_QUEUE = int(os.environ.get("UPLOAD_JOB_QUEUE", "8"))
+# Job conclusi conservati per la consultazione dello stato (secondi)
+UPLOAD_JOB_TTL = int(os.environ.get("UPLOAD_JOB_TTL", "3600"))
+# Intervallo minimo tra due pubblicazioni dell'avanzamento su file (secondi)
+_PUBLISH_INTERVAL = 0.5
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class JobQueueFull(RuntimeError):
+    """Troppi job attivi: il chiamante riprova più tardi."""
+
+
+class JobCancelled(Exception):
+    """Sollevata dentro il job (a fine blocco) quando è stato richiesto l'annullamento."""
+
+
+class UploadJob:
+    """Stato di un job di upload; aggiornato dal thread di elaborazione, letto dalle richieste di stato."""
+
+    def __init__(self, filename: str, state_dir: str | None = None):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.status = QUEUED
+        self.rows_total: int | None = None
+        self.rows_processed = 0
+        self.rows_skipped = 0
+        self.analysis_id: str | None = None
+        self.error: str | None = None
+        self.created_at = time.monotonic()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._cancel = threading.Event()
+        self._future: Future | None = None
+        self._state_dir = state_dir
+        self._published_at = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def progress(self, rows: int, kept: int, total: int) -> None:
+        """Callback per blocco elaborato: aggiorna i contatori e interrompe il job se annullato."""
+        self.rows_total = total
+        self.rows_processed += rows
+        self.rows_skipped += rows - kept
+        self.publish(force=False)
+        if self.cancel_requested():
+            raise JobCancelled()
+
+    def cancel_requested(self) -> bool:
+        if self._cancel.is_set():
+            return True
+        if self._state_dir is not None and os.path.exists(_cancel_path(self._state_dir, self.id)):
+            self._cancel.set()  # DELETE arrivato su un altro worker
+            return True
+        return False
+
+    def publish(self, force: bool = True) -> None:
+        """Scrive lo stato su file per gli altri worker (l'avanzamento al massimo ogni _PUBLISH_INTERVAL)."""
+        if self._state_dir is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._published_at < _PUBLISH_INTERVAL:
+            return
+        self._published_at = now
+        state = self.to_dict()
+        state["created_at"] = time.time() - (now - self.created_at)
+        state["worker_pid"], state["worker_host"] = os.getpid(), socket.gethostname()
+        tmp = os.path.join(self._state_dir, f".{self.id}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, _state_path(self._state_dir, self.id))
+
+    def to_dict(self) -> dict:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_total": self.rows_total,
+            "rows_processed": self.rows_processed,
+            "rows_skipped": self.rows_skipped,
+            "elapsed_seconds": round(end - self.started_at, 3) if self.started_at is not None else 0.0,
+            "analysis_id": self.analysis_id,
+            "error": self.error,
+        }
+
+
+class JobSnapshot:
+    """Stato di un job eseguito da un altro worker, letto dal file pubblicato."""
+
+    def __init__(self, state: dict):
+        self.state = state
+        self.id = state["job_id"]
+        self.status = state["status"]
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def orphaned(self) -> bool:
+        """Attivo secondo il file, ma il worker che lo eseguiva non esiste più."""
+        if not self.active or self.state.get("worker_host", socket.gethostname()) != socket.gethostname():
+            return False  # processo di un'altra macchina: non verificabile
+        return not _process_alive(self.state.get("worker_pid"))
+
+    def to_dict(self) -> dict:
+        return {k: v for k, v in self.state.items() if k not in ("created_at", "worker_pid", "worker_host")}
+
+
+def _process_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return False  # i job di questo processo sono in UploadJobQueue._jobs: il file è di un processo precedente
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _state_path(state_dir: str, job_id: str) -> str:
+    return os.path.join(state_dir, f"{job_id}.json")
+
+
+def _cancel_path(state_dir: str, job_id: str) -> str:
+    return os.path.join(state_dir, f"{job_id}.cancel")
+
+
+class UploadJobQueue:
+    """Pool di thread per gli upload in background, con limite ai job attivi e scadenza dei job conclusi."""
+
+    def __init__(
+        self,
+        workers: int = UPLOAD_JOB_WORKERS,
+        max_active: int = UPLOAD_JOB_QUEUE,
+        ttl: int = UPLOAD_JOB_TTL,
+        state_dir: str | None = None,
+    ):
+        self.max_active = max_active
+        self.ttl = ttl
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs: dict[str, UploadJob] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-job")
+        if state_dir is not None:
+            self._sweep_state_dir()  # job lasciati a metà da un'esecuzione precedente
+
+    def submit(self, filename: str, work: Callable[[UploadJob], str], cleanup: Callable[[], None] | None = None) -> UploadJob:
+        """
+        Accoda work(job) → analysis_id. Errori del job: messaggio in job.error (stato "failed").
+        cleanup viene chiamato a fine job (anche se annullato prima di partire), es. per chiudere il file temporaneo.
+        """
+        job = self.reserve(filename)
+        self.start(job, work, cleanup)
+        return job
+
+    def reserve(self, filename: str) -> UploadJob:
+        """
+        Posto in coda per un job ("queued", conta tra gli attivi): JobQueueFull se non c'è posto.
+        Va chiesto prima di preparare l'input (es. copiare l'upload), poi start() o release().
+        """
+        with self._lock:
+            self._purge()
+            if sum(1 for j in self._jobs.values() if j.active) >= self.max_active:
+                raise JobQueueFull("Troppi caricamenti in corso. Riprova tra qualche minuto.")
+            job = UploadJob(filename, self.state_dir)
+            self._jobs[job.id] = job
+        job.publish()
+        return job
+
+    def start(self, job: UploadJob, work: Callable[[UploadJob], str], cleanup: Callable[[], None] | None = None) -> None:
+        """Avvia sul pool un job ottenuto da reserve() (vedi submit)."""
+        job._future = self._executor.submit(self._run, job, work)
+        if cleanup is not None:
+            job._future.add_done_callback(lambda _: cleanup())
+
+    def release(self, job: UploadJob) -> None:
+        """Libera il posto di un job riservato e mai avviato (preparazione dell'input fallita)."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        if self.state_dir is not None:
+            _remove_state(self.state_dir, job.id)
+
+    def _run(self, job: UploadJob, work: Callable[[UploadJob], str]) -> None:
+        job.started_at = time.monotonic()
+        job.status = RUNNING
+        job.publish()
+        try:
+            if job.cancel_requested():
+                raise JobCancelled()
+            job.analysis_id = work(job)
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = getattr(e, "description", None) or str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.monotonic()
+            job.publish()
+
+    def get(self, job_id: str) -> UploadJob | JobSnapshot | None:
+        job = self._jobs.get(job_id)
+        if job is not None or self.state_dir is None or not valid_id(job_id):
+            return job
+        try:
+            with open(_state_path(self.state_dir, job_id), encoding="utf-8") as f:
+                snapshot = JobSnapshot(json.load(f))
+        except (FileNotFoundError, ValueError):
+            return None
+        return self._fail_orphan(snapshot) if snapshot.orphaned else snapshot
+
+    def _fail_orphan(self, snapshot: JobSnapshot) -> JobSnapshot:
+        """Segna "failed" (nel file) un job il cui worker è terminato durante l'elaborazione."""
+        state = {**snapshot.state, "status": FAILED, "error": "Elaborazione interrotta: il worker è stato terminato. Ricarica il file."}
+        tmp = os.path.join(self.state_dir, f".{snapshot.id}.{threading.get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, _state_path(self.state_dir, snapshot.id))
+        return JobSnapshot(state)
+
+    def cancel(self, job_id: str) -> UploadJob | JobSnapshot | None:
+        """Annulla un job: se ancora in coda non parte, se in esecuzione si ferma alla fine del blocco corrente."""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return job
+        if isinstance(job, JobSnapshot):
+            open(_cancel_path(self.state_dir, job_id), "w").close()  # letto dal worker che esegue il job
+            return job
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            job.status = CANCELLED
+            job.finished_at = time.monotonic()
+            job.publish()
+        return job
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        expired = [jid for jid, j in self._jobs.items() if j.finished_at is not None and now - j.finished_at > self.ttl]
+        for jid in expired:
+            del self._jobs[jid]
+            if self.state_dir is not None:
+                _remove_state(self.state_dir, jid)
+        if self.state_dir is not None:
+            self._sweep_state_dir()
+
+    def _sweep_state_dir(self) -> None:
+        """File di stato degli altri worker: job orfani segnati "failed", conclusi da oltre ttl rimossi."""
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.state_dir):
+            job_id = entry.name[: -len(".json")]
+            if not entry.name.endswith(".json") or job_id in self._jobs:
+                continue
+            snapshot = self.get(job_id)  # segna gli orfani
+            try:
+                stale = snapshot is not None and not snapshot.active and entry.stat().st_mtime < cutoff
+            except FileNotFoundError:
+                continue
+            if stale:
+                _remove_state(self.state_dir, job_id)
+
+
+def _remove_state(state_dir: str, job_id: str) -> None:
+    for path in (_state_path(state_dir, job_id), _cancel_path(state_dir, job_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -2,104 +2,342 @@
 Backend Flask: upload Excel, segmentazione, campagne, dashboard data.
 Compatibile Python 3.14 (no Pydantic/FastAPI). Nessun export Excel; risultati via API.
 """
+import base64
 import csv
+import hashlib
 import io
+import os
+import shutil
+import tempfile
+import threading
 import uuid
+import zipfile
 from collections import defaultdict
-from datetime import date, datetime
+from datetime import datetime
 from typing import Optional
 
+import numpy as np
 import pandas as pd
 from flask import Flask, jsonify, request, abort
+from openpyxl.utils.exceptions import InvalidFileException
+from werkzeug.exceptions import HTTPException
 
+from app.aggregates import AggregateCache
+from app.analysis import AnalysisBuilder, ColumnarAnalysis, effective_revenues
 from app.campaigns import get_all_campaigns_by_segment
-from app.excel_parser import parse_and_segment
-from app.models import Segment, SegmentedCustomer
-from app.operator_refinement import get_indicatori_definitions, segment_from_operator_input
+from app.feedback import open_feedback_store
+from app.filters import CustomerQuery, bitmap_count, match_bitmap, match_mask, parse_query
+from app.ingest import EmptyFileError, IngestScan, OnScan, Progress, iter_segmented_csv, iter_segmented_xlsx, segment_dataframe
+from app.jobs import JobCancelled, JobQueueFull, UploadJobQueue
+from app.models import SEGMENT_CODES, SEGMENTS_BY_CODE, Segment, SegmentedCustomer
+from app.operator_notes import NotesFileError, read_notes_file
+from app.operator_refinement import clean_operator_input, get_indicatori_definitions, operator_input_segment, operator_input_segments
+from app.scoring import SCORING_VERSION
+from app.segments import EffectiveSegments, operator_segment
+from app.sorting import decode_cursor, encode_cursor, sort_order
+from app.store import ANALYSIS_STORE, ANALYSIS_STORE_DIR, open_store
+from app.trend import GRANULARITIES, trend
 
 try:
     from flask_cors import CORS
 except ImportError:
     CORS = None
 
-# In-memory store (in produzione usare PostgreSQL)
-_store: dict[str, list[SegmentedCustomer]] = {}
-# Feedback operatore per segmento: analysis_id -> row_index -> { segment?, ...campi_manuali, updated_at }
+# Store analisi (ANALYSIS_STORE=disk persistente e condiviso tra i worker gunicorn, memory nel processo):
+# un'analisi colonnare per upload con soglie spesa e dati dell'upload, più la cache upload sha256(contenuto) + tipo file + versione scoring -> analysis_id già elaborato
+# (valida solo finché l'analisi è nello store; altrimenti il file viene rielaborato).
+_store = open_store()
+# Feedback operatore per segmento: (analysis_id, row_index) -> { segment?, ...campi_manuali, updated_at }
 # Usato per apprendere e aggiornare lo scoring (modello statistico / aggiustamento pesi)
-_operator_feedback: dict[str, dict[int, dict]] = {}
+_operator_feedback = open_feedback_store()
+# Segmenti visualizzati (modello + feedback) per analisi aperta: posting list e conteggi, per versione del feedback
+_segment_views: dict[str, EffectiveSegments] = {}
+_segment_views_lock = threading.Lock()
+# Risultati di overview / marketing / trend per analisi e versione del feedback
+_aggregates = AggregateCache()
+
+
+def _on_store_evict(analysis_id: str, dropped: bool) -> None:
+    """Analisi rilasciata dallo store (budget memoria / inattività): i dati derivati seguono la stessa sorte."""
+    _segment_views.pop(analysis_id, None)
+    _aggregates.evict(analysis_id)
+    _operator_feedback.evict(analysis_id, dropped)
+
+
+_store.on_evict = _on_store_evict
+_store.cleanup()  # analisi oltre la retention (STORE_RETENTION_DAYS / STORE_MAX_ANALYSES), con il loro feedback
+_HASH_BUFFER = 1 << 20
+# Clienti per richiesta su POST .../customers/batch
+BATCH_MAX = int(os.environ.get("BATCH_MAX", "1000"))
+# Record per richiesta su POST .../feedback/bulk e .../feedback/upload (note da gestionale)
+BULK_FEEDBACK_MAX = int(os.environ.get("BULK_FEEDBACK_MAX", "50000"))
+# Upload in background (POST /api/upload?async=1): coda limitata, stato su /api/jobs/<id>
+_upload_jobs = UploadJobQueue(state_dir=os.path.join(ANALYSIS_STORE_DIR, "jobs") if ANALYSIS_STORE != "memory" else None)
 
 app = Flask(__name__)
 if CORS is not None:
-    import os
     _origins = os.environ.get("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000").strip().split(",")
     _origins = [o.strip() for o in _origins if o.strip()]
-    CORS(app, origins=_origins, supports_credentials=True)
+    CORS(app, origins=_origins, supports_credentials=True, expose_headers=["X-Next-Cursor"])
 
 
 @app.route("/api/upload", methods=["POST"])
 def upload_excel():
-    """Carica file Excel con dati arrivi. Restituisce analysis_id (nessun file in output)."""
-    file = request.files.get("file")
-    if not file or not file.filename:
-        abort(400, "Nessun file caricato")
-    fn = file.filename.lower()
-    if not (fn.endswith(".xlsx") or fn.endswith(".xls") or fn.endswith(".csv")):
-        abort(400, "File deve essere .xlsx, .xls o .csv")
+    """
+    Carica file Excel con dati arrivi. Restituisce analysis_id (nessun file in output).
+    Con ?async=1 restituisce subito un job (202): elaborazione in background, stato su GET /api/jobs/<job_id>.
+    Con ?async=1 nella query il posto in coda è riservato prima di ricevere il file (503 se la coda è piena).
+    """
+    job = _reserve_upload_job() if _async_requested(request.args) else None
     try:
-        contents = file.read()
-        if fn.endswith(".csv"):
-            try:
-                text = contents.decode("utf-8")
-            except UnicodeDecodeError:
-                text = contents.decode("latin-1")
-            # Lettura CSV con stdlib per evitare errori "expected pattern" di pandas
-            reader = csv.DictReader(io.StringIO(text), delimiter=",", quotechar='"')
-            rows = list(reader)
-            if not rows:
-                abort(400, "Il file CSV è vuoto")
-            df = pd.DataFrame(rows)
-        else:
-            # .xlsx con openpyxl; .xls con xlrd (se installato)
-            engine = "openpyxl" if fn.endswith(".xlsx") else None
-            try:
-                df = pd.read_excel(io.BytesIO(contents), engine=engine, dtype=str)
-            except Exception as xls_err:
-                if fn.endswith(".xls"):
-                    abort(400, "File .xls non supportato. In Excel: File → Salva con nome → formato 'Cartella di lavoro Excel (.xlsx)' o 'CSV UTF-8', poi ricarica.")
-                raise xls_err
-            df = df.replace({"nan": None, "": None, "NaN": None})
+        file = request.files.get("file")
+        if not file or not file.filename:
+            abort(400, "Nessun file caricato")
+        fn = file.filename.lower()
+        if not (fn.endswith(".xlsx") or fn.endswith(".xls") or fn.endswith(".csv")):
+            abort(400, "File deve essere .xlsx, .xls o .csv")
+        if job is None and _async_requested(request.form):
+            job = _reserve_upload_job()
+    except BaseException:
+        if job is not None:
+            _upload_jobs.release(job)
+        raise
+    if job is not None:
+        return _start_upload_job(job, file.stream, fn)
+    return jsonify(_analyze_upload(file.stream, fn))
+
+
+def _async_requested(params) -> bool:
+    return (params.get("async") or "").lower() in ("1", "true", "yes")
+
+
+def _analyze_upload(stream, fn: str, progress: Optional[Progress] = None) -> dict:
+    """Segmenta il file (o riusa l'analisi di un file identico) e restituisce la risposta di upload."""
+    cache_key = _upload_cache_key(stream, fn)
+    cached_id = _store.find_upload(cache_key)
+    cached = _store.get(cached_id) if cached_id is not None else None
+    if cached is not None:
+        return {
+            "analysis_id": cached_id,
+            "total_arrivals": len(cached),
+            "message": "File già elaborato. Usa analysis_id per la dashboard.",
+            "cached": True,
+        }
+    meta = {"filename": fn, "scoring_version": SCORING_VERSION, "created_at": datetime.utcnow().isoformat() + "Z"}
+
+    def on_scan(scan: IngestScan) -> None:
+        meta.update(threshold_top25=scan.threshold_top25, media_spesa=scan.media_spesa, rows_total=scan.total_rows)
+
+    if fn.endswith(".csv"):
+        analysis = _segment_stream_upload(iter_segmented_csv, stream, progress, on_scan)
+    elif fn.endswith(".xlsx"):
+        analysis = _segment_stream_upload(iter_segmented_xlsx, stream, progress, on_scan)
+    else:
+        analysis = ColumnarAnalysis.from_customers(_segment_excel_upload(stream.read(), fn, progress, on_scan))
+    if not analysis:
+        abort(400, "Nessuna riga analizzata. Controlla che il file abbia la prima riga con le intestazioni (es. numero notti, numero ospiti, canale, data arrivo, ...). Vedi istruzioni nella pagina.")
+    analysis.meta.update(meta)
+    analysis_id = str(uuid.uuid4())
+    _store.put(analysis_id, analysis, upload_key=cache_key)
+    return {
+        "analysis_id": analysis_id,
+        "total_arrivals": len(analysis),
+        "message": "File elaborato. Usa analysis_id per la dashboard.",
+        "cached": False,
+    }
+
+
+def _reserve_upload_job():
+    """Posto in coda per un upload in background, prima di scriverne il contenuto su disco; 503 se la coda è piena."""
+    try:
+        return _upload_jobs.reserve("")  # nome file impostato da _start_upload_job
+    except JobQueueFull as e:
+        abort(503, str(e))
+
+
+def _start_upload_job(job, stream, fn: str):
+    """Copia l'upload su file temporaneo (lo stream della richiesta non sopravvive) e avvia il job riservato."""
+    job.filename = fn
+    tmp = tempfile.TemporaryFile()
+    try:
+        shutil.copyfileobj(stream, tmp, _HASH_BUFFER)
+        tmp.seek(0)
+    except BaseException:
+        tmp.close()
+        _upload_jobs.release(job)
+        raise
+    _upload_jobs.start(job, lambda job: _analyze_upload(tmp, fn, job.progress)["analysis_id"], cleanup=tmp.close)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_upload_job(job_id: str):
+    """Stato di un upload in background: righe elaborate/scartate, tempo trascorso, analysis_id finale."""
+    job = _upload_jobs.get(job_id)
+    if job is None:
+        abort(404, "Job non trovato")
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_upload_job(job_id: str):
+    """Annulla un upload in background (in coda: non parte; in esecuzione: si ferma a fine blocco)."""
+    job = _upload_jobs.cancel(job_id)
+    if job is None:
+        abort(404, "Job non trovato")
+    return jsonify(job.to_dict())
+
+
+def _upload_cache_key(stream, fn: str) -> str:
+    """Hash del contenuto letto a blocchi (lo stream torna all'inizio per l'elaborazione)."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(_HASH_BUFFER), b""):
+        digest.update(block)
+    stream.seek(0)
+    ext = fn.rsplit(".", 1)[-1]
+    return f"{SCORING_VERSION}:{ext}:{digest.hexdigest()}"
+
+
+def _abort_read_error(e: Exception):
+    err_msg = str(e)
+    if "pattern" in err_msg.lower() or "match" in err_msg.lower() or "expected" in err_msg.lower():
+        abort(400, "File non leggibile. Usa un CSV con virgola come separatore (prima riga = intestazioni).")
+    abort(400, f"File non valido: {err_msg}")
+
+
+def _abort_parse_error(e: Exception):
+    err_msg = str(e)
+    if "pattern" in err_msg.lower() or "match" in err_msg.lower() or "expected" in err_msg.lower():
+        abort(400, "Errore nei dati. Controlla date e numeri (usa formato 2024-01-15 per le date).")
+    abort(400, f"Errore elaborazione: {err_msg}")
+
+
+def _segment_stream_upload(
+    iter_segmented, stream, progress: Optional[Progress] = None, on_scan: Optional[OnScan] = None
+) -> ColumnarAnalysis:
+    """CSV/.xlsx in streaming a blocchi: memoria limitata a un blocco di righe più le colonne dei risultati."""
+    builder = AnalysisBuilder()
+    try:
+        for chunk in iter_segmented(stream, progress=progress, on_scan=on_scan):
+            builder.add(chunk)
+    except JobCancelled:
+        raise
+    except EmptyFileError as e:
+        abort(400, str(e))
+    except (csv.Error, zipfile.BadZipFile, InvalidFileException) as e:
+        _abort_read_error(e)
     except Exception as e:
-        err_msg = str(e)
-        if "pattern" in err_msg.lower() or "match" in err_msg.lower() or "expected" in err_msg.lower():
-            abort(400, "File non leggibile. Usa un CSV con virgola come separatore (prima riga = intestazioni).")
-        abort(400, f"File non valido: {err_msg}")
+        _abort_parse_error(e)
+    return builder.build()
+
+
+def _segment_excel_upload(
+    contents: bytes, fn: str, progress: Optional[Progress] = None, on_scan: Optional[OnScan] = None
+) -> list[SegmentedCustomer]:
+    """.xls (xlrd, se installato): lettura completa con pandas."""
+    try:
+        try:
+            df = pd.read_excel(io.BytesIO(contents), dtype=str)
+        except Exception:
+            abort(400, "File .xls non supportato. In Excel: File → Salva con nome → formato 'Cartella di lavoro Excel (.xlsx)' o 'CSV UTF-8', poi ricarica.")
+        df = df.replace({"nan": None, "": None, "NaN": None})
+    except HTTPException:
+        raise
+    except Exception as e:
+        _abort_read_error(e)
     if df.empty:
         abort(400, "Il file è vuoto")
     try:
-        customers, _ = parse_and_segment(df)
+        customers = segment_dataframe(df, on_scan)
     except Exception as e:
-        err_msg = str(e)
-        if "pattern" in err_msg.lower() or "match" in err_msg.lower() or "expected" in err_msg.lower():
-            abort(400, "Errore nei dati. Controlla date e numeri (usa formato 2024-01-15 per le date).")
-        abort(400, f"Errore elaborazione: {err_msg}")
-    if not customers:
-        abort(400, "Nessuna riga analizzata. Controlla che il file abbia la prima riga con le intestazioni (es. numero notti, numero ospiti, canale, data arrivo, ...). Vedi istruzioni nella pagina.")
-    analysis_id = str(uuid.uuid4())
-    _store[analysis_id] = customers
-    return jsonify({
-        "analysis_id": analysis_id,
-        "total_arrivals": len(customers),
-        "message": "File elaborato. Usa analysis_id per la dashboard.",
-    })
+        _abort_parse_error(e)
+    if progress is not None:
+        progress(len(df), len(customers), len(df))
+    return customers
+
+
+def _get_analysis(analysis_id: str) -> ColumnarAnalysis:
+    analysis = _store.get(analysis_id)
+    if not analysis:
+        abort(404, "Analisi non trovata")
+    return analysis
+
+
+def _effective_segments(analysis_id: str, analysis: ColumnarAnalysis) -> EffectiveSegments:
+    """
+    Segmenti visualizzati dell'analisi, ricostruiti solo se il feedback è cambiato senza passare da
+    _apply_feedback (salvato da un altro worker, o salvataggi concorrenti).
+    """
+    version = _operator_feedback.version(analysis_id)
+    with _segment_views_lock:
+        view = _segment_views.get(analysis_id)
+        if view is None or view.version != version or view.analysis is not analysis:
+            view = EffectiveSegments(analysis, _operator_feedback.segments(analysis_id), version)
+            _segment_views[analysis_id] = view
+        return view
 
 
-def _effective_revenue(c) -> float:
-    """Revenue del cliente: da campo revenue o, se mancante, spesa_media * numero_notti."""
-    if c.revenue is not None and c.revenue > 0:
-        return float(c.revenue)
-    if c.spesa_media is not None and c.numero_notti is not None and c.numero_notti > 0:
-        return c.spesa_media * c.numero_notti
-    return 0.0
+def _apply_feedback(analysis_id: str, analysis: ColumnarAnalysis, updates: list[tuple[int, Optional[str]]]) -> None:
+    """
+    Feedback appena salvato (row_index, segmento): se sono gli unici salvataggi dall'ultima versione vista,
+    pubblica la vista successiva con i clienti spostati in O(1) ciascuno (EffectiveSegments.moved; la vista
+    precedente resta intatta per le richieste che la stanno leggendo); altrimenti la prossima lettura ricostruisce.
+    """
+    version = _operator_feedback.version(analysis_id)
+    with _segment_views_lock:
+        view = _segment_views.get(analysis_id)
+        if view is None or view.analysis is not analysis or version != view.version + len(updates):
+            return
+        positions = [analysis.position(row_index) for row_index, _ in updates]
+        if None in positions:
+            return
+        moves = [(pos, operator_segment(segment)) for pos, (_, segment) in zip(positions, updates)]
+        _segment_views[analysis_id] = view.moved(moves, version)
+
+
+def _parse_query() -> Optional[CustomerQuery]:
+    """Filtri clienti della richiesta (vedi app/filters.py), None se assenti."""
+    try:
+        return parse_query(request.args)
+    except ValueError:
+        abort(400, "Filtro non valido")
+
+
+def _parse_segment(value: str) -> int:
+    try:
+        return SEGMENT_CODES[Segment(value)]
+    except ValueError:
+        abort(400, "Segmento non valido")
+
+
+def _get_customer(analysis: ColumnarAnalysis, row_index: int) -> SegmentedCustomer:
+    pos = analysis.position(row_index)
+    if pos is None:
+        abort(404, "Cliente non trovato")
+    return analysis.customer(pos)
+
+
+def _customer_dict(c: SegmentedCustomer) -> dict:
+    return {
+        "row_index": c.row_index,
+        "segment": c.segment.value,
+        "scores": c.scores.to_dict(),
+        "numero_notti": c.numero_notti,
+        "numero_ospiti": c.numero_ospiti,
+        "canale": c.canale,
+        "giorno_arrivo": c.giorno_arrivo,
+        "storico_soggiorni": c.storico_soggiorni,
+        "spesa_media": c.spesa_media,
+        "cliente_id": c.cliente_id,
+        "nome_cliente": c.nome_cliente,
+        "data_arrivo": c.data_arrivo,
+        "categoria_camera": c.categoria_camera,
+        "revenue": c.revenue,
+        "anticipo_giorni": c.anticipo_giorni,
+        "prenotante": c.prenotante,
+        "numero_bambini": c.numero_bambini,
+    }
 
 
 def _scores_with_operator_boost(scores_dict: dict, chosen_segment: str) -> dict:
@@ -113,33 +351,48 @@ def _scores_with_operator_boost(scores_dict: dict, chosen_segment: str) -> dict:
     return out
 
 
-def _effective_adr(c) -> float:
-    """ADR del cliente: spesa_media o, se mancante, revenue / numero_notti."""
-    if c.spesa_media is not None and c.spesa_media > 0:
-        return float(c.spesa_media)
-    if c.revenue is not None and c.numero_notti is not None and c.numero_notti > 0:
-        return c.revenue / c.numero_notti
-    return 0.0
-
-
 @app.route("/api/analysis/<analysis_id>/overview")
 def get_overview(analysis_id: str):
-    """KPI overview: totale arrivi, distribuzione segmenti, ADR, revenue, valore cliente medio."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    total = len(customers)
-    by_segment = defaultdict(list)
-    for c in customers:
-        by_segment[c.segment].append(c)
+    """
+    KPI overview: totale arrivi, distribuzione segmenti, ADR, revenue, valore cliente medio.
+    Con i filtri clienti (canale, data_da, ..., vedi app/filters.py) i KPI sono calcolati sui soli clienti selezionati.
+    """
+    query = _parse_query()
+    if query is None:
+        return jsonify(_cached_aggregate(analysis_id, "overview", _overview))
+    return jsonify(_cached_aggregate(
+        analysis_id, ("overview", query), lambda analysis, segments: _overview(analysis, segments, query)
+    ))
+
+
+def _cached_aggregate(analysis_id: str, key, compute) -> dict:
+    """Aggregato dalla cache per la versione corrente del feedback, altrimenti compute(analysis, segments)."""
+    analysis = _get_analysis(analysis_id)
+    segments = _effective_segments(analysis_id, analysis)
+    return _aggregates.get(analysis_id, key, segments.version, lambda: compute(analysis, segments))
+
+
+def _overview(analysis: ColumnarAnalysis, segments: EffectiveSegments, query: Optional[CustomerQuery] = None) -> dict:
+    """Senza filtri dai contatori per segmento (aggiornati a ogni feedback); con filtri sulle righe selezionate."""
+    if query is None:
+        counts, revenue_by_seg, notti_by_seg, _ = segments.totals()
+        total = len(analysis)
+    else:
+        n_seg = len(SEGMENTS_BY_CODE)
+        mask = match_mask(analysis, query)
+        codes = segments.codes()[mask]
+        notti, notti_null = analysis.numbers("numero_notti")
+        counts = np.bincount(codes, minlength=n_seg)
+        revenue_by_seg = np.bincount(codes, weights=effective_revenues(analysis)[mask], minlength=n_seg)
+        notti_by_seg = np.bincount(codes, weights=np.where(notti_null, 0, notti)[mask].astype(np.float64), minlength=n_seg)
+        total = len(codes)
     segment_stats = []
     for seg in Segment:
-        list_c = by_segment.get(seg, [])
-        count = len(list_c)
+        code = SEGMENT_CODES[seg]
+        count = int(counts[code])
         pct = (count / total * 100) if total else 0
-        revenues = [_effective_revenue(c) for c in list_c]
-        rev_tot = sum(revenues)
-        notti_seg = sum((c.numero_notti or 0) for c in list_c)
+        rev_tot = float(revenue_by_seg[code])
+        notti_seg = float(notti_by_seg[code])
         adr = (rev_tot / notti_seg) if notti_seg else 0
         val_medio = (rev_tot / count) if count else 0
         segment_stats.append({
@@ -151,102 +404,141 @@ def get_overview(analysis_id: str):
             "valore_cliente_medio": round(val_medio, 2),
         })
     total_revenue = sum(s["revenue_totale"] for s in segment_stats)
-    total_notti = sum((c.numero_notti or 0) for c in customers)
+    total_notti = int(notti_by_seg.sum())
     overall_adr = (total_revenue / total_notti) if total_notti else 0
-    return jsonify({
+    return {
         "total_arrivals": total,
         "total_revenue": round(total_revenue, 2),
         "adr_medio_generale": round(overall_adr, 2),
         "valore_cliente_medio_generale": round(total_revenue / total, 2) if total else 0,
         "segment_distribution": segment_stats,
-    })
+    }
 
 
 @app.route("/api/analysis/<analysis_id>/customers")
 def get_customers(analysis_id: str):
-    """Tabella clienti filtrabile per segmento, con score dettagliato."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
+    """
+    Tabella clienti filtrabile per segmento visualizzato (modello o feedback operatore), con score dettagliato.
+    Paginazione con skip/limit (fetta della posting list del segmento o dell'intervallo di posizioni) oppure,
+    con sort=campo|-campo (vedi SORT_FIELDS) e/o cursor, a cursore: header X-Next-Cursor per la pagina successiva.
+    Filtri aggiuntivi (canale, prenotante, categoria_camera, data_da/data_a, notti_min/notti_max, bambini,
+    alta_spesa, op=and|or): vedi app/filters.py.
+    """
+    analysis = _get_analysis(analysis_id)
+    segments = _effective_segments(analysis_id, analysis)
     segment = request.args.get("segment")
-    if segment:
-        try:
-            seg_enum = Segment(segment)
-        except ValueError:
-            abort(400, "Segmento non valido")
-        customers = [c for c in customers if c.segment == seg_enum]
+    code = _parse_segment(segment) if segment else None
+    query = _parse_query()
+    mask = match_mask(analysis, query) if query is not None else None
+    sort = request.args.get("sort", "")
+    cursor = request.args.get("cursor")
     try:
         skip = max(0, int(request.args.get("skip", 0)))
         limit = max(1, min(500, int(request.args.get("limit", 100))))
     except (TypeError, ValueError):
         skip, limit = 0, 100
+    if sort or cursor:
+        after = None
+        if cursor:
+            try:
+                cursor_sort, after = decode_cursor(cursor)
+            except ValueError:
+                abort(400, "Cursore non valido")
+            if sort and sort != cursor_sort:
+                abort(400, "Il cursore appartiene a un altro ordinamento")
+            sort = cursor_sort
+        try:
+            order = segments.order(code, sort) if code is not None else sort_order(analysis, sort)
+        except ValueError:
+            abort(400, "Ordinamento non valido")
+        if mask is not None:
+            order = order.subset(mask)
+        page, last = order.page(after, limit)
+    else:
+        rows = segments.positions(code) if code is not None else None
+        if mask is not None:
+            rows = rows[mask[rows]] if rows is not None else np.flatnonzero(mask)
+        total = len(rows) if rows is not None else len(analysis)
+        page = rows[skip : skip + limit] if rows is not None else np.arange(min(skip, total), min(skip + limit, total))
+        last = (float(page[-1]), int(page[-1])) if skip + limit < total else None  # cursore in ordine del file
     out = []
-    for c in customers[skip : skip + limit]:
-        out.append({
-            "row_index": c.row_index,
-            "segment": c.segment.value,
-            "scores": c.scores.to_dict(),
-            "numero_notti": c.numero_notti,
-            "numero_ospiti": c.numero_ospiti,
-            "canale": c.canale,
-            "giorno_arrivo": c.giorno_arrivo,
-            "storico_soggiorni": c.storico_soggiorni,
-            "spesa_media": c.spesa_media,
-            "cliente_id": c.cliente_id,
-            "nome_cliente": c.nome_cliente,
-            "data_arrivo": c.data_arrivo,
-            "categoria_camera": c.categoria_camera,
-            "revenue": c.revenue,
-            "anticipo_giorni": c.anticipo_giorni,
-            "prenotante": c.prenotante,
-            "numero_bambini": c.numero_bambini,
-        })
-    return jsonify(out)
+    for pos, c in zip(page.tolist(), analysis.customers(page)):
+        row = _customer_dict(c)
+        chosen = segments.chosen_segment(pos)
+        if chosen is not None:
+            row["segment"] = chosen.value
+            row["scores"] = _scores_with_operator_boost(row["scores"], chosen.value)
+        out.append(row)
+    response = jsonify(out)
+    if last is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(sort, last)
+    return response
 
 
 @app.route("/api/analysis/<analysis_id>/customer/<int:row_index>", methods=["GET"])
 def get_customer(analysis_id: str, row_index: int):
     """Dettaglio singolo cliente per scheda (percentuali segmenti). Include feedback operatore se presente."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    found = next((c for c in customers if c.row_index == row_index), None)
-    if not found:
-        abort(404, "Cliente non trovato")
-    feedback = (_operator_feedback.get(analysis_id) or {}).get(row_index)
-    segment_display = found.segment.value
-    scores_out = found.scores.to_dict()
-    if feedback and feedback.get("segment"):
-        seg = feedback["segment"]
-        if seg == "Premium":
-            seg = "Leisure"  # retrocompat: Premium fusionato in Leisure
-        try:
-            Segment(seg)  # valida
-            segment_display = seg
-            scores_out = _scores_with_operator_boost(scores_out, seg)
-        except ValueError:
-            pass
-    out = {
-        "row_index": found.row_index,
-        "segment": segment_display,
-        "scores": scores_out,
-        "numero_notti": found.numero_notti,
-        "numero_ospiti": found.numero_ospiti,
-        "canale": found.canale,
-        "giorno_arrivo": found.giorno_arrivo,
-        "storico_soggiorni": found.storico_soggiorni,
-        "spesa_media": found.spesa_media,
-        "cliente_id": found.cliente_id,
-        "nome_cliente": found.nome_cliente,
-        "data_arrivo": found.data_arrivo,
-        "categoria_camera": found.categoria_camera,
-        "revenue": found.revenue,
-        "anticipo_giorni": found.anticipo_giorni,
-        "prenotante": found.prenotante,
-        "numero_bambini": found.numero_bambini,
-        "operator_feedback": feedback,
-    }
-    return jsonify(out)
+    found = _get_customer(_get_analysis(analysis_id), row_index)
+    return jsonify(_customer_detail(found, _operator_feedback.get(analysis_id, row_index)))
+
+
+def _customer_detail(c: SegmentedCustomer, feedback: Optional[dict]) -> dict:
+    """Cliente con segmento e score aggiornati dal feedback operatore (se presente) e il feedback stesso."""
+    out = _customer_dict(c)
+    chosen = operator_segment(feedback.get("segment")) if feedback else None
+    if chosen is not None:
+        out["segment"] = chosen.value
+        out["scores"] = _scores_with_operator_boost(out["scores"], chosen.value)
+    out["operator_feedback"] = feedback
+    return out
+
+
+@app.route("/api/analysis/<analysis_id>/customers/batch", methods=["POST"])
+def get_customers_batch(analysis_id: str):
+    """
+    Dettaglio di più clienti in una richiesta (gruppi di arrivi, campagne), come GET .../customer/<row_index>.
+    Body (anche combinati): { "row_indexes"?: [..], "ranges"?: [[da, a], ..] (estremi inclusi),
+    "bitmap"?: { "start": row_index del primo bit, "bits": base64 dei bit, il più significativo per primo } }.
+    Risposta nell'ordine richiesto, senza duplicati; i row_index assenti dall'analisi in "missing".
+    """
+    analysis = _get_analysis(analysis_id)
+    row_indexes = _batch_row_indexes(request.get_json(silent=True) or {})
+    positions = analysis.positions(np.array(row_indexes, dtype=np.int64)).tolist()
+    found = [(r, p) for r, p in zip(row_indexes, positions) if p >= 0]
+    feedback = _operator_feedback.get_many(analysis_id, [r for r, _ in found])
+    customers = analysis.customers(p for _, p in found)
+    return jsonify({
+        "customers": [_customer_detail(c, feedback.get(r)) for (r, _), c in zip(found, customers)],
+        "missing": [r for r, p in zip(row_indexes, positions) if p < 0],
+    })
+
+
+def _batch_row_indexes(data: dict) -> list[int]:
+    """
+    row_index richiesti da row_indexes / ranges / bitmap, senza duplicati; 400 se non validi (come
+    _record_row_index: niente 3.7, true, negativi o oltre int64) o oltre BATCH_MAX.
+    """
+    try:
+        requested = [_record_row_index(r) for r in data.get("row_indexes") or []]
+        ranges = [(_record_row_index(lo), _record_row_index(hi)) for lo, hi in data.get("ranges") or []]
+        bitmap = data.get("bitmap")
+        bits = None
+        if bitmap:
+            start = _record_row_index(bitmap.get("start", 0))
+            bits = np.unpackbits(np.frombuffer(base64.b64decode(bitmap["bits"], validate=True), dtype=np.uint8))
+            if start + len(bits) - 1 > _ROW_INDEX_MAX:
+                raise ValueError(start)
+    except (AttributeError, TypeError, ValueError, KeyError):
+        abort(400, "Richiesta non valida: row_indexes, ranges [[da, a]] o bitmap {start, bits}")
+    total = len(requested) + sum(max(0, hi - lo + 1) for lo, hi in ranges)
+    total += int(np.count_nonzero(bits)) if bits is not None else 0
+    if total > BATCH_MAX:
+        abort(400, f"Troppi clienti richiesti (max {BATCH_MAX})")
+    for lo, hi in ranges:
+        requested.extend(range(lo, hi + 1))
+    if bits is not None:
+        requested.extend((np.flatnonzero(bits) + start).tolist())
+    return list(dict.fromkeys(requested))
 
 
 @app.route("/api/analysis/<analysis_id>/customer/<int:row_index>/feedback", methods=["POST"])
@@ -256,47 +548,15 @@ def save_operator_feedback(analysis_id: str, row_index: int):
     Il segmento viene ricalcolato solo da indicatori e testo (note/richieste).
     Body: { "note_prenotazione"?, "richieste_speciali"?, "servizi_selezionati"?, "indicatori"?: [] }
     """
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    found = next((c for c in customers if c.row_index == row_index), None)
-    if not found:
-        abort(404, "Cliente non trovato")
-    data = request.get_json(silent=True) or {}
-    note_prenotazione = (data.get("note_prenotazione") or "").strip() or None
-    richieste_speciali = (data.get("richieste_speciali") or "").strip() or None
-    servizi_selezionati = data.get("servizi_selezionati")
-    if servizi_selezionati is not None and not isinstance(servizi_selezionati, list):
-        servizi_selezionati = [servizi_selezionati]
-    indicatori = data.get("indicatori")
-    if indicatori is not None and not isinstance(indicatori, list):
-        indicatori = [indicatori] if indicatori else []
-
-    segment_computed = None
-    if indicatori or note_prenotazione or richieste_speciali or servizi_selezionati:
-        segment_computed = segment_from_operator_input(
-            indicatori=indicatori or None,
-            note_prenotazione=note_prenotazione,
-            richieste_speciali=richieste_speciali,
-            servizi_selezionati=servizi_selezionati,
-        ).value
-
-    segment_final = segment_computed
-    if segment_final is None and analysis_id in _operator_feedback and row_index in _operator_feedback[analysis_id]:
-        segment_final = _operator_feedback[analysis_id][row_index].get("segment")
-
-    if analysis_id not in _operator_feedback:
-        _operator_feedback[analysis_id] = {}
-    payload = {
-        "note_prenotazione": note_prenotazione,
-        "richieste_speciali": richieste_speciali,
-        "servizi_selezionati": servizi_selezionati,
-        "indicatori": indicatori,
-        "segment_computed": segment_computed,
-        "segment": segment_final,
-        "updated_at": datetime.utcnow().isoformat() + "Z",
-    }
-    _operator_feedback[analysis_id][row_index] = payload
+    analysis = _get_analysis(analysis_id)
+    found = _get_customer(analysis, row_index)
+    inputs = clean_operator_input(request.get_json(silent=True) or {})
+    segment_computed = operator_input_segment(inputs)
+    previous = _operator_feedback.get(analysis_id, row_index) if segment_computed is None else None
+    payload = _feedback_payload(inputs, segment_computed, previous, datetime.utcnow().isoformat() + "Z")
+    segment_final = payload["segment"]
+    _operator_feedback.put(analysis_id, row_index, payload)
+    _apply_feedback(analysis_id, analysis, [(row_index, segment_final)])
     return jsonify({
         "ok": True,
         "message": "Input operatore salvato. Segmento aggiornato in base a note, richieste e indicatori." if segment_final else "Input salvato.",
@@ -305,73 +565,161 @@ def save_operator_feedback(analysis_id: str, row_index: int):
     })
 
 
+def _feedback_payload(inputs: dict, segment_computed: Optional[str], previous: Optional[dict], updated_at: str) -> dict:
+    """Payload salvato: input operatore, segmento calcolato; senza input resta il segmento del feedback precedente."""
+    segment_final = segment_computed
+    if segment_final is None and previous is not None:
+        segment_final = previous.get("segment")
+    return {**inputs, "segment_computed": segment_computed, "segment": segment_final, "updated_at": updated_at}
+
+
+@app.route("/api/analysis/<analysis_id>/feedback/bulk", methods=["POST"])
+def save_operator_feedback_bulk(analysis_id: str):
+    """
+    Salva l'input operatore di molti clienti in una richiesta (stesse regole di POST .../customer/<row_index>/feedback).
+    Body: { "records": [{ "row_index", "note_prenotazione"?, "richieste_speciali"?, "servizi_selezionati"?, "indicatori"? }, ..] }
+    (o direttamente la lista). Massimo BULK_FEEDBACK_MAX record, scritti in una sola transazione.
+    """
+    analysis = _get_analysis(analysis_id)
+    data = request.get_json(silent=True)
+    records = data.get("records") if isinstance(data, dict) else data
+    if not isinstance(records, list):
+        abort(400, "Richiesta non valida: records deve essere una lista")
+    return jsonify(_save_feedback_records(analysis_id, analysis, records))
+
+
+@app.route("/api/analysis/<analysis_id>/feedback/upload", methods=["POST"])
+def upload_operator_notes(analysis_id: str):
+    """
+    Importa un file note da gestionale (.csv o .xlsx, vedi app/operator_notes.py): colonna row_index (o riga)
+    più note, richieste, servizi, indicatori. Stesso salvataggio di POST .../feedback/bulk.
+    """
+    analysis = _get_analysis(analysis_id)
+    file = request.files.get("file")
+    if not file or not file.filename:
+        abort(400, "Nessun file caricato")
+    try:
+        records = read_notes_file(file.stream, file.filename.lower())
+    except NotesFileError as e:
+        abort(400, str(e))
+    except (csv.Error, zipfile.BadZipFile, InvalidFileException) as e:
+        _abort_read_error(e)
+    return jsonify(_save_feedback_records(analysis_id, analysis, records))
+
+
+_ROW_INDEX_MAX = int(np.iinfo(np.int64).max)
+
+
+def _record_row_index(value) -> int:
+    """
+    row_index di un record: intero JSON o cifre (file note); ValueError per 3.7, true, "1e3"... (altro cliente)
+    e per valori negativi o oltre int64 (non cercabili nell'analisi).
+    """
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value.strip())
+    if type(value) is int and 0 <= value <= _ROW_INDEX_MAX:
+        return value
+    raise ValueError(value)
+
+
+def _save_feedback_records(analysis_id: str, analysis: ColumnarAnalysis, records: list) -> dict:
+    """
+    Valida i record (row_index presente nell'analisi), calcola i segmenti in blocco e salva tutto con un
+    solo put_many. Stesso risultato dei salvataggi singoli in sequenza: per lo stesso row_index vale l'ultimo
+    record, e un record senza input eredita il segmento del precedente. Scarti in "rejected" (primi 100).
+    """
+    if len(records) > BULK_FEEDBACK_MAX:
+        abort(400, f"Troppi record (max {BULK_FEEDBACK_MAX})")
+    rejected = []
+    valid: list[tuple[int, dict]] = []
+    for i, record in enumerate(records):
+        try:
+            valid.append((_record_row_index(record["row_index"]), clean_operator_input(record)))
+        except (AttributeError, TypeError, ValueError, KeyError):
+            rejected.append({"record": i, "errore": "row_index mancante o campi non validi"})
+    positions = analysis.positions(np.array([r for r, _ in valid], dtype=np.int64)).tolist()
+    payloads: dict[int, dict] = {}
+    carried: list[int] = []  # righe senza input: segmento del feedback già salvato (se nel blocco, il precedente)
+    updated_at = datetime.utcnow().isoformat() + "Z"
+    for (row_index, inputs), pos, segment in zip(valid, positions, operator_input_segments([x for _, x in valid])):
+        if pos < 0:
+            rejected.append({"row_index": row_index, "errore": "Cliente non trovato"})
+            continue
+        previous = payloads.pop(row_index, None)  # come salvataggi in sequenza: l'ultimo record vince
+        payloads[row_index] = _feedback_payload(inputs, segment, previous, updated_at)
+        if segment is None and previous is None:
+            carried.append(row_index)
+    stored = _operator_feedback.get_many(analysis_id, carried)
+    for row_index in carried:
+        payload = payloads[row_index]
+        if payload["segment_computed"] is None and payload["segment"] is None and row_index in stored:
+            payload["segment"] = stored[row_index].get("segment")
+    items = list(payloads.items())
+    _operator_feedback.put_many(analysis_id, items)
+    _apply_feedback(analysis_id, analysis, [(r, payload["segment"]) for r, payload in items])
+    segments: dict[str, int] = defaultdict(int)
+    for _, payload in items:
+        segments[payload["segment"] or "nessuno"] += 1
+    return {
+        "ok": True,
+        "saved": len(items),
+        "segments": dict(segments),
+        "rejected_count": len(rejected),
+        "rejected": rejected[:100],
+    }
+
+
 @app.route("/api/analysis/<analysis_id>/customer/<int:row_index>/refresh", methods=["POST"])
 def refresh_customer_profile(analysis_id: str, row_index: int):
     """Simula aggiornamento profilo durante il soggiorno (ricalcolo segmentazione)."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    found = next((c for c in customers if c.row_index == row_index), None)
-    if not found:
-        abort(404, "Cliente non trovato")
+    found = _get_customer(_get_analysis(analysis_id), row_index)
     # Per ora restituisce gli stessi dati; in futuro qui si può ricalcolare con dati aggiornati
     return jsonify({
         "ok": True,
         "message": "Profilo aggiornato. Elaborato con i dati attuali del soggiorno.",
-        "customer": {
-            "row_index": found.row_index,
-            "segment": found.segment.value,
-            "scores": found.scores.to_dict(),
-            "numero_notti": found.numero_notti,
-            "numero_ospiti": found.numero_ospiti,
-            "canale": found.canale,
-            "giorno_arrivo": found.giorno_arrivo,
-            "storico_soggiorni": found.storico_soggiorni,
-            "spesa_media": found.spesa_media,
-            "cliente_id": found.cliente_id,
-            "nome_cliente": found.nome_cliente,
-            "data_arrivo": found.data_arrivo,
-            "categoria_camera": found.categoria_camera,
-            "revenue": found.revenue,
-            "anticipo_giorni": found.anticipo_giorni,
-            "prenotante": found.prenotante,
-            "numero_bambini": found.numero_bambini,
-        },
+        "customer": _customer_dict(found),
     })
 
 
 @app.route("/api/analysis/<analysis_id>/customers/count")
 def get_customers_count(analysis_id: str):
-    """Conteggio clienti (per paginazione), opzionale per segmento."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
+    """
+    Conteggio clienti (per paginazione), opzionale per segmento visualizzato: O(1) dai conteggi per segmento.
+    Con i filtri clienti (come /customers): conteggio dei bit della bitmap, ristretto alla posting list del segmento.
+    """
+    analysis = _get_analysis(analysis_id)
+    query = _parse_query()
+    code = None
     segment = request.args.get("segment")
     if segment:
         try:
-            seg_enum = Segment(segment)
-            customers = [c for c in customers if c.segment == seg_enum]
+            code = SEGMENT_CODES[Segment(segment)]
         except ValueError:
-            pass
-    return jsonify({"count": len(customers)})
+            code = None  # segmento sconosciuto: conteggio totale
+    if code is None:
+        count = bitmap_count(match_bitmap(analysis, query)) if query is not None else len(analysis)
+    elif query is None:
+        count = int(_effective_segments(analysis_id, analysis).counts[code])
+    else:
+        rows = _effective_segments(analysis_id, analysis).positions(code)
+        count = int(np.count_nonzero(match_mask(analysis, query)[rows]))
+    return jsonify({"count": count})
 
 
 @app.route("/api/analysis/<analysis_id>/marketing")
 def get_marketing(analysis_id: str):
     """Marketing Intelligence: campagne per segmento, revenue potenziale, conversion/ROI (placeholder)."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    by_segment = defaultdict(list)
-    for c in customers:
-        by_segment[c.segment].append(c)
+    return jsonify(_cached_aggregate(analysis_id, "marketing", _marketing))
+
+
+def _marketing(analysis: ColumnarAnalysis, segments: EffectiveSegments) -> dict:
+    counts, _, _, revenue_by_seg = segments.totals()
     campaigns_by_segment = get_all_campaigns_by_segment()
     segment_summaries = []
     for seg in Segment:
-        list_c = by_segment.get(seg, [])
-        count = len(list_c)
-        revenues = [c.revenue for c in list_c if c.revenue is not None]
-        rev_tot = sum(revenues) if revenues else 0
+        code = SEGMENT_CODES[seg]
+        count = int(counts[code])
+        rev_tot = float(revenue_by_seg[code])
         campagne = campaigns_by_segment.get(seg, [])
         revenue_potenziale = round(rev_tot * 1.15, 2)
         segment_summaries.append({
@@ -383,32 +731,35 @@ def get_marketing(analysis_id: str):
             "roi_stimato": 2.5,
             "campagne": [x.to_dict() for x in campagne],
         })
-    return jsonify({
+    return {
         "segmenti": segment_summaries,
         "campagne_globali": {s.value: [c.to_dict() for c in get_all_campaigns_by_segment()[s]] for s in Segment},
-    })
+    }
 
 
 @app.route("/api/analysis/<analysis_id>/trend")
 def get_trend(analysis_id: str):
-    """Trend settimanale segmenti (per data_arrivo se presente)."""
-    customers = _store.get(analysis_id)
-    if not customers:
-        abort(404, "Analisi non trovata")
-    week_segment: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
-    for c in customers:
-        if c.data_arrivo:
-            try:
-                y, m, d = map(int, c.data_arrivo.split("-")[:3])
-                w = date(y, m, d).isocalendar()[1]
-                key = f"{y}-W{w}"
-            except Exception:
-                key = "N/A"
-        else:
-            key = "N/A"
-        week_segment[key][c.segment.value] += 1
-    trend = [{"week": week, "segmenti": dict(week_segment[week])} for week in sorted(week_segment.keys(), reverse=True)[:12]]
-    return jsonify({"trend_settimanale": trend})
+    """
+    Trend arrivi per periodo e segmento visualizzato: conteggi, revenue e notti, in ordine cronologico.
+    granularity=day|week|month|season (default week); intervallo con data_da/data_a e gli altri filtri clienti.
+    Senza granularity include anche trend_settimanale (ultime 12 settimane, dalla più recente) per compatibilità.
+    """
+    granularity = request.args.get("granularity")
+    if granularity is not None and granularity not in GRANULARITIES:
+        abort(400, "Granularità non valida (day, week, month, season)")
+    query = _parse_query()
+
+    def compute(analysis: ColumnarAnalysis, segments: EffectiveSegments) -> dict:
+        mask = match_mask(analysis, query) if query is not None else None
+        out = trend(analysis, segments.codes(), granularity or "week", mask)
+        if granularity is None:
+            out["trend_settimanale"] = [
+                {"week": p["periodo"], "segmenti": {seg: v["count"] for seg, v in p["segmenti"].items()}}
+                for p in reversed(out["periodi"][-12:])
+            ]
+        return out
+
+    return jsonify(_cached_aggregate(analysis_id, ("trend", granularity, query), compute))
 
 
 @app.route("/api/segments")
@@ -422,6 +773,12 @@ def health():
     return jsonify({"status": "ok"})
 
 
+@app.route("/api/store/stats")
+def store_stats():
+    """Contatori del worker corrente: store analisi (hit/miss, rilasci, byte residenti) e cache aggregati."""
+    return jsonify({**_store.stats(), "aggregates": _aggregates.stats()})
+
+
 @app.route("/api/operator-indicators")
 def list_operator_indicators():
     """Elenco indicatori comportamentali per la scheda (note, richieste, servizi → segmento)."""
@@ -431,6 +788,7 @@ def list_operator_indicators():
 # Gestione errori HTTP per restituire JSON
 @app.errorhandler(400)
 @app.errorhandler(404)
+@app.errorhandler(503)
 def json_error(e):
     return jsonify({"detail": e.description or str(e)}), e.code
 
@@ -19,10 +19,17 @@ SEGMENT_PRIORITY = [
     Segment.LEISURE,
 ]
 
+# Codice intero del segmento (per array NumPy): posizione nell'Enum
+SEGMENTS_BY_CODE: tuple[Segment, ...] = tuple(Segment)
+SEGMENT_CODES: dict[Segment, int] = {seg: i for i, seg in enumerate(SEGMENTS_BY_CODE)}
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Scores:
-    """Punteggi per ogni segmento (Leisure include ex-Premium)."""
+    """
+    Punteggi per ogni segmento (Leisure include ex-Premium).
+    Immutabile: le combinazioni di punteggi sono poche e Scores.of restituisce un'istanza condivisa.
+    """
     business: int = 0
     leisure: int = 0
     coppia: int = 0
@@ -31,10 +38,25 @@ class Scores:
     def to_dict(self) -> dict:
         return asdict(self)
 
+    @classmethod
+    def of(cls, business: int = 0, leisure: int = 0, coppia: int = 0, famiglia: int = 0) -> "Scores":
+        """Istanza condivisa per questi quattro punteggi: per riga resta un solo riferimento."""
+        key = (business, leisure, coppia, famiglia)
+        scores = _SCORES_CACHE.get(key)
+        if scores is None:
+            scores = cls(business, leisure, coppia, famiglia)
+            if len(_SCORES_CACHE) < _SCORES_CACHE_SIZE:
+                _SCORES_CACHE[key] = scores
+        return scores
 
-@dataclass
+
+_SCORES_CACHE: dict[tuple[int, int, int, int], Scores] = {}
+_SCORES_CACHE_SIZE = 65536
+
+
+@dataclass(slots=True)
 class SegmentedCustomer:
-    """Cliente con segmento e punteggi."""
+    """Cliente con segmento e punteggi (slots: nessun __dict__ per riga; stringhe ripetute condivise dal parser)."""
     row_index: int
     segment: Segment
     scores: Scores
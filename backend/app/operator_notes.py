@@ -0,0 +1,110 @@
+"""
+File note operatore da gestionale (PMS): una riga per prenotazione con row_index del cliente nell'analisi,
+note di prenotazione, richieste speciali, servizi e indicatori. Prima riga = intestazioni (alias sotto,
+l'ordine delle colonne non conta); servizi e indicatori multipli separati da ";" "|" o ",".
+CSV (virgola o punto e virgola, UTF-8 o latin-1) letti con csv.reader, .xlsx con openpyxl in modalità read-only.
+"""
+import csv
+import io
+import re
+from typing import BinaryIO
+
+NOTES_COLUMN_ALIASES = {
+    "row_index": ["row_index", "row index", "riga", "n. riga", "indice", "indice riga"],
+    "note_prenotazione": ["note_prenotazione", "note prenotazione", "note", "booking notes", "notes", "commenti"],
+    "richieste_speciali": ["richieste_speciali", "richieste speciali", "richieste", "special requests", "requests"],
+    "servizi_selezionati": ["servizi_selezionati", "servizi selezionati", "servizi", "services", "extra"],
+    "indicatori": ["indicatori", "indicators", "indicatori comportamentali"],
+}
+_LIST_FIELDS = ("servizi_selezionati", "indicatori")
+_LIST_SEPARATOR = re.compile(r"[;|,]")
+
+
+def _cell_text(v) -> str | None:
+    """Cella .xlsx come testo (numeri interi senza ".0": row_index salvati come numero)."""
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+def _column_name(name) -> str:
+    return re.sub(r"\s+", " ", str(name or "").strip().lower())
+
+
+class NotesFileError(ValueError):
+    """File note senza intestazioni riconoscibili o non leggibile."""
+
+
+def _column_positions(header: list) -> dict[str, int]:
+    """Campo -> indice colonna; NotesFileError se manca la colonna row_index."""
+    names = {}
+    for i, name in enumerate(header):
+        names.setdefault(_column_name(name), i)
+    out = {}
+    for field, aliases in NOTES_COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                out[field] = names[alias]
+                break
+    if "row_index" not in out:
+        raise NotesFileError("Colonna row_index (o riga) mancante nelle intestazioni del file note")
+    return out
+
+
+def _records(rows, header: list) -> list[dict]:
+    columns = _column_positions(header)
+    out = []
+    for row in rows:
+        record = {}
+        for field, i in columns.items():
+            value = row[i] if i < len(row) else None
+            value = value.strip() if isinstance(value, str) else value
+            if field in _LIST_FIELDS:
+                value = [v.strip() for v in _LIST_SEPARATOR.split(value) if v.strip()] if value else None
+            record[field] = value or None
+        if any(v is not None for v in record.values()):
+            out.append(record)
+    return out
+
+
+def _read_csv(stream: BinaryIO) -> list[dict]:
+    contents = stream.read()
+    try:
+        text = contents.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        text = contents.decode("latin-1")
+    first_line = text.split("\n", 1)[0]
+    delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+    rows = csv.reader(io.StringIO(text, newline=""), delimiter=delimiter, quotechar='"')
+    header = next(rows, None)
+    if header is None:
+        raise NotesFileError("Il file note è vuoto")
+    return _records(rows, header)
+
+
+def _read_xlsx(stream: BinaryIO) -> list[dict]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = ([_cell_text(v) for v in values] for values in wb.worksheets[0].iter_rows(values_only=True))
+        header = next((row for row in rows if any(v is not None for v in row)), None)
+        if header is None:
+            raise NotesFileError("Il file note è vuoto")
+        return _records(rows, header)
+    finally:
+        wb.close()
+
+
+def read_notes_file(stream: BinaryIO, fn: str) -> list[dict]:
+    """
+    Record {row_index, note_prenotazione, richieste_speciali, servizi_selezionati, indicatori} dal file
+    (.csv o .xlsx), valori come testo o None; righe vuote saltate. row_index non è validato qui.
+    """
+    if fn.endswith(".csv"):
+        return _read_csv(stream)
+    if fn.endswith(".xlsx"):
+        return _read_xlsx(stream)
+    raise NotesFileError("File note deve essere .xlsx o .csv")
@@ -177,6 +177,54 @@ def segment_from_operator_input(
     return Segment.LEISURE
 
 
+def _as_list(value, keep_empty: bool) -> list | None:
+    if value is None or isinstance(value, list):
+        return value
+    return [value] if value or keep_empty else []
+
+
+def clean_operator_input(data: dict) -> dict:
+    """Campi operatore normalizzati (testi senza spazi ai bordi o None, servizi e indicatori come liste)."""
+    return {
+        "note_prenotazione": (data.get("note_prenotazione") or "").strip() or None,
+        "richieste_speciali": (data.get("richieste_speciali") or "").strip() or None,
+        "servizi_selezionati": _as_list(data.get("servizi_selezionati"), keep_empty=True),
+        "indicatori": _as_list(data.get("indicatori"), keep_empty=False),
+    }
+
+
+def operator_input_segment(inputs: dict) -> str | None:
+    """Segmento da input già normalizzati (clean_operator_input), None se l'operatore non ha indicato nulla."""
+    if not (inputs["indicatori"] or inputs["note_prenotazione"] or inputs["richieste_speciali"] or inputs["servizi_selezionati"]):
+        return None
+    return segment_from_operator_input(
+        indicatori=inputs["indicatori"] or None,
+        note_prenotazione=inputs["note_prenotazione"],
+        richieste_speciali=inputs["richieste_speciali"],
+        servizi_selezionati=inputs["servizi_selezionati"],
+    ).value
+
+
+def operator_input_segments(inputs: list[dict]) -> list[str | None]:
+    """
+    operator_input_segment per molti clienti (import note da gestionale): gli export ripetono spesso le stesse
+    note, richieste e servizi, quindi il segmento si calcola una volta per combinazione distinta.
+    """
+    memo: dict[tuple, str | None] = {}
+    out = []
+    for item in inputs:
+        key = (
+            item["note_prenotazione"],
+            item["richieste_speciali"],
+            tuple(map(str, item["servizi_selezionati"] or ())),
+            tuple(map(str, item["indicatori"] or ())),
+        )
+        if key not in memo:
+            memo[key] = operator_input_segment(item)
+        out.append(memo[key])
+    return out
+
+
 def get_indicatori_definitions() -> list[dict]:
     """Restituisce le definizioni degli indicatori per la UI (etichetta, chiave, segmento)."""
     return [
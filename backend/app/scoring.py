@@ -12,15 +12,28 @@ Parametri usati per segmento:
 - anticipo_giorni: Business (0-7), Leisure (30+), Coppia (14+), Famiglia (30+).
 - prenotante: Business (agenzia/azienda), Leisure (cliente/guest).
 """
+from dataclasses import dataclass
 from typing import Any
 
-from app.models import Segment, Scores, SEGMENT_PRIORITY
+import numpy as np
+import pandas as pd
 
+from app.models import Segment, Scores, SEGMENT_CODES, SEGMENT_PRIORITY
+
+# Versione delle regole di scoring/segmentazione: incrementare a ogni modifica che cambia i risultati
+# (invalida la cache delle upload identiche in main.py).
+SCORING_VERSION = "1"
 
 # Normalizzazione canali
 CANALI_CORPORATE_GDS = {"corporate", "gds", "corporate/gds", "aziendale"}
 CANALI_OTA_LEISURE = {"ota", "booking", "booking.com", "expedia", "leisure", "vacanza"}
 CANALI_DIRETTO = {"direct", "diretto", "sito", "web", "phone", "telefono"}
+# Sottostringhe nel canale e nel prenotante (stesse liste per compute_scores e compute_scores_batch)
+KEYWORDS_CANALE_CORPORATE = ("gds", "corporate")
+KEYWORDS_CANALE_OTA = ("ota", "booking", "expedia", "leisure")
+KEYWORDS_CANALE_DIRETTO = ("direct", "diretto")
+KEYWORDS_PRENOTANTE_BUSINESS = ("agenzia", "agency", "azienda", "corporate", "tour operator", "to ", "gds", "business")
+KEYWORDS_PRENOTANTE_LEISURE = ("cliente", "guest")
 
 GIORNI_MIDWEEK = {"lun", "mar", "mer", "lunedì", "martedì", "mercoledì", "monday", "tuesday", "wednesday"}
 GIORNI_WEEKEND = {"ven", "sab", "dom", "venerdì", "sabato", "domenica", "friday", "saturday", "sunday"}
@@ -57,6 +70,24 @@ def _is_high_room_category(cat: str) -> bool:
     return any(x in c for x in ("suite", "deluxe", "premium", "superior", "executive", "junior", "presidential"))
 
 
+def _canale_flags(c: Any) -> tuple[bool, bool, bool]:
+    """(corporate/GDS, OTA/leisure, diretto) per un canale."""
+    cn = _norm(c)
+    return (
+        cn in CANALI_CORPORATE_GDS or any(x in cn for x in KEYWORDS_CANALE_CORPORATE),
+        any(x in cn for x in KEYWORDS_CANALE_OTA),
+        cn in CANALI_DIRETTO or any(x in cn for x in KEYWORDS_CANALE_DIRETTO),
+    )
+
+
+def _prenotante_flags(p: Any) -> tuple[bool, bool]:
+    """(business, leisure) per un prenotante."""
+    if not p:
+        return False, False
+    pn = _norm(p)
+    return any(x in pn for x in KEYWORDS_PRENOTANTE_BUSINESS), any(x in pn for x in KEYWORDS_PRENOTANTE_LEISURE)
+
+
 def compute_scores(
     numero_notti: int,
     numero_ospiti: int,
@@ -72,9 +103,10 @@ def compute_scores(
     numero_bambini: int | None = None,
 ) -> Scores:
     """Calcola i 4 punteggi per un singolo record (combinazioni giorno+notti, spesa, anticipo, prenotante, bambini). Storico soggiorni non usato."""
-    cn = _norm(canale)
+    canale_corporate, canale_ota, canale_diretto = _canale_flags(canale)
+    prenotante_business, prenotante_leisure = _prenotante_flags(prenotante)
     gn = _norm(giorno_arrivo)
-    is_weekend = gn in {"ven", "sab", "dom", "venerdì", "sabato", "domenica", "friday", "saturday", "sunday"}
+    is_weekend = gn in GIORNI_WEEKEND
     is_midweek = gn in GIORNI_MIDWEEK
     business = leisure = coppia = famiglia = 0
 
@@ -106,23 +138,21 @@ def compute_scores(
         business += 3
     if numero_ospiti <= 2 and 1 <= numero_notti <= 2:
         business += 2
-    if cn in CANALI_CORPORATE_GDS or "gds" in cn or "corporate" in cn:
+    if canale_corporate:
         business += 2
     # Anticipo: last minute (0-7 giorni) spesso business
     if anticipo_giorni is not None and 0 <= anticipo_giorni <= 7:
         business += 2
     # Prenotante: agenzia/azienda/tour operator → business
-    if prenotante:
-        pn = _norm(prenotante)
-        if any(x in pn for x in ["agenzia", "agency", "azienda", "corporate", "tour operator", "to ", "gds", "business"]):
-            business += 2
+    if prenotante_business:
+        business += 2
 
     # --- LEISURE ---
     if numero_notti >= 3:
         leisure += 2
     if is_weekend:
         leisure += 1
-    if any(x in cn for x in ["ota", "booking", "expedia", "leisure"]):
+    if canale_ota:
         leisure += 2
     # Spesa sotto media → spesso leisure
     if media_spesa is not None and spesa_media is not None and spesa_media < media_spesa:
@@ -130,7 +160,7 @@ def compute_scores(
     # Prenotazione in anticipo (30+ giorni) → leisure
     if anticipo_giorni is not None and anticipo_giorni >= 30:
         leisure += 1
-    if prenotante and ("cliente" in _norm(prenotante) or "guest" in _norm(prenotante)):
+    if prenotante_leisure:
         leisure += 1
 
     # --- COPPIA (solo se almeno 2 ospiti: una coppia non può essere 1 persona) ---
@@ -140,7 +170,7 @@ def compute_scores(
         coppia += 2
     if numero_ospiti >= 2 and gn in GIORNI_COPPIA:
         coppia += 3
-    if numero_ospiti >= 2 and any(x in cn for x in ["ota", "booking", "expedia", "leisure"]):
+    if numero_ospiti >= 2 and canale_ota:
         coppia += 1
     if numero_bambini is not None and numero_bambini == 0 and numero_ospiti == 2:
         coppia += 2
@@ -163,7 +193,7 @@ def compute_scores(
     if numero_ospiti >= 2 and anticipo_giorni is not None and anticipo_giorni >= 30:
         famiglia += 1  # prenotazioni family spesso in anticipo
     # Canale OTA spesso usato per prenotazioni famiglia
-    if numero_ospiti >= 2 and any(x in cn for x in ["ota", "booking", "expedia", "leisure"]):
+    if numero_ospiti >= 2 and canale_ota:
         famiglia += 1
 
     # --- LEISURE (include ex-Premium: alta spesa, categoria camera, direct) ---
@@ -173,12 +203,12 @@ def compute_scores(
         leisure += 1
     if numero_notti >= 4:
         leisure += 2
-    if cn in CANALI_DIRETTO or "direct" in cn or "diretto" in cn:
+    if canale_diretto:
         leisure += 2
     if _is_high_room_category(categoria_camera):
         leisure += 2
 
-    return Scores(
+    return Scores.of(
         business=business,
         leisure=leisure,
         coppia=coppia,
@@ -203,3 +233,188 @@ def assign_segment(scores: Scores) -> Segment:
         if seg in candidates_enum:
             return seg
     return Segment.LEISURE
+
+
+# --- Scoring vettoriale ------------------------------------------------------
+# Stesse regole di compute_scores/assign_segment applicate a colonne intere con maschere booleane.
+# I predicati sulle stringhe (canale, giorno, prenotante, camera) sono valutati una volta per valore distinto.
+
+@dataclass
+class BatchScores:
+    """Punteggi per colonna (int16) e codice segmento (int8, vedi SEGMENT_CODES)."""
+    business: np.ndarray
+    leisure: np.ndarray
+    coppia: np.ndarray
+    famiglia: np.ndarray
+    segment: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.segment)
+
+    def scores_at(self, i: int) -> Scores:
+        return Scores.of(
+            business=int(self.business[i]),
+            leisure=int(self.leisure[i]),
+            coppia=int(self.coppia[i]),
+            famiglia=int(self.famiglia[i]),
+        )
+
+
+def _distinct_flags(values: Any, predicates: dict[str, Any]) -> dict[str, np.ndarray]:
+    """Valuta ogni predicato una sola volta per valore distinto (accetta anche pd.Categorical)."""
+    if isinstance(values, pd.Categorical):
+        codes, uniques = values.codes, list(values.categories)
+    else:
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=True)
+        uniques = list(uniques)
+    out = {}
+    for name, pred in predicates.items():
+        flags = np.array([bool(pred(u)) for u in uniques] + [bool(pred(None))], dtype=bool)
+        out[name] = flags[codes]
+    return out
+
+
+def _as_float(values: Any, n: int) -> np.ndarray:
+    """Colonna numerica opzionale → float64 con NaN al posto di None (i confronti con NaN sono falsi)."""
+    if values is None:
+        return np.full(n, np.nan)
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        return pd.to_numeric(pd.Series(arr), errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    return arr.astype(float)
+
+
+def assign_segment_batch(business: np.ndarray, leisure: np.ndarray, coppia: np.ndarray, famiglia: np.ndarray) -> np.ndarray:
+    """Codici segmento con punteggio massimo; in parità vince il primo in SEGMENT_PRIORITY."""
+    by_key = {"business": business, "leisure": leisure, "coppia": coppia, "famiglia": famiglia}
+    best = np.maximum.reduce([business, leisure, coppia, famiglia])
+    segment = np.full(len(best), SEGMENT_CODES[Segment.LEISURE], dtype=np.int8)
+    # Dal meno prioritario al più prioritario: l'ultima assegnazione vince
+    for seg in reversed(SEGMENT_PRIORITY):
+        key = next(k for k, v in KEY_TO_SEGMENT.items() if v == seg)
+        segment[by_key[key] == best] = SEGMENT_CODES[seg]
+    return segment
+
+
+def compute_scores_batch(
+    numero_notti: Any,
+    numero_ospiti: Any,
+    canale: Any,
+    giorno_arrivo: Any,
+    spesa_media: Any,
+    categoria_camera: Any,
+    threshold_top25: float | None,
+    is_vacation_period: Any,
+    media_spesa: float | None = None,
+    anticipo_giorni: Any = None,
+    prenotante: Any = None,
+    numero_bambini: Any = None,
+) -> BatchScores:
+    """
+    Versione a colonne di compute_scores + assign_segment: stesso risultato riga per riga.
+    Colonne numeriche opzionali (spesa, anticipo, bambini) accettano None/NaN per valore mancante.
+    """
+    notti = np.asarray(numero_notti, dtype=np.int64)
+    ospiti = np.asarray(numero_ospiti, dtype=np.int64)
+    n = len(notti)
+    spesa = _as_float(spesa_media, n)
+    anticipo = _as_float(anticipo_giorni, n)
+    bambini = _as_float(numero_bambini, n)
+    vacanza = np.asarray(is_vacation_period, dtype=bool)
+
+    g = _distinct_flags(giorno_arrivo, {
+        "weekend": lambda v: _norm(v) in GIORNI_WEEKEND,
+        "midweek": lambda v: _norm(v) in GIORNI_MIDWEEK,
+        "coppia": lambda v: _norm(v) in GIORNI_COPPIA,
+    })
+    c = _distinct_flags(canale, {
+        "corporate": lambda v: _canale_flags(v)[0],
+        "ota": lambda v: _canale_flags(v)[1],
+        "diretto": lambda v: _canale_flags(v)[2],
+    })
+    p = _distinct_flags(prenotante if prenotante is not None else np.full(n, None, dtype=object), {
+        "business": lambda v: _prenotante_flags(v)[0],
+        "leisure": lambda v: _prenotante_flags(v)[1],
+    })
+    high_room = _distinct_flags(categoria_camera, {"high": _is_high_room_category})["high"]
+
+    is_weekend, is_midweek = g["weekend"], g["midweek"]
+    ospiti_le2 = ospiti <= 2
+    ospiti_ge2 = ospiti >= 2
+    notti_1_2 = (notti >= 1) & (notti <= 2)
+    notti_1_3 = (notti >= 1) & (notti <= 3)
+    has_media = media_spesa is not None
+    high_spend = spesa >= threshold_top25 if threshold_top25 is not None else np.zeros(n, dtype=bool)
+
+    business = np.zeros(n, dtype=np.int16)
+    leisure = np.zeros(n, dtype=np.int16)
+    coppia = np.zeros(n, dtype=np.int16)
+    famiglia = np.zeros(n, dtype=np.int16)
+
+    def add(target: np.ndarray, mask: np.ndarray, points: int) -> None:
+        target += mask.astype(np.int16) * np.int16(points)
+
+    # --- Combinazioni giorno arrivo + numero notti ---
+    weekend_1 = is_weekend & (notti == 1)
+    add(business, weekend_1 & ospiti_le2, 2)
+    add(coppia, weekend_1 & ospiti_ge2, 1)
+    weekend_2_3 = is_weekend & (notti >= 2) & (notti <= 3)
+    add(coppia, weekend_2_3 & ospiti_ge2, 3)
+    add(leisure, weekend_2_3, 2)
+    weekend_4 = is_weekend & (notti >= 4)
+    add(famiglia, weekend_4 & ospiti_ge2, 2)
+    add(leisure, weekend_4, 1)
+    add(business, is_midweek & notti_1_2 & ospiti_le2, 3)
+    midweek_3 = is_midweek & (notti >= 3)
+    add(leisure, midweek_3, 1)
+    add(famiglia, midweek_3 & ospiti_ge2, 1)
+
+    # --- BUSINESS ---
+    add(business, ospiti_le2 & is_midweek, 2)
+    add(business, ospiti == 1, 3)
+    add(business, ospiti_le2 & notti_1_2, 2)
+    add(business, c["corporate"], 2)
+    add(business, (anticipo >= 0) & (anticipo <= 7), 2)
+    add(business, p["business"], 2)
+
+    # --- LEISURE ---
+    add(leisure, notti >= 3, 2)
+    add(leisure, is_weekend, 1)
+    add(leisure, c["ota"], 2)
+    if has_media:
+        add(leisure, spesa < media_spesa, 1)
+    add(leisure, anticipo >= 30, 1)
+    add(leisure, p["leisure"], 1)
+
+    # --- COPPIA ---
+    add(coppia, ospiti == 2, 3)
+    add(coppia, ospiti_ge2 & notti_1_3, 2)
+    add(coppia, ospiti_ge2 & g["coppia"], 3)
+    add(coppia, ospiti_ge2 & c["ota"], 1)
+    add(coppia, (bambini == 0) & (ospiti == 2), 2)
+    add(coppia, ospiti_ge2 & (anticipo >= 14), 1)
+
+    # --- FAMIGLIA ---
+    add(famiglia, ospiti >= 3, 3)
+    add(famiglia, ospiti_ge2 & (notti >= 3), 2)
+    add(famiglia, ospiti_ge2 & is_weekend, 2)
+    add(famiglia, ospiti_ge2 & vacanza, 2)
+    add(famiglia, bambini >= 1, 4)
+    add(famiglia, ospiti_ge2 & (anticipo >= 30), 1)
+    add(famiglia, ospiti_ge2 & c["ota"], 1)
+
+    # --- LEISURE (ex-Premium) ---
+    add(leisure, high_spend, 4)
+    if has_media:
+        add(leisure, spesa >= media_spesa, 1)
+    add(leisure, notti >= 4, 2)
+    add(leisure, c["diretto"], 2)
+    add(leisure, high_room, 2)
+
+    return BatchScores(
+        business=business,
+        leisure=leisure,
+        coppia=coppia,
+        famiglia=famiglia,
+        segment=assign_segment_batch(business, leisure, coppia, famiglia),
+    )
@@ -0,0 +1,198 @@
+"""
+Segmento visualizzato per cliente: quello del modello, salvo feedback operatore con un segmento valido
+("Premium" → "Leisure", come nella scheda cliente).
+Posting list e conteggi per segmento visualizzato partono da quelli salvati con l'analisi
+(segment.postings / segment.offsets) e correggono solo le righe spostate dal feedback; un feedback salvato
+dopo la costruzione si applica come differenza (EffectiveSegments.moved), senza ricalcoli sull'intera analisi.
+Una vista non cambia dopo la pubblicazione (salvo le cache calcolate al primo uso): moved() restituisce una
+nuova vista, così le richieste che leggono quella precedente in parallelo vedono contatori e posting list coerenti.
+"""
+import copy
+from typing import Optional
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis, effective_revenues
+from app.models import SEGMENT_CODES, SEGMENTS_BY_CODE, Segment
+from app.sorting import SortOrder, positions_order, sort_order
+
+
+def operator_segment(value: Optional[str]) -> Optional[Segment]:
+    """Segmento scelto dall'operatore (None se assente o non valido)."""
+    if not value:
+        return None
+    if value == "Premium":
+        value = "Leisure"  # retrocompat: Premium fusionato in Leisure
+    try:
+        return Segment(value)
+    except ValueError:
+        return None
+
+
+def _column(analysis: ColumnarAnalysis, name: str, build) -> np.ndarray:
+    """Colonna derivata per riga, calcolata una volta per analisi aperta (analysis.derived)."""
+    column = analysis.derived.get(("column", name))
+    if column is None:
+        column = analysis.derived[("column", name)] = build(analysis)
+    return column
+
+
+def _nights(analysis: ColumnarAnalysis) -> np.ndarray:
+    values, null = analysis.numbers("numero_notti")
+    return np.where(null, 0, values).astype(np.float64)
+
+
+def _booked_revenue(analysis: ColumnarAnalysis) -> np.ndarray:
+    values, null = analysis.numbers("revenue")
+    return np.where(null, 0.0, values)
+
+
+class EffectiveSegments:
+    """
+    Segmenti visualizzati di un'analisi a una certa versione del feedback.
+    chosen: posizione -> codice segmento scelto dall'operatore (anche se uguale a quello del modello).
+    Contatori per segmento visualizzato (totals(): clienti, revenue effettiva, notti, campo revenue) calcolati
+    alla costruzione; moved() ne deriva la vista della versione successiva con una differenza O(1) per ogni
+    feedback salvato in questo worker.
+    """
+
+    def __init__(self, analysis: ColumnarAnalysis, feedback_segments: dict[int, str], version: int):
+        self.analysis = analysis
+        self.version = version
+        self.chosen: dict[int, int] = {}
+        self._moved: dict[int, int] = {}  # posizione -> segmento visualizzato, se diverso da quello del modello
+        self._revenues = _column(analysis, "revenue_effettiva", effective_revenues)
+        self._nights = _column(analysis, "notti", _nights)
+        self._booked = _column(analysis, "revenue_prenotata", _booked_revenue)
+        base = analysis.segment
+        n_seg = len(SEGMENTS_BY_CODE)
+        self.counts = analysis.segment_counts().astype(np.int64)
+        self._revenue = np.bincount(base, weights=self._revenues, minlength=n_seg)
+        self._nights_by_seg = np.bincount(base, weights=self._nights, minlength=n_seg)
+        self._booked_by_seg = np.bincount(base, weights=self._booked, minlength=n_seg)
+        self._stale: set[int] = set()  # segmenti da risommare: spostata una riga con valori non finiti
+        self._positions: dict[int, np.ndarray] = {}
+        self._codes: Optional[np.ndarray] = None
+        self._orders: dict[tuple[int, str], SortOrder] = {}
+        for row_index, value in feedback_segments.items():
+            pos = analysis.position(row_index)
+            if pos is not None:
+                self._choose(pos, operator_segment(value))
+
+    def _choose(self, pos: int, segment: Optional[Segment]) -> tuple[int, int]:
+        """Registra il segmento scelto per pos e sposta i contatori; (codice precedente, codice nuovo)."""
+        model = int(self.analysis.segment[pos])
+        old = self._moved.get(pos, model)
+        if segment is None:
+            self.chosen.pop(pos, None)
+            new = model
+        else:
+            new = self.chosen[pos] = SEGMENT_CODES[segment]
+        if new != model:
+            self._moved[pos] = new
+        else:
+            self._moved.pop(pos, None)
+        if new != old:
+            values = (self._revenues[pos], self._nights[pos], self._booked[pos])
+            finite = all(np.isfinite(v) for v in values)
+            for code, sign in ((old, -1), (new, 1)):
+                self.counts[code] += sign
+                if finite:
+                    self._revenue[code] += sign * values[0]
+                    self._nights_by_seg[code] += sign * values[1]
+                    self._booked_by_seg[code] += sign * values[2]
+                else:  # NaN/inf non si tolgono da una somma: segmento risommato alla prossima lettura
+                    self._stale.add(code)
+        return old, new
+
+    def totals(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Per codice segmento visualizzato: (clienti, revenue effettiva, notti, somma del campo revenue)."""
+        for code in list(self._stale):
+            rows = self.positions(code)
+            self._revenue[code] = self._revenues[rows].sum()
+            self._nights_by_seg[code] = self._nights[rows].sum()
+            self._booked_by_seg[code] = self._booked[rows].sum()
+            self._stale.discard(code)
+        return self.counts, self._revenue, self._nights_by_seg, self._booked_by_seg
+
+    def moved(self, moves: list[tuple[int, Optional[Segment]]], version: int) -> "EffectiveSegments":
+        """
+        Vista alla versione version dopo i feedback appena salvati (posizione, segmento), senza modificare questa:
+        si copiano solo dizionari e contatori per segmento (e la colonna dei codici, se già calcolata), poi
+        contatori in O(1) per feedback; delle posting list e degli ordinamenti si scartano solo quelli dei
+        segmenti coinvolti.
+        """
+        view = copy.copy(self)
+        view.version = version
+        view.chosen = dict(self.chosen)
+        view._moved = dict(self._moved)
+        view.counts = self.counts.copy()
+        view._revenue = self._revenue.copy()
+        view._nights_by_seg = self._nights_by_seg.copy()
+        view._booked_by_seg = self._booked_by_seg.copy()
+        view._stale = set(self._stale)
+        view._positions = dict(self._positions)
+        view._orders = dict(self._orders)
+        if self._codes is not None and self._codes is not self.analysis.segment:
+            view._codes = self._codes.copy()
+        for pos, segment in moves:
+            view._move(pos, segment)
+        return view
+
+    def _move(self, pos: int, segment: Optional[Segment]) -> None:
+        """Sposta pos sul posto (solo su una vista non ancora pubblicata, vedi moved)."""
+        old, new = self._choose(pos, segment)
+        if old == new:
+            return
+        for code in (old, new):
+            self._positions.pop(code, None)
+        for key in [key for key in self._orders if key[0] in (old, new)]:
+            del self._orders[key]
+        if self._codes is not None:
+            if self._codes is self.analysis.segment:
+                self._codes = None  # colonna del modello (sola lettura): copia al prossimo uso
+            else:
+                self._codes[pos] = new
+
+    def codes(self) -> np.ndarray:
+        """Codice del segmento visualizzato per posizione (colonna segment del modello se nessuno spostamento)."""
+        if self._codes is None:
+            if self._moved:
+                codes = np.array(self.analysis.segment)
+                codes[list(self._moved)] = list(self._moved.values())
+            else:
+                codes = self.analysis.segment
+            self._codes = codes
+        return self._codes
+
+    def positions(self, code: int) -> np.ndarray:
+        """Posizioni (in ordine di file) con segmento visualizzato = code; calcolate una volta per versione."""
+        cached = self._positions.get(code)
+        if cached is not None:
+            return cached
+        base = self.analysis.segment_positions(code)
+        if self._moved:
+            model = self.analysis.segment
+            leaving = np.array(sorted(p for p, c in self._moved.items() if model[p] == code), dtype=np.int64)
+            entering = np.array(sorted(p for p, c in self._moved.items() if c == code), dtype=np.int64)
+            kept = np.delete(base, np.searchsorted(base, leaving))
+            cached = np.insert(kept, np.searchsorted(kept, entering), entering)
+        else:
+            cached = base
+        self._positions[code] = cached
+        return cached
+
+    def order(self, code: int, sort: str) -> SortOrder:
+        """Clienti del segmento visualizzato code nell'ordinamento sort ("" = ordine del file); ValueError se sort non valido."""
+        cached = self._orders.get((code, sort))
+        if cached is None:
+            if sort:
+                cached = sort_order(self.analysis, sort).subset(self.codes() == code)
+            else:
+                cached = positions_order(self.positions(code))
+            self._orders[(code, sort)] = cached
+        return cached
+
+    def chosen_segment(self, pos: int) -> Optional[Segment]:
+        code = self.chosen.get(pos)
+        return None if code is None else SEGMENTS_BY_CODE[code]
@@ -0,0 +1,143 @@
+"""
+Statistiche in streaming per la spesa: quantile (sketch KLL) e media, aggiornabili a blocchi e fondibili
+tra processi/worker. Servono alle modalità di ingest a blocchi e parallele per calcolare threshold_top25
+(75° percentile) e media_spesa senza materializzare l'intera colonna.
+
+Limiti di errore (k = parametro dello sketch, default SPEND_SKETCH_K):
+- finché i valori visti sono <= k lo sketch è esatto e quantile() coincide con pandas
+  Series.quantile (interpolazione lineare);
+- oltre, ogni compattazione di livello h sposta il rango di al più 2^h: l'errore di rango normalizzato
+  |rango(stima) / n - q| è O(1/k) (KLL); con k = 8192 su distribuzioni reali resta sotto 0.05%
+  (vedi scripts/check_spend_sketch.py, che verifica il limite 2/k rispetto a Series.quantile);
+- la media è esatta a meno di arrotondamenti floating point (somme compensate per blocco).
+"""
+import math
+import os
+import random
+
+import numpy as np
+
+SPEND_SKETCH_K = int(os.environ.get("SPEND_SKETCH_K", "8192"))
+
+
+class QuantileSketch:
+    """Sketch KLL: livelli di valori campionati, peso 2^livello; compattazione a metà quando un livello è pieno."""
+
+    def __init__(self, k: int = SPEND_SKETCH_K, seed: int | None = 0):
+        self.k = k
+        self.n = 0
+        self.levels: list[np.ndarray] = [np.empty(0)]
+        self._rng = random.Random(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compact(self, level: int) -> None:
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0))
+        items = np.sort(self.levels[level])
+        keep = items[:0]
+        if len(items) % 2:
+            keep, items = items[-1:], items[:-1]
+        promoted = items[self._rng.randint(0, 1)::2]
+        self.levels[level] = keep
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def _compress(self) -> None:
+        while True:
+            for level, items in enumerate(self.levels):
+                if len(items) > self._capacity(level):
+                    self._compact(level)
+                    break
+            else:
+                return
+
+    def update(self, values) -> None:
+        arr = np.asarray(values, dtype=float).ravel()
+        arr = arr[~np.isnan(arr)]
+        if not len(arr):
+            return
+        self.levels[0] = np.concatenate([self.levels[0], arr])
+        self.n += len(arr)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+
+    @property
+    def exact(self) -> bool:
+        return len(self.levels) == 1
+
+    def quantile(self, q: float) -> float | None:
+        if self.n == 0:
+            return None
+        if self.exact:
+            return float(np.quantile(self.levels[0], q))
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level, dtype=np.int64) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        cum = np.cumsum(weights[order])
+        pos = int(np.searchsorted(cum, q * cum[-1], side="left"))
+        return float(values[order][min(pos, len(values) - 1)])
+
+
+class RunningMean:
+    """Media in streaming: conteggio e somma compensata (Neumaier) dei totali per blocco."""
+
+    def __init__(self):
+        self.count = 0
+        self._sum = 0.0
+        self._comp = 0.0
+
+    def _add(self, x: float) -> None:
+        t = self._sum + x
+        if not math.isfinite(t):  # inf/nan come pandas: niente compensazione
+            self._sum = t
+            return
+        if abs(self._sum) >= abs(x):
+            self._comp += (self._sum - t) + x
+        else:
+            self._comp += (x - t) + self._sum
+        self._sum = t
+
+    def update(self, values) -> None:
+        arr = np.asarray(values, dtype=float).ravel()
+        arr = arr[~np.isnan(arr)]
+        if len(arr):
+            self.count += len(arr)
+            self._add(float(np.sum(arr)))
+
+    def merge(self, other: "RunningMean") -> None:
+        self.count += other.count
+        self._add(other._sum)
+        self._add(other._comp)
+
+    @property
+    def value(self) -> float | None:
+        return (self._sum + self._comp) / self.count if self.count else None
+
+
+class SpendStats:
+    """Soglia top 25% e media spesa accumulate a blocchi; fondibili tra worker."""
+
+    def __init__(self, k: int = SPEND_SKETCH_K):
+        self.sketch = QuantileSketch(k)
+        self.mean = RunningMean()
+
+    def update(self, values) -> None:
+        self.sketch.update(values)
+        self.mean.update(values)
+
+    def merge(self, other: "SpendStats") -> None:
+        self.sketch.merge(other.sketch)
+        self.mean.merge(other.mean)
+
+    def result(self) -> tuple[float | None, float | None]:
+        """(threshold_top25, media_spesa) come excel_parser.spend_stats."""
+        return self.sketch.quantile(0.75), self.mean.value
@@ -0,0 +1,122 @@
+"""
+Ordinamento lato server della tabella clienti con paginazione a cursore (keyset).
+Per ogni campo ordinabile e direzione si calcola, al primo uso, la permutazione delle posizioni e le chiavi
+ordinate (in analysis.derived): una pagina è una ricerca binaria del cursore più una fetta di `limit` righe,
+a qualsiasi profondità. Il cursore contiene (ordinamento, chiave, posizione) dell'ultima riga restituita:
+la pagina successiva riparte subito dopo, senza contare le righe precedenti.
+Parità di chiave: ordine del file. Valori mancanti (data arrivo, anticipo, notti) in fondo in entrambe le direzioni.
+"""
+import base64
+import json
+import math
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis, effective_adrs, effective_revenues
+
+
+def _arrival_dates(analysis: ColumnarAnalysis) -> np.ndarray:
+    """Rango della data arrivo (stringhe YYYY-MM-DD: ordine lessicografico = cronologico), NaN se mancante."""
+    categories = analysis.categories["data_arrivo"]
+    rank = np.empty(len(categories) + 1, dtype=np.float64)
+    rank[sorted(range(len(categories)), key=categories.__getitem__)] = np.arange(len(categories))
+    rank[-1] = np.nan  # codice -1
+    return rank[analysis.codes("data_arrivo")]
+
+
+def _numbers(field: str) -> Callable[[ColumnarAnalysis], np.ndarray]:
+    def values(analysis: ColumnarAnalysis) -> np.ndarray:
+        column, null = analysis.numbers(field)
+        return np.where(null, np.nan, column.astype(np.float64))
+
+    return values
+
+
+# Campi ordinabili (?sort=campo crescente, ?sort=-campo decrescente): valore per riga, NaN = mancante
+SORT_FIELDS: dict[str, Callable[[ColumnarAnalysis], np.ndarray]] = {
+    "revenue": effective_revenues,
+    "adr": effective_adrs,
+    "data_arrivo": _arrival_dates,
+    "anticipo_giorni": _numbers("anticipo_giorni"),
+    "numero_notti": _numbers("numero_notti"),
+}
+
+
+class SortOrder:
+    """Posizioni in ordine di pagina e relative chiavi (crescenti; decrescente = chiave negata, mancanti = +inf)."""
+
+    def __init__(self, positions: np.ndarray, keys: np.ndarray):
+        self.positions = positions
+        self.keys = keys
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def nbytes(self) -> int:
+        return self.positions.nbytes + self.keys.nbytes
+
+    def subset(self, mask: np.ndarray) -> "SortOrder":
+        """Solo le posizioni con mask[posizione] vero, nello stesso ordine."""
+        keep = mask[self.positions]
+        return SortOrder(self.positions[keep], self.keys[keep])
+
+    def page(self, after: Optional[tuple[float, int]], limit: int) -> tuple[np.ndarray, Optional[tuple[float, int]]]:
+        """Fino a limit posizioni dopo il cursore (chiave, posizione); cursore dell'ultima se ne restano altre."""
+        start = 0
+        if after is not None:
+            key, pos = after
+            lo = int(np.searchsorted(self.keys, key, side="left"))
+            hi = int(np.searchsorted(self.keys, key, side="right"))
+            start = lo + int(np.searchsorted(self.positions[lo:hi], pos, side="right"))  # parità: ordine del file
+        end = min(start + limit, len(self.positions))
+        last = (float(self.keys[end - 1]), int(self.positions[end - 1])) if end < len(self.positions) else None
+        return self.positions[start:end], last
+
+
+def parse_sort(value: str) -> tuple[str, bool]:
+    """"campo" o "-campo" → (campo, decrescente); ValueError se il campo non è ordinabile."""
+    field = value[1:] if value.startswith("-") else value
+    if field not in SORT_FIELDS:
+        raise ValueError(value)
+    return field, value.startswith("-")
+
+
+def sort_order(analysis: ColumnarAnalysis, sort: str) -> SortOrder:
+    """Ordinamento di tutte le righe per sort ("" = ordine del file), calcolato una volta per analisi aperta."""
+    cached = analysis.derived.get(("sort", sort))
+    if cached is not None:
+        return cached
+    if sort:
+        field, descending = parse_sort(sort)
+        keys = SORT_FIELDS[field](analysis).astype(np.float64)
+        if descending:
+            keys = -keys
+        keys[np.isnan(keys)] = math.inf
+        positions = np.argsort(keys, kind="stable").astype(np.int32)
+        order = SortOrder(positions, keys[positions])
+    else:
+        positions = np.arange(len(analysis), dtype=np.int32)
+        order = SortOrder(positions, positions.astype(np.float64))
+    analysis.derived[("sort", sort)] = order
+    return order
+
+
+def positions_order(positions: np.ndarray) -> SortOrder:
+    """Ordine del file su un sottoinsieme di posizioni crescenti (es. posting list di un segmento)."""
+    return SortOrder(positions, positions.astype(np.float64))
+
+
+def encode_cursor(sort: str, last: tuple[float, int]) -> str:
+    raw = json.dumps([sort, last[0], last[1]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[str, tuple[float, int]]:
+    """(ordinamento, (chiave, posizione)) dal cursore; ValueError se non valido."""
+    try:
+        sort, key, pos = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return str(sort), (float(key), int(pos))
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(token) from e
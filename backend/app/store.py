@@ -0,0 +1,462 @@
+"""
+Store delle analisi, intercambiabile (ANALYSIS_STORE):
+- "memory": dizionario nel processo (un solo worker, niente persistenza);
+- "disk" (default): directory persistente (ANALYSIS_STORE_DIR, di default backend/data): le analisi
+  sopravvivono a riavvii e deploy;
+- "shared": come "disk" ma di default su /dev/shm (RAM condivisa, non sopravvive al riavvio dell'host).
+Con "disk" e "shared" la directory è condivisa da tutti i worker gunicorn dello stesso host.
+Ogni analisi è una cartella con un file .npy per colonna, categories.json e meta.json (righe, colonne,
+soglie spesa e dati dell'upload). All'avvio si legge solo l'indice (i meta.json); le colonne vengono
+aperte con np.load(mmap_mode="r") al primo accesso, una per una: nessuna copia, le pagine sono condivise
+tra i processi tramite la page cache e la memoria occupata segue le analisi effettivamente consultate.
+La scrittura avviene in una cartella temporanea rinominata a fine scrittura: gli altri worker vedono
+un'analisi completa o niente.
+Le analisi aperte in ogni processo restano in memoria entro un budget in byte (STORE_MAX_BYTES) e un tempo
+di inattività (STORE_IDLE_TTL): oltre, le meno usate di recente vengono rilasciate. Su disco vengono solo
+chiuse (riaperte al prossimo accesso); in memoria vengono scartate o, con STORE_SPILL_DIR, scritte su disco.
+Su disco le analisi non restano per sempre: quelle non aperte da STORE_RETENTION_DAYS giorni, e oltre
+STORE_MAX_ANALYSES le meno usate di recente, vengono rimosse (all'avvio e dopo ogni nuovo upload) insieme
+al loro feedback operatore. L'ultimo uso è il mtime della cartella, aggiornato all'apertura.
+"""
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis
+
+ANALYSIS_STORE = os.environ.get("ANALYSIS_STORE", "disk").strip().lower()
+# Budget per processo delle analisi aperte (byte, 0 = nessun limite) e inattività massima (secondi, 0 = nessuna)
+STORE_MAX_BYTES = int(os.environ.get("STORE_MAX_BYTES", str(1 << 30)))
+STORE_IDLE_TTL = int(os.environ.get("STORE_IDLE_TTL", "0"))
+# Store "memory": cartella dove scrivere le analisi rilasciate invece di scartarle (vuoto = scartate)
+STORE_SPILL_DIR = os.environ.get("STORE_SPILL_DIR", "")
+# Store "disk"/"shared": analisi non aperte da più di STORE_RETENTION_DAYS giorni rimosse (0 = mai), e al massimo
+# STORE_MAX_ANALYSES analisi su disco, le meno usate di recente rimosse per prime (0 = nessun limite)
+STORE_RETENTION_DAYS = float(os.environ.get("STORE_RETENTION_DAYS", "30"))
+STORE_MAX_ANALYSES = int(os.environ.get("STORE_MAX_ANALYSES", "500"))
+# Intervallo minimo tra due aggiornamenti dell'ultimo uso di un'analisi su disco (mtime della cartella, secondi)
+_TOUCH_INTERVAL = 3600
+# Cartelle temporanee di scritture interrotte (crash durante l'upload) rimosse all'avvio dopo questo tempo (secondi)
+_STALE_TMP_SECONDS = 3600
+
+
+def _default_dir(kind: str) -> str:
+    if kind == "shared":
+        base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        return os.path.join(base, "customer-segmentation")
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+ANALYSIS_STORE_DIR = os.environ.get("ANALYSIS_STORE_DIR") or _default_dir(ANALYSIS_STORE)
+
+
+def valid_id(value: str) -> bool:
+    """analysis_id/job_id sono uuid4: qualsiasi altro valore (es. percorsi) viene rifiutato."""
+    try:
+        return str(uuid.UUID(value)) == value
+    except (TypeError, ValueError):
+        return False
+
+
+class AnalysisStore(ABC):
+    """
+    Interfaccia dello store: analisi per analysis_id e cache upload (chiave contenuto → analysis_id).
+    Le analisi aperte nel processo sono in ordine LRU; _enforce rilascia le meno usate oltre max_bytes
+    o inattive da più di idle_ttl. on_evict(analysis_id, dropped) avvisa chi tiene dati per analisi
+    (feedback operatore): dropped = l'analisi non è più disponibile.
+    """
+
+    kind = ""
+
+    def __init__(self, max_bytes: int = STORE_MAX_BYTES, idle_ttl: int = STORE_IDLE_TTL):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.on_evict: Optional[Callable[[str, bool], None]] = None
+        self._resident: OrderedDict[str, list] = OrderedDict()  # analysis_id -> [analisi, ultimo accesso, byte]
+        self._lock = threading.RLock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "spills": 0}
+
+    def get(self, analysis_id: str) -> Optional[ColumnarAnalysis]:
+        with self._lock:
+            entry = self._resident.get(analysis_id)
+            if entry is None:
+                self._counters["misses"] += 1
+                analysis = self._load(analysis_id)
+                if analysis is None:
+                    return None
+                entry = self._resident[analysis_id] = [analysis, 0.0, 0]
+            else:
+                self._counters["hits"] += 1
+                self._resident.move_to_end(analysis_id)
+            entry[1] = time.monotonic()
+            self._enforce(keep=analysis_id)
+            return entry[0]
+
+    def put(self, analysis_id: str, analysis: ColumnarAnalysis, upload_key: Optional[str] = None) -> None:
+        resident = self._save(analysis_id, analysis, upload_key)
+        with self._lock:
+            self._resident[analysis_id] = [resident, time.monotonic(), 0]
+            self._enforce(keep=analysis_id)
+
+    @abstractmethod
+    def find_upload(self, upload_key: str) -> Optional[str]:
+        """analysis_id già elaborato per questa chiave upload, se l'analisi è ancora disponibile."""
+
+    def cleanup(self, keep: Optional[str] = None) -> list[str]:
+        """Rimuove le analisi oltre la retention dello store (solo store su disco); restituisce gli id rimossi."""
+        return []
+
+    def __contains__(self, analysis_id: str) -> bool:
+        return self.get(analysis_id) is not None
+
+    @abstractmethod
+    def _load(self, analysis_id: str) -> Optional[ColumnarAnalysis]:
+        """Riapre un'analisi non residente (None se non esiste)."""
+
+    @abstractmethod
+    def _save(self, analysis_id: str, analysis: ColumnarAnalysis, upload_key: Optional[str]) -> ColumnarAnalysis:
+        """Salva una nuova analisi e restituisce la versione da tenere aperta."""
+
+    @abstractmethod
+    def _release(self, analysis_id: str, analysis: ColumnarAnalysis) -> bool:
+        """Rilascia un'analisi dalla memoria; True se non sarà più disponibile."""
+
+    def _enforce(self, keep: str) -> None:
+        """Rilascia in ordine LRU le analisi inattive da più di idle_ttl, poi finché si rientra in max_bytes."""
+        now = time.monotonic()
+        for entry in self._resident.values():
+            entry[2] = footprint(entry[0])  # le colonne mappate crescono con gli accessi
+        total = sum(entry[2] for entry in self._resident.values())
+        for analysis_id, (analysis, last_access, size) in list(self._resident.items()):
+            idle = self.idle_ttl > 0 and now - last_access > self.idle_ttl
+            over = self.max_bytes > 0 and total > self.max_bytes
+            if not idle and not over:
+                break  # ordine LRU: le successive sono più recenti
+            if analysis_id == keep:
+                continue  # quella appena richiesta resta anche se da sola supera il budget
+            del self._resident[analysis_id]
+            total -= size
+            self._counters["evictions"] += 1
+            dropped = self._release(analysis_id, analysis)
+            if self.on_evict is not None:
+                self.on_evict(analysis_id, dropped)
+
+    def stats(self) -> dict:
+        """Contatori del processo corrente (ogni worker gunicorn ha i suoi)."""
+        with self._lock:
+            return {
+                "backend": self.kind,
+                **self._counters,
+                "resident_analyses": len(self._resident),
+                "resident_bytes": sum(footprint(entry[0]) for entry in self._resident.values()),
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+            }
+
+
+class MemoryStore(AnalysisStore):
+    """
+    Analisi nel processo corrente. Quelle rilasciate dal budget vengono scartate oppure, con spill_dir,
+    scritte su disco e riaperte (mappate in memoria) al prossimo accesso.
+    """
+
+    kind = "memory"
+
+    def __init__(self, spill_dir: str = STORE_SPILL_DIR, **limits):
+        super().__init__(**limits)
+        self._uploads: dict[str, str] = {}
+        self._spilled: dict[str, str] = {}  # analysis_id -> cartella su disco
+        self._spill_dir = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spill_dir = tempfile.mkdtemp(prefix="spill-", dir=spill_dir)  # privata del processo
+            atexit.register(shutil.rmtree, self._spill_dir, True)
+
+    def _load(self, analysis_id: str) -> Optional[ColumnarAnalysis]:
+        path = self._spilled.get(analysis_id)
+        return read_analysis(path) if path is not None else None
+
+    def _save(self, analysis_id: str, analysis: ColumnarAnalysis, upload_key: Optional[str]) -> ColumnarAnalysis:
+        if upload_key is not None:
+            self._uploads[upload_key] = analysis_id
+        return analysis
+
+    def _release(self, analysis_id: str, analysis: ColumnarAnalysis) -> bool:
+        if self._spill_dir is None:
+            return True
+        if analysis_id not in self._spilled:
+            path = os.path.join(self._spill_dir, analysis_id)
+            write_analysis(analysis, path)
+            self._spilled[analysis_id] = path
+            self._counters["spills"] += 1
+        return False
+
+    def find_upload(self, upload_key: str) -> Optional[str]:
+        analysis_id = self._uploads.get(upload_key)
+        if analysis_id is not None and analysis_id not in self._resident and analysis_id not in self._spilled:
+            self._uploads.pop(upload_key, None)  # analisi scartata
+            return None
+        return analysis_id
+
+
+def footprint(analysis: ColumnarAnalysis) -> int:
+    """Byte approssimativi di un'analisi aperta: colonne in memoria (o già mappate), categorie e dati derivati."""
+    arrays = analysis.arrays
+    columns = arrays.opened() if isinstance(arrays, _LazyColumns) else arrays.values()
+    categories = sum(len(v) + 50 for values in analysis.categories.values() for v in values)
+    derived = sum(getattr(d, "nbytes", 0) for d in list(analysis.derived.values()))
+    return sum(a.nbytes for a in columns) + categories + derived
+
+
+def write_analysis(analysis: ColumnarAnalysis, path: str) -> None:
+    """Scrive colonne (.npy), categories.json e meta.json in path (cartella nuova, creata qui)."""
+    os.makedirs(path)
+    for name, arr in analysis.arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), arr, allow_pickle=arr.dtype == object)
+    with open(os.path.join(path, "categories.json"), "w", encoding="utf-8") as f:
+        json.dump(analysis.categories, f, ensure_ascii=False)
+    meta = {"length": len(analysis), "arrays": list(analysis.arrays), "meta": analysis.meta}
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def _open_array(path: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode="r").view(np.ndarray)
+    except ValueError:
+        return np.load(path, allow_pickle=True)  # colonna object (interi oltre int64): non mappabile
+
+
+class _LazyColumns(Mapping):
+    """Colonne di un'analisi su disco: ogni .npy viene mappato in memoria al primo accesso."""
+
+    def __init__(self, path: str, names: list[str]):
+        self._path = path
+        self._names = names
+        self._known = set(names)
+        self._open: dict[str, np.ndarray] = {}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        arr = self._open.get(name)
+        if arr is None:
+            if name not in self._known:
+                raise KeyError(name)
+            arr = self._open.setdefault(name, _open_array(os.path.join(self._path, f"{name}.npy")))
+        return arr
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def opened(self) -> list[np.ndarray]:
+        return list(self._open.values())
+
+
+def _read_meta(path: str) -> dict:
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_analysis(path: str, meta: Optional[dict] = None) -> ColumnarAnalysis:
+    """Apre un'analisi scritta da write_analysis: colonne mappate in memoria al primo uso (sola lettura)."""
+    meta = meta if meta is not None else _read_meta(path)
+    with open(os.path.join(path, "categories.json"), encoding="utf-8") as f:
+        categories = json.load(f)
+    return ColumnarAnalysis(_LazyColumns(path, meta["arrays"]), categories, meta.get("meta"))
+
+
+class SharedDirStore(AnalysisStore):
+    """
+    Analisi in una directory condivisa tra processi: root/analyses/<id>/ (colonne .npy, categories.json,
+    meta.json) e root/uploads/<chiave> (analysis_id dell'upload).
+    index: analysis_id -> meta.json, letto all'avvio; le analisi salvate da altri worker si aggiungono al primo accesso.
+    Ogni processo tiene aperte le analisi lette di recente (solo le colonne effettivamente usate sono mappate);
+    rilasciarle chiude solo le mappe, i dati restano su disco.
+    """
+
+    def __init__(
+        self,
+        root: str = ANALYSIS_STORE_DIR,
+        kind: str = "disk",
+        retention_days: float = STORE_RETENTION_DAYS,
+        max_analyses: int = STORE_MAX_ANALYSES,
+        **limits,
+    ):
+        super().__init__(**limits)
+        self.kind = kind
+        self.root = root
+        self.retention_days = retention_days
+        self.max_analyses = max_analyses
+        self._analyses_dir = os.path.join(root, "analyses")
+        self._uploads_dir = os.path.join(root, "uploads")
+        os.makedirs(self._analyses_dir, exist_ok=True)
+        os.makedirs(self._uploads_dir, exist_ok=True)
+        self._touched: dict[str, float] = {}  # analysis_id -> ultimo aggiornamento del mtime da questo processo
+        self.index: dict[str, dict] = self._load_index()
+        self._counters["removed"] = 0
+
+    def _load_index(self) -> dict[str, dict]:
+        index = {}
+        now = time.time()
+        for entry in os.scandir(self._analyses_dir):
+            if entry.name.startswith(".tmp-"):
+                if now - entry.stat().st_mtime > _STALE_TMP_SECONDS:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            if valid_id(entry.name):
+                try:
+                    index[entry.name] = _read_meta(entry.path)
+                except (OSError, ValueError):
+                    continue  # cartella incompleta o danneggiata: ignorata
+        return index
+
+    def _path(self, analysis_id: str) -> str:
+        return os.path.join(self._analyses_dir, analysis_id)
+
+    def _load(self, analysis_id: str) -> Optional[ColumnarAnalysis]:
+        if not valid_id(analysis_id):
+            return None
+        path = self._path(analysis_id)
+        if not os.path.isdir(path):
+            self.index.pop(analysis_id, None)  # rimossa (retention) da un altro worker
+            return None
+        meta = self.index.get(analysis_id)
+        if meta is None:
+            try:
+                meta = _read_meta(path)  # salvata da un altro worker dopo l'avvio
+            except (OSError, ValueError):
+                return None
+            self.index[analysis_id] = meta
+        return read_analysis(path, meta)
+
+    def _save(self, analysis_id: str, analysis: ColumnarAnalysis, upload_key: Optional[str]) -> ColumnarAnalysis:
+        path = self._path(analysis_id)
+        tmp = os.path.join(self._analyses_dir, f".tmp-{analysis_id}")
+        write_analysis(analysis, tmp)
+        os.rename(tmp, path)
+        meta = _read_meta(path)
+        with self._lock:
+            self.index[analysis_id] = meta
+        if upload_key is not None:
+            _write_text_atomic(self._upload_path(upload_key), analysis_id)
+        self.cleanup(keep=analysis_id)
+        return read_analysis(path, meta)  # colonne dalla page cache, condivise con gli altri worker
+
+    def get(self, analysis_id: str) -> Optional[ColumnarAnalysis]:
+        if analysis_id in self._resident and not os.path.isdir(self._path(analysis_id)):
+            self._forget(analysis_id)  # rimossa (retention) da un altro worker
+            return None
+        analysis = super().get(analysis_id)
+        if analysis is not None:
+            self._touch(analysis_id)
+        return analysis
+
+    def _touch(self, analysis_id: str) -> None:
+        """Segna l'analisi come usata (mtime della cartella), al massimo una volta ogni _TOUCH_INTERVAL."""
+        now = time.monotonic()
+        if now - self._touched.get(analysis_id, -_TOUCH_INTERVAL) < _TOUCH_INTERVAL:
+            return
+        self._touched[analysis_id] = now
+        try:
+            os.utime(self._path(analysis_id))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self, keep: Optional[str] = None) -> list[str]:
+        """
+        Rimuove dal disco le analisi oltre la retention (giorni dall'ultimo uso) e, oltre max_analyses, le meno
+        usate di recente (keep esclusa), più le chiavi upload che puntano ad analisi rimosse. Restituisce gli id rimossi.
+        """
+        if self.retention_days <= 0 and self.max_analyses <= 0:
+            return []
+        last_used = []
+        for entry in os.scandir(self._analyses_dir):
+            if valid_id(entry.name):
+                try:
+                    last_used.append((entry.stat().st_mtime, entry.name))
+                except FileNotFoundError:
+                    continue
+        last_used.sort()
+        cutoff = time.time() - self.retention_days * 86400
+        excess = len(last_used) - self.max_analyses if self.max_analyses > 0 else 0
+        removed = []
+        for mtime, analysis_id in last_used:
+            expired = self.retention_days > 0 and mtime < cutoff
+            if analysis_id == keep or not (expired or len(removed) < excess):
+                continue
+            self._remove(analysis_id)
+            removed.append(analysis_id)
+        if removed:
+            for entry in os.scandir(self._uploads_dir):
+                try:
+                    with open(entry.path, encoding="utf-8") as f:
+                        target = f.read().strip()
+                except (FileNotFoundError, UnicodeDecodeError):
+                    continue
+                if target in removed:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+    def _remove(self, analysis_id: str) -> None:
+        """Cancella l'analisi dal disco (i worker che la tengono mappata la rilasciano al prossimo accesso)."""
+        tmp = os.path.join(self._analyses_dir, f".tmp-removed-{analysis_id}")
+        try:
+            os.rename(self._path(analysis_id), tmp)  # sparisce in un colpo per gli altri worker
+        except FileNotFoundError:
+            return
+        shutil.rmtree(tmp, ignore_errors=True)
+        self._counters["removed"] += 1
+        self._forget(analysis_id)
+
+    def _forget(self, analysis_id: str) -> None:
+        with self._lock:
+            self.index.pop(analysis_id, None)
+            self._touched.pop(analysis_id, None)
+            self._resident.pop(analysis_id, None)
+        if self.on_evict is not None:
+            self.on_evict(analysis_id, True)
+
+    def _release(self, analysis_id: str, analysis: ColumnarAnalysis) -> bool:
+        return False
+
+    def _upload_path(self, upload_key: str) -> str:
+        return os.path.join(self._uploads_dir, upload_key.replace(":", "_"))
+
+    def find_upload(self, upload_key: str) -> Optional[str]:
+        try:
+            with open(self._upload_path(upload_key), encoding="utf-8") as f:
+                analysis_id = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return analysis_id if valid_id(analysis_id) and (analysis_id in self.index or os.path.isdir(self._path(analysis_id))) else None
+
+
+def _write_text_atomic(path: str, text: str) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def open_store(kind: str = ANALYSIS_STORE, root: str = ANALYSIS_STORE_DIR) -> AnalysisStore:
+    if kind == "memory":
+        return MemoryStore()
+    if kind in ("disk", "shared"):
+        return SharedDirStore(root, kind)
+    raise ValueError(f"ANALYSIS_STORE non valido: {kind!r} (usa 'memory', 'disk' o 'shared')")
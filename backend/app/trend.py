@@ -0,0 +1,125 @@
+"""
+Trend degli arrivi per periodo (giorno, settimana ISO, mese, stagione) e segmento visualizzato.
+La colonna data arrivo è a codici: ogni data distinta è convertita una volta per analisi aperta in giorni dal
+1970-01-01 (tabella int32 in analysis.derived); il periodo si calcola con aritmetica vettoriale sulle date
+distinte, si assegna alle righe con un'indicizzazione per codice, e conteggi, revenue e notti per
+(periodo, segmento) escono da un solo passaggio di np.bincount.
+Periodi in ordine cronologico (solo quelli con arrivi); stagioni meteorologiche (l'inverno 2024 va da
+dicembre 2023 a febbraio 2024).
+"""
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis, effective_revenues
+from app.models import SEGMENTS_BY_CODE
+
+GRANULARITIES = ("day", "week", "month", "season")
+NO_DATE = np.iinfo(np.int32).min
+_EPOCH = date(1970, 1, 1)
+_SEASONS = {12: "inverno", 3: "primavera", 6: "estate", 9: "autunno"}  # mese di inizio -> nome
+
+
+def arrival_days(analysis: ColumnarAnalysis) -> np.ndarray:
+    """
+    Data arrivo in giorni dal 1970-01-01 per codice categoria (NO_DATE se non valida; ultimo elemento = codice -1,
+    data mancante): la colonna data è codici + questa tabella, convertita una volta per analisi aperta.
+    """
+    days = analysis.derived.get(("days", "data_arrivo"))
+    if days is None:
+        categories = analysis.categories["data_arrivo"]
+        days = np.full(len(categories) + 1, NO_DATE, dtype=np.int32)
+        for code, value in enumerate(categories):
+            try:
+                day = np.datetime64(value, "D")
+            except ValueError:
+                continue  # testo non data conservato dal parser
+            if not np.isnat(day):
+                days[code] = day.astype(np.int64)
+        analysis.derived[("days", "data_arrivo")] = days
+    return days
+
+
+def _months(days: np.ndarray) -> np.ndarray:
+    """Mesi dal gennaio 1970."""
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def bucket_ids(days: np.ndarray, granularity: str) -> np.ndarray:
+    """Identificativo crescente del periodo di ogni giorno (stesso ordine della cronologia)."""
+    days = days.astype(np.int64)
+    if granularity == "day":
+        return days
+    if granularity == "week":
+        return days - (days + 3) % 7  # lunedì della settimana (1970-01-01 era giovedì)
+    if granularity == "month":
+        return _months(days)
+    if granularity == "season":
+        return (_months(days) + 1) // 3  # dicembre apre la stagione dell'anno successivo
+    raise ValueError(granularity)
+
+
+def _month_start(months: int) -> date:
+    return date(1970 + months // 12, months % 12 + 1, 1)
+
+
+def bucket_label(bucket: int, granularity: str) -> tuple[str, str, str]:
+    """(etichetta, primo giorno, ultimo giorno) del periodo, date in formato YYYY-MM-DD."""
+    if granularity in ("day", "week"):
+        start = _EPOCH + timedelta(days=bucket)
+        if granularity == "day":
+            return start.isoformat(), start.isoformat(), start.isoformat()
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}", start.isoformat(), (start + timedelta(days=6)).isoformat()
+    first = bucket if granularity == "month" else bucket * 3 - 1
+    last = first if granularity == "month" else first + 2
+    start, end = _month_start(first), _month_start(last + 1) - timedelta(days=1)
+    if granularity == "month":
+        return f"{start.year}-{start.month:02d}", start.isoformat(), end.isoformat()
+    return f"{end.year}-{_SEASONS[start.month]}", start.isoformat(), end.isoformat()
+
+
+def _totals(count: int, revenue: float, nights: float) -> dict:
+    return {"count": count, "revenue": round(revenue, 2), "notti": int(nights)}
+
+
+def trend(
+    analysis: ColumnarAnalysis, segment_codes: np.ndarray, granularity: str, mask: Optional[np.ndarray] = None
+) -> dict:
+    """Arrivi, revenue e notti per periodo e segmento (righe selezionate da mask, se data)."""
+    days = arrival_days(analysis)
+    dated = days != NO_DATE
+    buckets, bucket_of_date = np.unique(bucket_ids(days[dated], granularity), return_inverse=True)
+    period = np.full(len(days), -1, dtype=np.int64)  # periodo per codice data, -1 se senza data
+    period[dated] = bucket_of_date
+    rows = period[analysis.codes("data_arrivo")]
+    revenues = effective_revenues(analysis)
+    nights, nights_null = analysis.numbers("numero_notti")
+    nights = np.where(nights_null, 0, nights).astype(np.float64)
+    if mask is not None:
+        rows, segment_codes, revenues, nights = rows[mask], segment_codes[mask], revenues[mask], nights[mask]
+    selected = rows >= 0
+    n_seg = len(SEGMENTS_BY_CODE)
+    keys = rows[selected] * n_seg + segment_codes[selected]
+    size = len(buckets) * n_seg
+    counts = np.bincount(keys, minlength=size).reshape(-1, n_seg)
+    revenue = np.bincount(keys, weights=revenues[selected], minlength=size).reshape(-1, n_seg)
+    notti = np.bincount(keys, weights=nights[selected], minlength=size).reshape(-1, n_seg)
+    periods = []
+    rows_out = zip(buckets.tolist(), counts.tolist(), revenue.tolist(), notti.tolist())
+    for bucket, seg_counts, seg_revenue, seg_notti in rows_out:
+        if not any(seg_counts):
+            continue  # data presente nell'analisi ma nessun arrivo selezionato
+        label, start, end = bucket_label(bucket, granularity)
+        periods.append({
+            "periodo": label,
+            "inizio": start,
+            "fine": end,
+            "totale": _totals(sum(seg_counts), sum(seg_revenue), sum(seg_notti)),
+            "segmenti": {
+                SEGMENTS_BY_CODE[c].value: _totals(seg_counts[c], seg_revenue[c], seg_notti[c])
+                for c in range(n_seg) if seg_counts[c]
+            },
+        })
+    return {"granularity": granularity, "periodi": periods, "senza_data": int(len(rows) - selected.sum())}
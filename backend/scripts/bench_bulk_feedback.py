@@ -0,0 +1,88 @@
+"""
+Import note operatore da gestionale su SQLite: un salvataggio per record (segmento calcolato e commit per
+ciascuno, come POST .../customer/<row_index>/feedback) contro il blocco di POST .../feedback/bulk
+(segmenti per combinazione distinta di input, una sola transazione con put_many).
+Verifica che i feedback salvati coincidano. Da eseguire sul disco di produzione (ANALYSIS_STORE_DIR).
+Esegui: python -m scripts.bench_bulk_feedback [cartella] [record]
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from app.feedback import SqliteFeedback
+from app.operator_refinement import clean_operator_input, operator_input_segment, operator_input_segments
+
+NOTE = [
+    "Arrivo tardi per lavoro", "Culla in camera", "Anniversario di matrimonio", "Vista lago se possibile",
+    "Viaggiamo con il cane", "Richiesta fattura aziendale", "", None,
+]
+RICHIESTE = ["camera tripla", "transfer dall'aeroporto", "late checkout", "", None]
+SERVIZI = [None, ["Parcheggio"], ["Spa", "Cena"], ["Colazione inclusa"], ["Sala meeting"]]
+INDICATORI = [None, [], ["bambini"], ["weekend"], ["attrazioni_turistiche"]]
+
+
+def _records(n: int) -> list[dict]:
+    return [
+        {
+            "row_index": i,
+            "note_prenotazione": random.choice(NOTE),
+            "richieste_speciali": random.choice(RICHIESTE),
+            "servizi_selezionati": random.choice(SERVIZI),
+            "indicatori": random.choice(INDICATORI),
+        }
+        for i in range(n)
+    ]
+
+
+def _payload(inputs: dict, segment: str | None) -> dict:
+    return {**inputs, "segment_computed": segment, "segment": segment, "updated_at": "2024-01-01T00:00:00Z"}
+
+
+def _one_by_one(store: SqliteFeedback, analysis_id: str, records: list[dict]) -> None:
+    for record in records:
+        inputs = clean_operator_input(record)
+        store.put(analysis_id, record["row_index"], _payload(inputs, operator_input_segment(inputs)))
+
+
+def _bulk(store: SqliteFeedback, analysis_id: str, records: list[dict]) -> None:
+    inputs = [clean_operator_input(r) for r in records]
+    segments = operator_input_segments(inputs)
+    store.put_many(analysis_id, [(r["row_index"], _payload(x, s)) for r, x, s in zip(records, inputs, segments)])
+
+
+def _run(store: SqliteFeedback, save, records: list[dict]) -> tuple[float, str]:
+    analysis_id = str(uuid.uuid4())
+    t0 = time.perf_counter()
+    save(store, analysis_id, records)
+    return time.perf_counter() - t0, analysis_id
+
+
+def main():
+    base = sys.argv[1] if len(sys.argv) > 1 else None
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    random.seed(3)
+    records = _records(n)
+    root = tempfile.mkdtemp(dir=base)
+    try:
+        store = SqliteFeedback(os.path.join(root, "db"))
+        single, single_id = _run(store, _one_by_one, records)
+        print(f"un salvataggio per record: {n} record in {single:.2f}s ({n / single:8.0f} record/s)")
+        commits = store.commits
+        bulk, bulk_id = _run(store, _bulk, records)
+        print(f"blocco (put_many):         {n} record in {bulk:.2f}s ({n / bulk:8.0f} record/s), "
+              f"{store.commits - commits} commit")
+        rows = [r["row_index"] for r in records]
+        if store.get_many(single_id, rows) != store.get_many(bulk_id, rows):
+            sys.exit("feedback diversi tra salvataggi singoli e blocco")
+        if store.version(bulk_id) != n:
+            sys.exit(f"versione feedback {store.version(bulk_id)} invece di {n}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Filtri clienti (canale, prenotante, camera, date, notti, bambini, alta spesa) su un'analisi grande:
+list comprehension su SegmentedCustomer contro il motore a bitmap di app/filters.py (indici già costruiti).
+Verifica che i due diano le stesse righe; tempi per conteggio e prima pagina da 100.
+Esegui: python -m scripts.bench_customer_filters [righe]
+"""
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+from werkzeug.datastructures import MultiDict
+
+from app.analysis import ColumnarAnalysis
+from app.filters import bitmap_count, match_bitmap, match_mask, parse_query
+from app.models import Scores, Segment, SegmentedCustomer
+
+CANALI = ["corporate", "Booking.com", "Expedia", "GDS", "direct", None]
+PRENOTANTI = ["cliente", "agenzia", "azienda", None]
+CAMERE = ["Standard", "Deluxe", "Suite", None]
+THRESHOLD = 180.0
+
+QUERIES = [
+    ({"canale": ["corporate", "GDS"]}, lambda c: c.canale in ("corporate", "GDS")),
+    (
+        {"prenotante": ["agenzia"], "bambini": ["1"], "notti_min": ["3"]},
+        lambda c: c.prenotante == "agenzia" and (c.numero_bambini or 0) > 0
+        and c.numero_notti is not None and c.numero_notti >= 3,
+    ),
+    (
+        {"data_da": ["2024-06-01"], "data_a": ["2024-08-31"], "alta_spesa": ["1"]},
+        lambda c: c.data_arrivo is not None and "2024-06-01" <= c.data_arrivo <= "2024-08-31"
+        and c.spesa_media is not None and c.spesa_media >= THRESHOLD,
+    ),
+    (
+        {"categoria_camera": ["Suite"], "notti_max": ["1"], "op": ["or"]},
+        lambda c: c.categoria_camera == "Suite" or (c.numero_notti is not None and c.numero_notti <= 1),
+    ),
+]
+
+
+def _customers(n: int) -> list[SegmentedCustomer]:
+    start = date(2022, 1, 1)
+    days = [(start + timedelta(days=d)).isoformat() for d in range(3 * 365)]
+    segments = list(Segment)
+    return [
+        SegmentedCustomer(
+            row_index=i,
+            segment=random.choice(segments),
+            scores=Scores.of(),
+            numero_notti=random.choice([1, 2, 3, 4, 7, None]),
+            canale=random.choice(CANALI),
+            spesa_media=random.choice([None, round(random.uniform(60, 400), 2)]),
+            data_arrivo=random.choice(days),
+            categoria_camera=random.choice(CAMERE),
+            prenotante=random.choice(PRENOTANTI),
+            numero_bambini=random.choice([0, 0, 0, 1, 2, None]),
+        )
+        for i in range(n)
+    ]
+
+
+def _ms(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    random.seed(5)
+    customers = _customers(n)
+    analysis = ColumnarAnalysis.from_customers(customers)
+    analysis.meta["threshold_top25"] = THRESHOLD
+    print(f"{n} clienti")
+    print(f"{'filtri':<58} {'righe':>7} {'lista (ms)':>11} {'conteggio (ms)':>15} {'pagina (ms)':>12}")
+    for args, predicate in QUERIES:
+        query = parse_query(MultiDict([(k, v) for k, values in args.items() for v in values]))
+        expected = [i for i, c in enumerate(customers) if predicate(c)]
+        if np.flatnonzero(match_mask(analysis, query)).tolist() != expected:
+            sys.exit(f"risultati diversi per {args}")
+        t_list = _ms(lambda: [c for c in customers if predicate(c)][:100])
+        t_count = _ms(lambda: bitmap_count(match_bitmap(analysis, query)))
+        t_page = _ms(lambda: np.flatnonzero(match_mask(analysis, query))[:100])
+        label = ", ".join(f"{k}={'|'.join(v)}" for k, v in args.items())
+        print(f"{label:<58} {len(expected):>7} {t_list:>11.1f} {t_count:>15.2f} {t_page:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
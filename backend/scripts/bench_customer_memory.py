@@ -0,0 +1,100 @@
+"""
+Memoria per cliente dei risultati di segmentazione:
+- prima: dataclass con __dict__, un oggetto Scores per riga, una stringa per cella (come il vecchio parser riga per riga);
+- dopo: SegmentedCustomer/Scores con slots, Scores condivisi (Scores.of), stringhe ripetute internate dal parser;
+- ColumnarAnalysis (app/analysis.py): formato in cui l'analisi resta in memoria.
+Esegui: python -m scripts.bench_customer_memory [righe]
+"""
+import gc
+import io
+import sys
+import tracemalloc
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from app.analysis import ColumnarAnalysis
+from app.ingest import iter_segmented_csv
+from app.models import Scores, Segment, SegmentedCustomer
+from scripts.bench_parallel_ingest import _csv_bytes
+
+
+@dataclass
+class LegacyScores:
+    business: int = 0
+    leisure: int = 0
+    coppia: int = 0
+    famiglia: int = 0
+
+
+@dataclass
+class LegacyCustomer:
+    row_index: int
+    segment: Segment
+    scores: LegacyScores
+    numero_notti: Optional[int] = None
+    numero_ospiti: Optional[int] = None
+    canale: Optional[str] = None
+    giorno_arrivo: Optional[str] = None
+    storico_soggiorni: Optional[int] = None
+    spesa_media: Optional[float] = None
+    cliente_id: Optional[str] = None
+    nome_cliente: Optional[str] = None
+    data_arrivo: Optional[str] = None
+    categoria_camera: Optional[str] = None
+    revenue: Optional[float] = None
+    anticipo_giorni: Optional[int] = None
+    prenotante: Optional[str] = None
+    numero_bambini: Optional[int] = None
+
+
+_NAMES = [f.name for f in fields(SegmentedCustomer) if f.name != "scores"]
+
+
+def _copy(v):
+    """Stringa nuova per cella, come le righe lette una ad una dal file."""
+    return v.encode().decode() if isinstance(v, str) else v
+
+
+def _legacy(c: SegmentedCustomer) -> LegacyCustomer:
+    s = c.scores
+    return LegacyCustomer(
+        scores=LegacyScores(s.business, s.leisure, s.coppia, s.famiglia),
+        **{name: _copy(getattr(c, name)) for name in _NAMES},
+    )
+
+
+def _measure(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return obj, used
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    data = _csv_bytes(n)
+    customers = [c for part in iter_segmented_csv(io.BytesIO(data)) for c in part]
+    rows = len(customers)
+
+    legacy, legacy_bytes = _measure(lambda: [_legacy(c) for c in customers])
+    del legacy
+    compact, compact_bytes = _measure(
+        lambda: [c for part in iter_segmented_csv(io.BytesIO(data)) for c in part]
+    )
+    assert all(isinstance(c.scores, Scores) for c in compact)
+    del compact
+    analysis, columnar_bytes = _measure(lambda: ColumnarAnalysis.from_customers(customers))
+
+    print(f"{rows} clienti, byte per cliente:")
+    print(f"  prima (dataclass con __dict__)      {legacy_bytes / rows:8.1f}")
+    print(f"  dopo (slots, Scores condivisi)      {compact_bytes / rows:8.1f}  "
+          f"(-{100 * (1 - compact_bytes / legacy_bytes):.0f}%)")
+    print(f"  ColumnarAnalysis                    {columnar_bytes / rows:8.1f}  (array: {analysis.nbytes / rows:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Salvataggi feedback concorrenti su SQLite: un commit per salvataggio (una connessione per thread)
+contro il group commit di app/feedback.py (più salvataggi nella stessa transazione).
+Verifica anche che ogni valore salvato sia leggibile. Da eseguire sul disco di produzione
+(ANALYSIS_STORE_DIR): su tmpfs l'fsync non costa e le differenze spariscono.
+Esegui: python -m scripts.bench_feedback_writes [cartella] [thread] [salvataggi per thread]
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.feedback import SqliteFeedback
+
+
+def _payload(i: int) -> dict:
+    return {"indicatori": ["bambini"], "segment": "Famiglia", "n": i}
+
+
+def _one_commit_per_save(store: SqliteFeedback, analysis_id: str, rows: range) -> None:
+    conn = sqlite3.connect(store.path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA synchronous=FULL")
+    for r in rows:
+        conn.execute("INSERT OR REPLACE INTO feedback VALUES (?, ?, ?)", (analysis_id, r, json.dumps(_payload(r))))
+    conn.close()
+
+
+def _group_commit(store: SqliteFeedback, analysis_id: str, rows: range) -> None:
+    for r in rows:
+        store.put(analysis_id, r, _payload(r))
+
+
+def _run(store: SqliteFeedback, save, threads: int, per_thread: int) -> float:
+    analysis_id = str(uuid.uuid4())
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda t: save(store, analysis_id, range(t * per_thread, (t + 1) * per_thread)), range(threads)))
+    elapsed = time.perf_counter() - t0
+    missing = [r for r in range(threads * per_thread) if (store.get(analysis_id, r) or {}).get("n") != r]
+    if missing:
+        sys.exit(f"feedback mancanti: {len(missing)}")
+    return elapsed
+
+
+def main():
+    base = sys.argv[1] if len(sys.argv) > 1 else None
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    per_thread = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    total = threads * per_thread
+    root = tempfile.mkdtemp(dir=base)
+    try:
+        store = SqliteFeedback(os.path.join(root, "db"))
+        naive = _run(store, _one_commit_per_save, threads, per_thread)
+        print(f"un commit per salvataggio: {total} salvataggi da {threads} thread in {naive:.2f}s, {total} commit")
+        grouped = _run(store, _group_commit, threads, per_thread)
+        print(f"group commit:              {total} salvataggi da {threads} thread in {grouped:.2f}s, "
+              f"{store.commits} commit ({total / store.commits:.1f} salvataggi per commit)")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
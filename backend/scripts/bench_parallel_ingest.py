@@ -0,0 +1,64 @@
+"""
+Confronta l'ingest CSV in un solo processo con quello parallelo (pool di processi):
+stessi risultati nello stesso ordine di row_index, e tempi.
+Esegui: INGEST_WORKERS=8 python -m scripts.bench_parallel_ingest [righe]
+"""
+import io
+import random
+import sys
+import time
+from dataclasses import asdict
+
+from app import ingest
+
+CANALI = ["corporate", "GDS", "Booking.com", "Expedia", "direct", "sito"]
+CATEGORIE = ["Standard", "Superior", "Deluxe", "Junior Suite"]
+PRENOTANTI = ["cliente", "Agenzia Viaggi", "azienda", "guest", "tour operator"]
+
+
+def _csv_bytes(n: int) -> bytes:
+    random.seed(1)
+    lines = ["cliente,data arrivo,numero notti,numero ospiti,canale,tariffa,categoria camera,anticipo,prenotante"]
+    for i in range(n):
+        lines.append(",".join([
+            f"C{i}",
+            f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            str(random.randint(1, 7)),
+            str(random.randint(1, 5)),
+            random.choice(CANALI),
+            f"{random.uniform(80, 350):.2f}",
+            random.choice(CATEGORIE),
+            str(random.randint(0, 90)),
+            random.choice(PRENOTANTI),
+        ]))
+    return "\n".join(lines).encode()
+
+
+def _run(data: bytes) -> tuple[list, float]:
+    t0 = time.perf_counter()
+    customers = [c for part in ingest.iter_segmented_csv(io.BytesIO(data)) for c in part]
+    return customers, time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 400_000
+    data = _csv_bytes(n)
+    workers = max(2, ingest.ingest_workers())
+
+    ingest.INGEST_WORKERS = 1
+    serial, t_serial = _run(data)
+
+    ingest.INGEST_WORKERS = workers
+    ingest.INGEST_PARALLEL_MIN_ROWS = 0
+    _run(_csv_bytes(1000))  # avvio del pool escluso dai tempi
+    parallel, t_parallel = _run(data)
+
+    same = [asdict(c) for c in serial] == [asdict(c) for c in parallel]
+    print(f"{len(serial)} righe: 1 processo {t_serial:.2f}s, {workers} processi {t_parallel:.2f}s, "
+          f"risultati {'identici' if same else 'DIVERSI'}")
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
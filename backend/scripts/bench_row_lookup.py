@@ -0,0 +1,51 @@
+"""
+Latenza della ricerca di un cliente per row_index (scheda cliente, feedback, refresh) al crescere dell'analisi:
+scansione della lista di SegmentedCustomer (vecchio next(...)), confronto vettoriale sulla colonna row_index
+e indice row_index → posizione di ColumnarAnalysis.position.
+Esegui: python -m scripts.bench_row_lookup [righe,righe,...]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis
+from app.models import Scores, Segment, SegmentedCustomer
+
+LOOKUPS = 200
+
+
+def _per_lookup_us(find, keys: list[int]) -> float:
+    t0 = time.perf_counter()
+    for k in keys:
+        find(k)
+    return (time.perf_counter() - t0) / len(keys) * 1e6
+
+
+def main():
+    sizes = [int(x) for x in sys.argv[1].split(",")] if len(sys.argv) > 1 else [10_000, 100_000, 300_000, 1_000_000]
+    random.seed(3)
+    print(f"{'righe':>9} {'lista (µs)':>12} {'colonna (µs)':>13} {'indice (µs)':>12}")
+    for n in sizes:
+        customers = [SegmentedCustomer(row_index=i, segment=Segment.LEISURE, scores=Scores.of()) for i in range(n)]
+        analysis = ColumnarAnalysis.from_customers(customers)
+        keys = [random.randrange(n) for _ in range(LOOKUPS)]
+        column = analysis.row_index
+
+        def scan_list(r: int):
+            return next((c for c in customers if c.row_index == r), None)
+
+        def scan_column(r: int):
+            hits = np.flatnonzero(column == r)
+            return int(hits[0]) if len(hits) else None
+
+        assert all(analysis.position(k) == scan_column(k) == k for k in keys[:20])
+        t_list = _per_lookup_us(scan_list, keys[:20])
+        t_column = _per_lookup_us(scan_column, keys)
+        t_index = _per_lookup_us(analysis.position, keys)
+        print(f"{n:>9} {t_list:>12.1f} {t_column:>13.1f} {t_index:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
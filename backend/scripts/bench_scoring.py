@@ -0,0 +1,73 @@
+"""
+Confronta compute_scores_batch con compute_scores/assign_segment (stesso risultato) e misura i tempi.
+Esegui: python -m scripts.bench_scoring [righe]
+"""
+import random
+import sys
+import time
+
+import numpy as np
+
+from app.models import SEGMENTS_BY_CODE
+from app.scoring import assign_segment, compute_scores, compute_scores_batch
+
+CANALI = ["corporate", "GDS", "Booking.com", "Expedia", "direct", "sito", "OTA", "phone", "", None]
+GIORNI = ["lun", "mar", "mer", "gio", "ven", "sab", "dom", "lunedì", "Sabato", "", None]
+CATEGORIE = ["Standard", "Superior", "Deluxe", "Junior Suite", "Suite", "", None]
+PRENOTANTI = ["cliente", "agenzia", "azienda", "tour operator", "guest", "", None]
+
+
+def _random_columns(n: int) -> dict:
+    rnd = random.Random(7)
+    return {
+        "numero_notti": [rnd.randint(1, 8) for _ in range(n)],
+        "numero_ospiti": [rnd.randint(1, 5) for _ in range(n)],
+        "canale": [rnd.choice(CANALI) for _ in range(n)],
+        "giorno_arrivo": [rnd.choice(GIORNI) for _ in range(n)],
+        "spesa_media": [rnd.choice([None, round(rnd.uniform(60, 400), 2)]) for _ in range(n)],
+        "categoria_camera": [rnd.choice(CATEGORIE) for _ in range(n)],
+        "is_vacation_period": [rnd.random() < 0.4 for _ in range(n)],
+        "anticipo_giorni": [rnd.choice([None, rnd.randint(0, 120)]) for _ in range(n)],
+        "prenotante": [rnd.choice(PRENOTANTI) for _ in range(n)],
+        "numero_bambini": [rnd.choice([None, 0, 0, 1, 2]) for _ in range(n)],
+    }
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    cols = _random_columns(n)
+    params = {"threshold_top25": 250.0, "media_spesa": 200.0}
+
+    check = min(n, 100_000)
+    t0 = time.perf_counter()
+    expected = []
+    for k in range(check):
+        scores = compute_scores(**{key: v[k] for key, v in cols.items()}, **params)
+        expected.append((scores, assign_segment(scores)))
+    t_rows = time.perf_counter() - t0
+
+    text_cols = ("canale", "giorno_arrivo", "categoria_camera", "prenotante")
+    optional_cols = ("spesa_media", "anticipo_giorni", "numero_bambini")
+    arrays = {}
+    for key, v in cols.items():
+        if key in text_cols:
+            arrays[key] = np.array(v, dtype=object)
+        elif key in optional_cols:
+            arrays[key] = np.array(v, dtype=float)  # None → NaN
+        else:
+            arrays[key] = np.array(v)
+    t0 = time.perf_counter()
+    batch = compute_scores_batch(**arrays, **params)
+    t_batch = time.perf_counter() - t0
+
+    for k, (scores, segment) in enumerate(expected):
+        if batch.scores_at(k) != scores or SEGMENTS_BY_CODE[batch.segment[k]] != segment:
+            print(f"DIFFERENZA alla riga {k}")
+            sys.exit(1)
+    print(f"OK: {check} righe identiche.")
+    print(f"compute_scores riga per riga: {t_rows / check * 1e6:.2f} µs/riga ({t_rows:.2f}s per {check})")
+    print(f"compute_scores_batch:         {t_batch:.3f}s per {n} righe")
+
+
+if __name__ == "__main__":
+    main()
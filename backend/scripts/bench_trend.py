@@ -0,0 +1,90 @@
+"""
+Trend settimanale su un'analisi pluriennale: parsing di data_arrivo riga per riga (split + isocalendar per
+cliente), una volta per data distinta (get_trend precedente) e motore di app/trend.py (colonna giorni in cache).
+Verifica che i conteggi per settimana ISO coincidano e che i periodi escano in ordine cronologico
+(il vecchio ordinamento per stringa metteva 2024-W10 prima di 2024-W9).
+Esegui: python -m scripts.bench_trend [righe] [anni]
+"""
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+import numpy as np
+
+from app.analysis import ColumnarAnalysis
+from app.models import SEGMENTS_BY_CODE, Scores, Segment, SegmentedCustomer
+from app.trend import GRANULARITIES, trend
+
+
+def _per_row(customers: list[SegmentedCustomer]) -> Counter:
+    out: Counter = Counter()
+    for c in customers:
+        y, m, d = map(int, c.data_arrivo.split("-")[:3])
+        iso_year, week, _ = date(y, m, d).isocalendar()
+        out[(f"{iso_year}-W{week:02d}", c.segment.value)] += 1
+    return out
+
+
+def _per_distinct_date(analysis: ColumnarAnalysis) -> Counter:
+    week_ids: dict[str, int] = {}
+    dates = analysis.categories["data_arrivo"]
+    week_of_date = np.empty(len(dates), dtype=np.int64)
+    for k, value in enumerate(dates):
+        y, m, d = map(int, value.split("-")[:3])
+        iso_year, week, _ = date(y, m, d).isocalendar()
+        week_of_date[k] = week_ids.setdefault(f"{iso_year}-W{week:02d}", len(week_ids))
+    n_seg = len(SEGMENTS_BY_CODE)
+    weeks = week_of_date[analysis.codes("data_arrivo")]
+    counts = np.bincount(weeks * n_seg + analysis.segment, minlength=len(week_ids) * n_seg).reshape(-1, n_seg)
+    return Counter({
+        (week, SEGMENTS_BY_CODE[c].value): int(counts[i, c])
+        for week, i in week_ids.items() for c in np.flatnonzero(counts[i])
+    })
+
+
+def _ms(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return (time.perf_counter() - t0) * 1000, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    random.seed(9)
+    start = date(2026 - years, 1, 1)
+    days = [(start + timedelta(days=d)).isoformat() for d in range(years * 365)]
+    segments = list(Segment)
+    customers = [
+        SegmentedCustomer(
+            row_index=i, segment=random.choice(segments), scores=Scores.of(),
+            data_arrivo=random.choice(days), numero_notti=random.randint(1, 7), revenue=random.uniform(80, 900),
+        )
+        for i in range(n)
+    ]
+    analysis = ColumnarAnalysis.from_customers(customers)
+    print(f"{n} arrivi su {years} anni ({len(days)} date distinte)")
+
+    t_row, expected = _ms(lambda: _per_row(customers))
+    t_distinct, distinct = _ms(lambda: _per_distinct_date(analysis))
+    t_cold, result = _ms(lambda: trend(analysis, analysis.segment, "week"))
+    got = Counter({
+        (p["periodo"], seg): v["count"] for p in result["periodi"] for seg, v in p["segmenti"].items()
+    })
+    if got != expected or distinct != expected:
+        sys.exit("conteggi settimanali diversi")
+    starts = [p["inizio"] for p in result["periodi"]]
+    if starts != sorted(starts):
+        sys.exit("periodi non in ordine cronologico")
+    print(f"per riga:               {t_row:8.1f} ms")
+    print(f"per data distinta:      {t_distinct:8.1f} ms")
+    print(f"motore (prima chiamata):{t_cold:8.1f} ms")
+    for granularity in GRANULARITIES:
+        t, result = _ms(lambda: trend(analysis, analysis.segment, granularity))
+        print(f"motore {granularity:<7} ({len(result['periodi']):>4} periodi): {t:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
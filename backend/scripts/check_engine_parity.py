@@ -0,0 +1,142 @@
+"""
+Verifica che il motore colonnare di parse_and_segment produca la stessa lista del motore riga per riga.
+Genera file casuali "sporchi" (celle vuote, numeri europei, date in formati diversi, valori non validi).
+Date con orario: notti e anticipo come pd.to_datetime sul valore intero (dal 15 alle 14:00 al 17 alle 10:00 = 1 notte).
+Esegui: python -m scripts.check_engine_parity [righe] [iterazioni]
+"""
+import random
+import sys
+import time
+from dataclasses import asdict
+
+import pandas as pd
+
+from app.excel_parser import parse_and_segment
+
+NUMERI = ["1", "2", "3", "4", "7", "0", "2.5", "-1", "", "abc", "1e400", "3,0", None]
+SPESE = [
+    "120", "95.5", "1.234,56", "89,90", "", "n/d", "nan", "inf", "0", "250", "1 234,50", "1.234", " 99.00 ",
+    "1_000", "1.234.567", "-12,5", "1e400", None,
+]
+DATE = [
+    "2024-06-15", "2024-01-02", "15/06/2024", "05/06/2024", "2024-06-15 00:00:00", "2024/12/24",
+    "31-12-2024", "", "lun", "202", "2024-13-45", "2024-06-15T10:00:00+02:00", None,
+]
+# Colonne omogenee (formato dedotto dal campione) con qualche valore fuori formato
+DATE_ISO = ["2024-06-15", "2024-1-2", "2023-12-31 00:00:00", "2024-08-09", "2024-02-30", "", None]
+DATE_DMY = ["15/06/2024", "05/06/2024", "1/2/2024", "31/12/2023", "2024-06-15", "12/31/2024", "", None]
+# Date con orario (export da gestionale, celle .xlsx come str(datetime))
+DATE_ISO_TIME = ["2024-06-15 14:00", "2024-06-16 10:00:00", "2024-06-15T23:30:00", "2024-06-18", "2024-06-20 09:15", "", None]
+DATE_DMY_TIME = ["15/06/2024 14:00", "16/06/2024 10:00", "18/06/2024", "20/06/2024 23:59", "2024-06-17 08:00", "", None]
+GIORNI = ["lun", "Martedì", "sab", "domenica", "3", "", "0", None]
+CANALI = ["corporate", "GDS", "Booking.com", "Expedia", "direct", "sito", "", None]
+CATEGORIE = ["Standard", "Superior", "Deluxe", "Junior Suite", "", None]
+PRENOTANTI = ["cliente", "Agenzia Viaggi", "azienda", "guest", "tour operator", "", None]
+BAMBINI = ["0", "1", "2", "sì", "no", "x", "", "abc", "1e400", None]
+
+
+def _random_frame(n: int, columns: list[str]) -> pd.DataFrame:
+    def date_pool():
+        return random.choice([DATE, DATE_ISO, DATE_DMY, DATE_ISO_TIME, DATE_DMY_TIME])
+
+    pools = {
+        "cliente": [f"C{i}" for i in range(50)] + ["", None],
+        "nome cliente": ["Mario Rossi", " Anna ", "", None],
+        "data arrivo": date_pool(),
+        "data partenza": date_pool(),
+        "data prenotazione": date_pool(),
+        "numero notti": NUMERI,
+        "numero ospiti": NUMERI,
+        "interi": NUMERI,
+        "bambini": BAMBINI,
+        "giorno arrivo": random.choice([GIORNI, DATE_DMY]),
+        "canale": CANALI,
+        "tariffa": SPESE,
+        "totale": SPESE,
+        "categoria camera": CATEGORIE,
+        "anticipo": NUMERI,
+        "prenotante": PRENOTANTI,
+    }
+    rows = [{c: random.choice(pools[c]) for c in columns} for _ in range(n)]
+    return pd.DataFrame(rows)
+
+
+def _same(a: list, b: list) -> bool:
+    return [repr(asdict(x)) for x in a] == [repr(asdict(x)) for x in b]
+
+
+def _baseline_date(v):
+    """Data come la interpretava il parser prima del formato per colonna: pd.to_datetime sul valore intero."""
+    return pd.to_datetime(v).to_pydatetime()
+
+
+def _check_timestamps() -> bool:
+    """Notti e anticipo da date con orario: stessi valori di pd.to_datetime sul valore intero, per entrambi i motori."""
+    ok = True
+    for pool in (DATE_ISO_TIME, DATE_DMY_TIME):
+        dates = [v for v in pool if v]
+        pairs = [(a, b) for a in dates for b in dates]
+        df = pd.DataFrame({
+            "cliente": [f"C{i}" for i in range(len(pairs))],
+            "data arrivo": [a for a, _ in pairs],
+            "data partenza": [b for _, b in pairs],
+            "data prenotazione": [b for _, b in pairs],
+        })
+        expected = []
+        for a, b in pairs:
+            arr, other = _baseline_date(a), _baseline_date(b)
+            expected.append((max(1, (other - arr).days), (arr - other).days if other <= arr else None))
+        for engine in ("rows", "columns"):
+            got = [(c.numero_notti, c.anticipo_giorni) for c in parse_and_segment(df, engine=engine)[0]]
+            if got != expected:
+                print(f"DIFFERENZA date con orario ({engine}): {[(p, g, e) for p, g, e in zip(pairs, got, expected) if g != e][:3]}")
+                ok = False
+    return ok
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    all_columns = [
+        "cliente", "nome cliente", "data arrivo", "data partenza", "data prenotazione", "numero notti",
+        "numero ospiti", "interi", "bambini", "giorno arrivo", "canale", "tariffa", "totale",
+        "categoria camera", "anticipo", "prenotante",
+    ]
+    random.seed(42)
+    for it in range(iterations):
+        columns = random.sample(all_columns, random.randint(3, len(all_columns)))
+        df = _random_frame(n, columns)
+        rows, t_rows = parse_and_segment(df, engine="rows")
+        cols, t_cols = parse_and_segment(df, engine="columns")
+        if repr(t_rows) != repr(t_cols) or not _same(rows, cols):
+            print(f"DIFFERENZA all'iterazione {it} (colonne: {columns})")
+            sys.exit(1)
+    print(f"OK: {iterations} file casuali da {n} righe, risultati identici.")
+    if not _check_timestamps():
+        sys.exit(1)
+    print("OK: notti e anticipo da date con orario come pd.to_datetime sul valore intero.")
+
+    # Tempi su un export "pulito" di grandi dimensioni
+    random.seed(1)
+    big = pd.DataFrame([
+        {
+            "cliente": f"C{i}",
+            "data arrivo": f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+            "numero notti": str(random.randint(1, 7)),
+            "numero ospiti": str(random.randint(1, 5)),
+            "canale": random.choice(CANALI[:6]),
+            "tariffa": f"{random.uniform(80, 350):.2f}",
+            "categoria camera": random.choice(CATEGORIE[:4]),
+            "anticipo": str(random.randint(0, 90)),
+            "prenotante": random.choice(PRENOTANTI[:5]),
+        }
+        for i in range(50_000)
+    ])
+    for engine in ("rows", "columns"):
+        t0 = time.perf_counter()
+        res, _ = parse_and_segment(big, engine=engine)
+        print(f"{engine:8s} {len(res):6d} righe in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Verifica che l'upload CSV in streaming (POST /api/upload) abbia memoria limitata: per ogni dimensione un processo
+nuovo carica un CSV generato su disco e misura il picco RSS oltre la memoria dopo l'avvio. Tolta la ColumnarAnalysis
+risultante (che cresce con le righe), il picco deve restare piatto tra il file piccolo e quello grande.
+Ingest in un solo processo (INGEST_WORKERS=1): i worker del pool non rientrano nell'RSS misurato.
+Esegui: python -m scripts.check_ingest_memory [righe] [fattore]
+"""
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+
+from scripts.bench_parallel_ingest import CANALI, CATEGORIE, PRENOTANTI
+
+_MB = 1 << 20
+_SLACK_MB = 48  # margine per allocatore e blocchi di lettura
+
+
+def _write_csv(path: str, n: int) -> None:
+    random.seed(1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("cliente,nome,data arrivo,numero notti,numero ospiti,canale,tariffa,categoria camera,anticipo,prenotante\n")
+        for i in range(n):
+            f.write(",".join([
+                f"C{i}",
+                f"Ospite {random.randint(1, 10**6)}",
+                f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+                str(random.randint(1, 7)),
+                str(random.randint(1, 5)),
+                random.choice(CANALI),
+                f"{random.uniform(80, 350):.2f}",
+                random.choice(CATEGORIE),
+                str(random.randint(0, 90)),
+                random.choice(PRENOTANTI),
+            ]) + "\n")
+
+
+def _peak_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux: KiB
+
+
+def _child(path: str) -> None:
+    """Nel processo figlio: upload del file con il client di test, stampa JSON con le misure."""
+    from app.main import _store, app
+
+    client = app.test_client()
+    base = _peak_rss()
+    with open(path, "rb") as f:
+        response = client.post("/api/upload", data={"file": (f, "arrivi.csv")}, content_type="multipart/form-data")
+    peak = _peak_rss()
+    if response.status_code != 200:
+        sys.exit(f"upload fallito: {response.status_code} {response.get_data(as_text=True)[:200]}")
+    body = response.get_json()
+    analysis = _store.get(body["analysis_id"])
+    print(json.dumps({"rows": len(analysis), "peak": peak - base, "analysis": analysis.nbytes}))
+
+
+def _measure(rows: int, tmpdir: str) -> dict:
+    path = os.path.join(tmpdir, f"arrivi_{rows}.csv")
+    _write_csv(path, rows)
+    env = {**os.environ, "ANALYSIS_STORE": "memory", "INGEST_WORKERS": "1"}
+    try:
+        out = subprocess.run(
+            [sys.executable, "-m", "scripts.check_ingest_memory", "--child", path],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    finally:
+        size = os.path.getsize(path)
+        os.remove(path)
+    result = json.loads(out.strip().splitlines()[-1])
+    result["file"] = size
+    result["overhead"] = result["peak"] - result["analysis"]
+    print(f"{result['rows']:9d} righe, file {size / _MB:7.1f} MB: picco +{result['peak'] / _MB:7.1f} MB, "
+          f"analisi {result['analysis'] / _MB:6.1f} MB, resto {result['overhead'] / _MB:6.1f} MB")
+    return result
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        _child(sys.argv[2])
+        return
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    factor = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with tempfile.TemporaryDirectory() as tmpdir:
+        small = _measure(rows, tmpdir)
+        large = _measure(rows * factor, tmpdir)
+    limit = small["overhead"] + _SLACK_MB * _MB
+    if large["overhead"] > limit:
+        sys.exit(f"KO: memoria oltre l'analisi cresce con il file ({large['overhead'] / _MB:.1f} MB "
+                 f"> {limit / _MB:.1f} MB)")
+    print(f"OK: memoria oltre l'analisi piatta ({factor}x righe, limite {limit / _MB:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Verifica i limiti di errore dello sketch spesa (app/sketch.py) rispetto a pandas:
+- sotto k valori: quantile identico a Series.quantile(0.75);
+- oltre: errore di rango normalizzato <= 2/k, anche fondendo sketch costruiti su blocchi/worker diversi;
+- media: errore relativo <= 1e-12 rispetto a Series.mean().
+Esegui: python -m scripts.check_spend_sketch [righe] [k]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.sketch import SpendStats
+
+
+def _distributions(n: int, rng: np.random.Generator) -> dict[str, np.ndarray]:
+    return {
+        "uniforme 80-350": rng.uniform(80, 350, n).round(2),
+        "lognormale": rng.lognormal(4.8, 0.5, n).round(2),
+        "tariffe discrete": rng.choice([89.0, 99.0, 120.0, 149.0, 199.0, 250.0], n),
+        "ordinata": np.sort(rng.uniform(50, 500, n)),
+        "con outlier": np.concatenate([rng.normal(150, 30, n - 50), rng.uniform(5000, 20000, 50)]),
+    }
+
+
+def _rank_error(values: np.ndarray, estimate: float, q: float) -> float:
+    """Distanza tra q e l'intervallo di ranghi normalizzati occupato dalla stima."""
+    s = np.sort(values)
+    lo = np.searchsorted(s, estimate, side="left") / len(s)
+    hi = np.searchsorted(s, estimate, side="right") / len(s)
+    return 0.0 if lo <= q <= hi else min(abs(lo - q), abs(hi - q))
+
+
+def _check(name: str, values: np.ndarray, k: int, parts: int) -> bool:
+    series = pd.Series(values)
+    exact_q = float(series.quantile(0.75))
+    exact_mean = float(series.mean())
+
+    t0 = time.perf_counter()
+    merged = SpendStats(k)
+    for chunk in np.array_split(values, parts):  # un sketch per "worker", poi fusione
+        part = SpendStats(k)
+        for block in np.array_split(chunk, 8):
+            part.update(block)
+        merged.merge(part)
+    q, mean = merged.result()
+    elapsed = time.perf_counter() - t0
+
+    rank_err = _rank_error(values, q, 0.75)
+    mean_err = abs(mean - exact_mean) / abs(exact_mean)
+    if merged.sketch.exact:
+        ok = q == exact_q and mean_err <= 1e-12
+    else:
+        ok = rank_err <= 2 / k and mean_err <= 1e-12
+    print(f"{'OK ' if ok else 'KO '} {name:18s} p75 {q:10.2f} (esatto {exact_q:10.2f}) "
+          f"errore rango {rank_err:.5f} (limite {2 / k:.5f}) errore media {mean_err:.1e} {elapsed:.2f}s")
+    return ok
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 8192
+    rng = np.random.default_rng(7)
+    ok = True
+    for size in (k // 2, n):
+        print(f"--- {size} valori, k={k}")
+        for name, values in _distributions(size, rng).items():
+            ok &= _check(name, values, k, parts=4)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()